@@ -5,9 +5,9 @@
 import os
 import streamlit as st
 import pandas as pd
-import concurrent.futures
+from datetime import datetime, time as dt_time, timezone
 from dotenv import load_dotenv
-from services import sheets, parser, ai_engine, export
+from services import sheets, project_store, jobs, ai_engine, export, humanizer
 
 load_dotenv()
 
@@ -79,8 +79,196 @@ if 'current_project_id' not in st.session_state:
     st.session_state.current_project_id = None
 if 'project_data' not in st.session_state:
     st.session_state.project_data = []
-if 'generation_active' not in st.session_state:
-    st.session_state.generation_active = False
+# Последнее известное содержимое таблицы - с ним сравниваем при сохранении
+if 'sheet_snapshot' not in st.session_state:
+    st.session_state.sheet_snapshot = []
+# Колонка Text грузится по требованию (длинные тексты тормозят загрузку)
+if 'text_loaded' not in st.session_state:
+    st.session_state.text_loaded = True
+# Фоновые задачи этой сессии: по их завершении перечитываем данные проекта
+if 'watched_jobs' not in st.session_state:
+    st.session_state.watched_jobs = set()
+
+def set_project_data(rows, text_loaded=True):
+    """Заменяет данные проекта и снимок таблицы (данные только что прочитаны/записаны)."""
+    st.session_state.project_data = rows
+    st.session_state.sheet_snapshot = [dict(row) for row in rows]
+    st.session_state.text_loaded = text_loaded
+
+def load_project_rows(sheet_id, refresh=False):
+    """
+    Загружает список проекта (без колонки Text) из локальной копии.
+    refresh=True - явная загрузка: копия сверяется с таблицей.
+    """
+    project_store.open_project(sheet_id, refresh=refresh)
+    data = project_store.get_project_data(sheet_id, columns=sheets.LIST_COLUMNS)
+    # Гарантируем наличие колонки "Выбрать" для всех строк
+    for row in data:
+        if "Выбрать" not in row:
+            row["Выбрать"] = False
+    return data
+
+def ensure_text_loaded(rows=None):
+    """
+    Догружает колонку Text в данные проекта и снимок, если ее еще нет,
+    и дописывает ее в rows (строки редактора, собранные без текстов).
+    Строки сопоставляются по Link: порядок в редакторе и в локальной копии
+    может расходиться (сортировка, фильтр, подтянутые из таблицы правки).
+    """
+    if st.session_state.text_loaded:
+        return
+    if st.session_state.current_project_id:
+        texts = {}
+        for row in project_store.get_project_data(st.session_state.current_project_id, columns=["Text"]):
+            texts.setdefault(row.get("Link"), row.get("Text") or "")
+        for row in st.session_state.project_data:
+            row.setdefault("Text", texts.get(row.get("Link"), ""))
+        for row in st.session_state.sheet_snapshot:
+            row["Text"] = texts.get(row.get("Link"), "")
+        st.session_state.text_loaded = True
+    loaded = {}
+    for row in st.session_state.project_data:
+        loaded.setdefault(row.get("Link"), row.get("Text", ""))
+    for row in rows or []:
+        value = row.get("Text")
+        if value is None or (isinstance(value, float) and pd.isna(value)) or value == "":
+            row["Text"] = loaded.get(row.get("Link"), "")
+
+def save_editor_data(rows):
+    """
+    Сохраняет строки редактора в локальную копию (в таблицу уйдет только разница
+    с последним известным состоянием). Возвращает сводку или None при ошибке.
+    """
+    if not st.session_state.text_loaded:
+        # Тексты не загружены - колонку Text не сравниваем, чтобы не затереть их
+        rows = [{k: v for k, v in row.items() if k != "Text"} for row in rows]
+    try:
+        summary = project_store.save_project_changes(
+            st.session_state.current_project_id,
+            st.session_state.sheet_snapshot,
+            rows,
+        )
+    except Exception as e: # pylint: disable=broad-exception-caught
+        st.error(f"Ошибка сохранения: {e}")
+        return None
+    # Только ПОСЛЕ успешного сохранения обновляем мастер-состояние
+    set_project_data(rows, text_loaded=st.session_state.text_loaded)
+    return summary
+
+# --- Фоновые задачи ---
+JOB_LABELS = {"crawl": "Сбор страниц", "meta": "Meta-описания", "text": "Тексты", "export": "Экспорт"}
+JOB_STATUS_LABELS = {
+    jobs.QUEUED: "⏳ в очереди",
+    jobs.RUNNING: "▶️ выполняется",
+    jobs.DONE: "✅ готово",
+    jobs.FAILED: "❌ ошибка",
+    jobs.CANCELLED: "⏹ остановлена",
+}
+STAGE_LABELS = {"draft": "черновик", "editor": "правка редактора"}
+
+def start_job(kind, params):
+    """Ставит задачу в очередь фоновых процессов и перезапускает скрипт, чтобы показать панель."""
+    job_id = jobs.submit(kind, params)
+    st.session_state.watched_jobs.add(job_id)
+    st.rerun()
+
+def resume_job(job_id):
+    if jobs.resume(job_id):
+        st.session_state.watched_jobs.add(job_id)
+
+# Как часто панель задач опрашивает таблицу задач (секунды)
+JOBS_POLL_ACTIVE = 0.5
+JOBS_POLL_IDLE = 5
+
+def has_active_job(*kinds):
+    """Есть ли у проекта незавершенная задача одного из типов."""
+    return any(
+        job["kind"] in kinds and job["status"] in jobs.ACTIVE_STATUSES
+        for job in jobs.list_jobs(st.session_state.current_project_id, limit=10)
+    )
+
+def job_summary(job):
+    result = job["result"] or {}
+    if job["kind"] == "crawl":
+        summary = f"Обработано: {result.get('scanned', 0)}, добавлено страниц: {result.get('added', 0)}"
+        if result.get("errors"):
+            summary += "\n\nНе удалось прочитать: " + "; ".join(result["errors"])
+        return summary
+    if job["kind"] == "export":
+        return f"Файл {result.get('format', '')}, строк: {result.get('rows', 0)}"
+    return f"Сгенерировано: {result.get('generated', 0)}, не удалось: {result.get('failed', 0)}"
+
+def render_jobs_panel(sheet_id):
+    """
+    Панель фоновых задач проекта: прогресс, живой вывод, отмена и возобновление.
+    Фрагмент опрашивает таблицу задач, не перезапуская страницу: часто, пока
+    задача идет (живой вывод текста), и редко, когда задач нет.
+    """
+    if any(job["status"] in jobs.ACTIVE_STATUSES for job in jobs.list_jobs(sheet_id, limit=5)):
+        _live_jobs_panel(sheet_id)
+    else:
+        _idle_jobs_panel(sheet_id)
+
+@st.fragment(run_every=JOBS_POLL_ACTIVE)
+def _live_jobs_panel(sheet_id):
+    _jobs_panel(sheet_id, live=True)
+
+@st.fragment(run_every=JOBS_POLL_IDLE)
+def _idle_jobs_panel(sheet_id):
+    _jobs_panel(sheet_id, live=False)
+
+def _jobs_panel(sheet_id, live):
+    recent = jobs.list_jobs(sheet_id, limit=5)
+    active = [job for job in recent if job["status"] in jobs.ACTIVE_STATUSES]
+    st.session_state.watched_jobs.update(job["id"] for job in active)
+    finished = [
+        job for job in recent
+        if job["id"] in st.session_state.watched_jobs and job["status"] not in jobs.ACTIVE_STATUSES
+    ]
+    if finished:
+        st.session_state.watched_jobs.difference_update(job["id"] for job in finished)
+        if any(job["kind"] != "export" for job in finished):
+            # Задача записала результаты в локальную копию - перечитываем проект целиком
+            set_project_data(load_project_rows(sheet_id), text_loaded=False)
+            st.rerun()
+    if bool(active) != live:
+        # Задача началась (например, через API) или закончилась - меняем частоту опроса
+        st.rerun()
+    if not recent:
+        return
+
+    with st.expander("⚙️ Фоновые задачи", expanded=bool(active)):
+        for job in recent:
+            st.markdown(
+                f"**{JOB_LABELS.get(job['kind'], job['kind'])}** — "
+                f"{JOB_STATUS_LABELS.get(job['status'], job['status'])}"
+            )
+            if job["status"] in jobs.ACTIVE_STATUSES:
+                if job["total"]:
+                    st.progress(min(job["done"] / job["total"], 1.0))
+                    st.caption(f"{job['done']} из {job['total']}: {job['message']}")
+                elif job["message"]:
+                    st.caption(job["message"])
+                partial = job["partial"]
+                if partial:
+                    st.markdown(
+                        f"*{partial['title']}* — {STAGE_LABELS.get(partial['stage'], partial['stage'])}\n\n"
+                        f"{partial['text']}"
+                    )
+                st.button(
+                    "Остановить", key=f"cancel_{job['id']}", disabled=bool(job["cancel_requested"]),
+                    on_click=jobs.cancel, args=(job["id"],),
+                )
+            elif job["status"] == jobs.DONE:
+                st.caption(job_summary(job))
+            else:
+                if job["error"]:
+                    st.caption(job["error"])
+                st.button(
+                    "Продолжить", key=f"resume_{job['id']}",
+                    help="Задача продолжится с места остановки",
+                    on_click=resume_job, args=(job["id"],),
+                )
 
 # Безопасность: Ключ API берется только из .env
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
@@ -106,13 +294,11 @@ with st.sidebar:
         sheet_id_input = st.text_input("ID Google Таблицы", help="Вставьте ID из URL таблицы")
         if st.button("Загрузить проект") and sheet_id_input:
             try:
-                data = sheets.get_project_data(sheet_id_input)
-                # Гарантируем наличие колонки "Выбрать" для всех строк
-                for row in data:
-                    if "Выбрать" not in row:
-                        row["Выбрать"] = False
-                st.session_state.project_data = data
+                # Таблицу могли изменить вручную - берем свежие заголовки
+                sheets.invalidate(sheet_id_input)
                 st.session_state.current_project_id = sheet_id_input
+                data = load_project_rows(sheet_id_input, refresh=True)
+                set_project_data(data, text_loaded=False)
                 st.success(f"Загружено строк: {len(data)}")
             except Exception as e: # pylint: disable=broad-exception-caught
                 st.error(f"Ошибка загрузки: {e}")
@@ -122,8 +308,9 @@ with st.sidebar:
         if st.button("Создать проект") and new_proj_name:
             try:
                 meta = sheets.create_project_sheet(new_proj_name)
+                project_store.open_project(meta['id'])
                 st.session_state.current_project_id = meta['id']
-                st.session_state.project_data = []
+                set_project_data([])
                 st.success(f"Проект создан! ID: {meta['id']}")
                 st.info(
                     "Убедитесь, что у сервисного аккаунта есть доступ к этой таблице "
@@ -136,10 +323,9 @@ with st.sidebar:
         if st.button("❌ Очистить таблицу проекта", type="secondary"):
             if st.session_state.current_project_id:
                 try:
-                    # Очищаем в Google Sheets
-                    sheets.replace_project_data(st.session_state.current_project_id, [])
-                    # Очищаем локально
-                    st.session_state.project_data = []
+                    # Очищаем локально, Google Sheets - фоном
+                    project_store.replace_project_data(st.session_state.current_project_id, [])
+                    set_project_data([])
                     st.success("Таблица проекта полностью очищена!")
                     st.rerun()
                 except Exception as e:
@@ -167,6 +353,33 @@ with st.sidebar:
         st.code("magic-seo@magic-seo-486911.iam.gserviceaccount.com")
         st.write("3. Вставьте ID таблицы в 'Выбрать существующий'.")
 
+    with st.expander("📊 Gemini: кэш и лимиты"):
+        stats = ai_engine.cache_stats()
+        if stats:
+            st.write(f"Попаданий: {stats['hits']} | Промахов: {stats['misses']}")
+            st.write(f"Объединено параллельных запросов: {stats['coalesced']}")
+            st.caption(f"Доля попаданий: {stats['hit_rate']:.0%}")
+        else:
+            st.caption("Кэш отключен (LLM_CACHE_ENABLED=0).")
+        limits = ai_engine.limiter_stats()
+        st.write(f"Параллельность: {limits['concurrency']} | Запросов: {limits['requests']}")
+        st.caption(f"Ответов 429/5xx: {limits['throttled']}")
+        for model_name, health in ai_engine.model_stats().items():
+            if not health["calls"]:
+                continue
+            state = "⛔ отключена" if health["open"] else "✅"
+            latency = f"{health['latency']:.1f} с" if health["latency"] is not None else "—"
+            st.caption(f"{model_name}: {state}, {latency}, ошибок {health['error_rate']:.0%}")
+
+    if st.session_state.current_project_id:
+        sync = project_store.sync_status(st.session_state.current_project_id)
+        if sync["error"]:
+            st.warning(f"Синхронизация с таблицей: ошибка, повторим позже ({sync['error']})")
+        elif sync["pending"]:
+            st.caption(f"🔄 Ожидают отправки в таблицу: {sync['pending']}")
+        else:
+            st.caption("✅ Таблица синхронизирована")
+
 # --- Рабочая область (Main Area) ---
 st.header("🛠 Рабочая область")
 
@@ -179,14 +392,30 @@ if st.session_state.current_project_id:
         )
     with col2:
         if st.button("🔄 Обновить данные"):
-            data = sheets.get_project_data(
-                st.session_state.current_project_id
+            # Перечитываем таблицу, только если она менялась с прошлой загрузки
+            data, changed = project_store.refresh_project_data(
+                st.session_state.current_project_id,
+                st.session_state.project_data,
+                columns=sheets.LIST_COLUMNS,
             )
-            for row in data:
-                if "Выбрать" not in row:
-                    row["Выбрать"] = False
-            st.session_state.project_data = data
-            st.rerun()
+            if changed:
+                for row in data:
+                    if "Выбрать" not in row:
+                        row["Выбрать"] = False
+                set_project_data(data, text_loaded=False)
+                st.rerun()
+            else:
+                st.toast("Таблица не менялась с последней загрузки")
+
+    render_jobs_panel(st.session_state.current_project_id)
+
+    show_texts = st.toggle(
+        "Показывать тексты (Text)",
+        value=st.session_state.text_loaded,
+        help="Длинные тексты не загружаются вместе со списком - включите, чтобы догрузить их из таблицы."
+    )
+    if show_texts:
+        ensure_text_loaded()
 
     st.subheader("📝 Данные проекта")
     st.info("💡 Подсказка: Чтобы удалить строку, выделите ее и нажмите кнопку 'Delete' на клавиатуре или используйте значок корзины внизу таблицы.")
@@ -227,19 +456,17 @@ if st.session_state.current_project_id:
                 # Если уже список (бывает при определенных конфигах streamlit)
                 data_to_save = edited_data
 
-            with st.spinner("Сохранение в Google Таблицы..."):
-                try:
-                    sheets.replace_project_data(
-                        st.session_state.current_project_id, data_to_save
+            with st.spinner("Сохранение..."):
+                # Сохраняем в локальную копию; в таблицу уйдет только разница
+                # с последним известным состоянием (фоновая синхронизация)
+                summary = save_editor_data(data_to_save)
+                if summary is not None:
+                    st.success(
+                        f"Изменения сохранены! Ожидают отправки в таблицу: {summary['pending']}"
                     )
-                    # Только ПОСЛЕ успешного сохранения в Sheets обновляем мастер-состояние
-                    st.session_state.project_data = data_to_save
-                    st.success("Изменения успешно сохранены!")
                     # Сбрасываем ключ редактора, чтобы он перечитал новые данные
                     # (Но в Streamlit это иногда не нужно, просто st.rerun() достаточно)
                     st.rerun()
-                except Exception as e: # pylint: disable=broad-exception-caught
-                    st.error(f"Ошибка сохранения: {e}")
 
     # --- Инспекция контента (Expanders) ---
     st.divider()
@@ -310,116 +537,66 @@ if st.session_state.current_project_id:
     if action == "Запуск парсера":
         st.info("Парсинг исходной страницы для поиска новых ссылок.")
         source_url = st.text_input("URL источника")
-        
-        # Инициализация флага остановки
-        if 'parsing_active' not in st.session_state:
-            st.session_state.parsing_active = False
-
-        col_start, col_stop = st.columns(2)
-        with col_start:
-            start_btn = st.button("Начать парсинг", disabled=st.session_state.parsing_active)
-        with col_stop:
-            stop_btn = st.button("Остановить", disabled=not st.session_state.parsing_active)
-
-        if stop_btn:
-            st.session_state.parsing_active = False
-            st.rerun()
+        crawl_mode = st.radio(
+            "Режим сбора", ["Одна страница", "Обход сайта", "Sitemap.xml"], horizontal=True
+        )
+        job_params = {"sheet_id": st.session_state.current_project_id, "source_url": source_url}
+        if crawl_mode == "Обход сайта":
+            col_depth, col_pages = st.columns(2)
+            with col_depth:
+                crawl_depth = st.number_input("Глубина обхода", min_value=1, max_value=10, value=2)
+            with col_pages:
+                crawl_max_pages = st.number_input(
+                    "Максимум страниц", min_value=10, max_value=100000, value=1000, step=100
+                )
+            include_patterns = st.text_area(
+                "Включать пути (шаблон на строку, напр. /catalog/*)", height=68
+            )
+            exclude_patterns = st.text_area(
+                "Исключать пути (шаблон на строку, напр. */page/*)", height=68
+            )
+            job_params.update(
+                mode="crawl",
+                max_depth=int(crawl_depth),
+                max_pages=int(crawl_max_pages),
+                include=[p.strip() for p in include_patterns.splitlines()],
+                exclude=[p.strip() for p in exclude_patterns.splitlines()],
+            )
+        else:
+            job_params["mode"] = "page"
+            if crawl_mode == "Sitemap.xml":
+                st.caption("Укажите адрес сайта (sitemap найдется через robots.txt) или прямую ссылку на sitemap.xml / .xml.gz.")
+                use_since = st.checkbox("Только страницы, измененные после даты (по lastmod)")
+                since_date = st.date_input("Дата", disabled=not use_since)
+                job_params["mode"] = "sitemap"
+                if use_since:
+                    job_params["modified_since"] = datetime.combine(
+                        since_date, dt_time.min, tzinfo=timezone.utc
+                    ).isoformat()
+            job_params["head_only"] = st.checkbox(
+                "Быстрый режим: читать только <head>",
+                help="Title и Description берутся из начала страницы, остальное не скачивается. "
+                     "Страницы не попадают в кэш, поэтому генерация текстов загрузит их заново."
+            )
 
-        if start_btn and source_url:
-            st.session_state.parsing_active = True
-            with st.spinner("Парсим структуру сайта..."):
-                res = parser.parse_source_page(source_url)
-                
-                if "error" in res:
-                    st.error(res["error"])
-                    st.session_state.parsing_active = False
-                else:
-                    links = res["links"]
-                    existing_links = {
-                        row.get("Link") for row in st.session_state.project_data
-                    }
-                    new_links = [l for l in links if l not in existing_links]
-                    
-                    if not new_links:
-                        st.warning("Новых ссылок не обнаружено.")
-                        st.session_state.parsing_active = False
-                    else:
-                        st.write(f"Найдено новых ссылок: {len(new_links)}. Начинаем сбор данных...")
-                        
-                        processed_rows = []
-                        progress_bar = st.progress(0)
-                        status_text = st.empty()
-                        
-                        batch_size = 25
-                        
-                        # Функция для обработки одной ссылки (для многопоточности)
-                        def fetch_meta_safe(link):
-                            # НЕЛЬЗЯ обращаться к st.session_state из дочернего потока
-                            return parser.fetch_page_metadata(link)
-
-                        # Используем ThreadPoolExecutor для ускорения (5 потоков для парсинга)
-                        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-                            future_to_link = {executor.submit(fetch_meta_safe, link): link for link in new_links}
-                            
-                            for i, future in enumerate(concurrent.futures.as_completed(future_to_link)):
-                                if not st.session_state.get('parsing_active', False):
-                                    executor.shutdown(wait=False, cancel_futures=True)
-                                    break
-                                
-                                link = future_to_link[future]
-                                try:
-                                    meta = future.result()
-                                    if meta:
-                                        meta["Выбрать"] = False
-                                        meta["Keywords"] = ""
-                                        meta["New Description"] = ""
-                                        meta["Text"] = ""
-                                        processed_rows.append(meta)
-                                except Exception as e:
-                                    st.warning(f"Ошибка при обработке {link}: {e}")
-                                
-                                percent = int((i + 1) / len(new_links) * 100)
-                                status_text.text(f"Обработано {i + 1} из {len(new_links)} ({percent}%): {link}")
-                                progress_bar.progress((i + 1) / len(new_links))
-
-                                # Сохранение в Sheets пачками
-                                if len(processed_rows) >= batch_size:
-                                    sheets.add_rows(st.session_state.current_project_id, processed_rows)
-                                    # Обновляем локальные данные
-                                    st.session_state.project_data.extend(processed_rows)
-                                    processed_rows = []
-
-                        # Сохраняем остаток
-                        if processed_rows:
-                            sheets.add_rows(st.session_state.current_project_id, processed_rows)
-                            st.session_state.project_data.extend(processed_rows)
-                        
-                        st.session_state.parsing_active = False
-                        st.success(f"Парсинг завершен! Добавлено страниц: {len(new_links)}")
-                        st.balloons()
-                        # Вместо st.rerun() сразу, даем пользователю увидеть результат
-                        if st.button("Обновить таблицу и продолжить"):
-                            st.rerun()
+        # Сбор идет в фоновом процессе: переживает перезапуск скрипта и закрытие вкладки
+        if st.button("Начать парсинг", disabled=has_active_job("crawl")) and source_url:
+            start_job("crawl", job_params)
 
     elif action == "Генерация Meta-описаний":
-        col_gen_start, col_gen_stop = st.columns(2)
-        with col_gen_start:
-            start_gen_btn = st.button("Запустить генерацию", disabled=st.session_state.generation_active)
-        with col_gen_stop:
-            stop_gen_btn = st.button("Остановить", disabled=not st.session_state.generation_active)
-
-        if stop_gen_btn:
-            st.session_state.generation_active = False
-            st.rerun()
-
-        if start_gen_btn:
-            st.session_state.generation_active = True
-            ai_engine.configure_gemini(GEMINI_API_KEY)
-            
+        meta_batch_size = int(st.number_input(
+            "Строк в одном запросе к Gemini",
+            min_value=1, max_value=50, value=ai_engine.META_BATCH_SIZE,
+            help="Несколько страниц упаковываются в один запрос. Описания неподходящей длины "
+                 "перегенерируются по одному."
+        ))
+
+        if st.button("Запустить генерацию", disabled=has_active_job("meta", "text")):
             data_to_process = edited_data.to_dict('records') if isinstance(edited_data, pd.DataFrame) else edited_data
             
             # Находим индексы строк для обработки
             target_indices = [i for i, r in enumerate(data_to_process) if check_if_selected(r)]
+            selected_mode = bool(target_indices)
             
             if not target_indices:
                 # Если ничего не выбрано - берем пустые
@@ -433,71 +610,37 @@ if st.session_state.current_project_id:
 
             if not target_indices:
                 st.warning("Нет строк для обработки. Выберите строки галочками или очистите ячейки 'New Description'.")
-                st.session_state.generation_active = False
-            else:
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-                updates_count = 0
-                
-                # Функция для генерации одной Meta
-                def process_meta_row(idx_row_tuple):
-                    idx, row = idx_row_tuple
-                    # НЕЛЬЗЯ обращаться к st.session_state из дочернего потока
-                    title = row.get("Title", "")
-                    kw = row.get("Keywords", "")
-                    old_desc = row.get("Description", "")
-                    new_text = ai_engine.generate_new_description(title, kw, old_desc)
-                    return idx, new_text
-
-                # Используем 3 потока для Meta (чтобы не превысить лимиты Gemini)
-                with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-                    indexed_rows = [(idx, data_to_process[idx]) for idx in target_indices]
-                    future_to_idx = {executor.submit(process_meta_row, item): item[0] for item in indexed_rows}
-                    
-                    for i, future in enumerate(concurrent.futures.as_completed(future_to_idx)):
-                        if not st.session_state.get('generation_active', False):
-                            executor.shutdown(wait=False, cancel_futures=True)
-                            break
-                        
-                        idx = future_to_idx[future]
-                        try:
-                            result = future.result()
-                            if result:
-                                _, new_text = result
-                                sheets.update_row(st.session_state.current_project_id, idx, {"New Description": new_text})
-                                data_to_process[idx]["New Description"] = new_text
-                                data_to_process[idx]["Выбрать"] = False
-                                updates_count += 1
-                        except Exception as e:
-                            st.warning(f"Ошибка в строке {idx + 1}: {e}")
-                        
-                        percent = int((i + 1) / len(target_indices) * 100)
-                        row_title = data_to_process[idx].get('Title', 'No Title')
-                        status_text.text(f"Генерация {i + 1} из {len(target_indices)} ({percent}%): {row_title}")
-                        progress_bar.progress((i + 1) / len(target_indices))
-
-                st.session_state.project_data = data_to_process
-                st.session_state.generation_active = False
-                st.success(f"Готово! Сгенерировано описаний: {updates_count}")
-                if st.button("Обновить данные"):
-                    st.rerun()
+            elif save_editor_data(data_to_process):
+                start_job("meta", {
+                    "sheet_id": st.session_state.current_project_id,
+                    "indices": target_indices,
+                    "batch_size": meta_batch_size,
+                    "selected": selected_mode,
+                })
 
     elif action == "Генерация текстов":
-        col_txt_start, col_txt_stop = st.columns(2)
-        with col_txt_start:
-            start_txt_btn = st.button("Запустить генерацию текстов", disabled=st.session_state.generation_active)
-        with col_txt_stop:
-            stop_txt_btn = st.button("Остановить", disabled=not st.session_state.generation_active)
-
-        if stop_txt_btn:
-            st.session_state.generation_active = False
-            st.rerun()
+        urgent_mode = st.checkbox(
+            "⚡ Срочный режим: параллельные черновики",
+            help="Несколько черновиков пишутся одновременно, критик выбирает лучший, "
+                 "редактор делает один проход. Быстрее, но расходует больше токенов."
+        )
+        speculative_drafts = 0
+        if urgent_mode:
+            speculative_drafts = int(st.slider("Черновиков на страницу", min_value=2, max_value=4, value=3))
+        # Свой словарь замен у каждого проекта: выбор хранится по id проекта
+        dictionary = st.selectbox(
+            "Словарь замен проекта",
+            [None] + humanizer.list_dictionaries(),
+            format_func=lambda name: "Стандартный" if name is None else name,
+            key=f"dictionary_{st.session_state.current_project_id}",
+            help="Файлы .json ({\"фраза\": \"замена\"}) или .tsv/.csv из папки словарей "
+                 f"({humanizer.DICTIONARIES_DIR}). Фразы добавляются к стандартному словарю Humanizer.",
+        )
 
-        if start_txt_btn:
-            st.session_state.generation_active = True
-            ai_engine.configure_gemini(GEMINI_API_KEY)
-            
+        if st.button("Запустить генерацию текстов", disabled=has_active_job("meta", "text")):
             data_to_process = edited_data.to_dict('records') if isinstance(edited_data, pd.DataFrame) else edited_data
+            # Пустые ячейки Text определяем по реальным текстам из таблицы
+            ensure_text_loaded(data_to_process)
             
             selected_indices = [i for i, r in enumerate(data_to_process) if is_row_selected(r)]
             
@@ -513,59 +656,14 @@ if st.session_state.current_project_id:
 
             if not target_indices:
                 st.warning("Нет строк для обработки. Выберите строки галочками или очистите ячейки 'Text'.")
-                st.session_state.generation_active = False
-            else:
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-                updates_count = 0
-                
-                # Функция для генерации одного текста (для многопоточности)
-                def process_text_row(idx_row_tuple):
-                    idx, row = idx_row_tuple
-                    # НЕЛЬЗЯ обращаться к st.session_state из дочернего потока
-                    page_text = parser.fetch_page_content(row.get("Link")) or "Контент недоступен"
-                    res = ai_engine.run_multi_agent_text_generation(
-                        title=row.get("Title"),
-                        link=row.get("Link"),
-                        keywords=row.get("Keywords"),
-                        _description=row.get("Description"),
-                        page_context=page_text,
-                        api_key=GEMINI_API_KEY
-                    )
-                    return idx, res
-
-                # Используем 2 потока для текстов (более тяжелая задача)
-                with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-                    indexed_rows = [(idx, data_to_process[idx]) for idx in target_indices]
-                    future_to_idx = {executor.submit(process_text_row, item): item[0] for item in indexed_rows}
-                    
-                    for i, future in enumerate(concurrent.futures.as_completed(future_to_idx)):
-                        if not st.session_state.get('generation_active', False):
-                            executor.shutdown(wait=False, cancel_futures=True)
-                            break
-                        
-                        idx = future_to_idx[future]
-                        try:
-                            result = future.result()
-                            if result:
-                                _, text_content = result
-                                sheets.update_row(st.session_state.current_project_id, idx, {"Text": text_content})
-                                data_to_process[idx]["Text"] = text_content
-                                data_to_process[idx]["Выбрать"] = False
-                                updates_count += 1
-                        except Exception as e:
-                            st.warning(f"Ошибка в строке {idx + 1}: {e}")
-
-                        percent = int((i + 1) / len(target_indices) * 100)
-                        row_title = data_to_process[idx].get('Title', 'No Title')
-                        status_text.text(f"Текст {i + 1} из {len(target_indices)} ({percent}%): {row_title}")
-                        progress_bar.progress((i + 1) / len(target_indices))
-                
-                st.session_state.project_data = data_to_process
-                st.session_state.generation_active = False
-                st.success(f"Готово! Сгенерировано текстов: {updates_count}")
-                if st.button("Применить"):
-                    st.rerun()
+            elif save_editor_data(data_to_process):
+                start_job("text", {
+                    "sheet_id": st.session_state.current_project_id,
+                    "indices": target_indices,
+                    "speculative_drafts": speculative_drafts,
+                    "selected": bool(selected_indices),
+                    "dictionary": dictionary,
+                })
 
     elif action == "Экспорт":
         # Экспорт всегда из мастер-данных или текущего буфера? 
@@ -573,16 +671,34 @@ if st.session_state.current_project_id:
         data_to_export = edited_data.to_dict('records') if isinstance(edited_data, pd.DataFrame) else edited_data
         
         if data_to_export:
-            xls_data = export.export_to_excel(data_to_export)
-            st.download_button(
-                "Скачать .xlsx",
-                xls_data,
-                "project.xlsx",
-                "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            export_format = st.selectbox(
+                "Формат", list(export.EXPORTERS), format_func=lambda f: export.EXPORTERS[f].label
             )
-
-            xml_data = export.export_to_xml(data_to_export)
-            st.download_button("Скачать .xml", xml_data, "project.xml", "text/xml")
+            exporter = export.EXPORTERS[export_format]
+            # Файл собирается только по кнопке; готовый файл того же содержимого
+            # берется из кэша, а на прочих перезапусках скрипта ничего не рендерится
+            prepared = st.session_state.get("export_file")
+            if st.button(f"Подготовить {exporter.label}"):
+                ensure_text_loaded(data_to_export)
+                with st.spinner("Формируем файл..."):
+                    prepared = {
+                        "project": st.session_state.current_project_id,
+                        "format": export_format,
+                        "data": export.cached_export(export_format, data_to_export),
+                    }
+                st.session_state.export_file = prepared
+            if (
+                prepared is not None
+                and prepared["project"] == st.session_state.current_project_id
+                and prepared["format"] == export_format
+            ):
+                st.download_button(
+                    f"Скачать {exporter.label}",
+                    prepared["data"],
+                    f"project.{exporter.extension}",
+                    exporter.media_type,
+                )
+                st.caption("Файл собран по данным на момент нажатия «Подготовить».")
         else:
             st.warning("Нет данных для экспорта")
 
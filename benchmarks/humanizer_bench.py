@@ -0,0 +1,122 @@
+"""
+Micro-benchmark: compiled Humanizer vs the old multi-pass humanize_text.
+
+Usage (from the repository root):
+    python -m benchmarks.humanizer_bench
+    python -m benchmarks.humanizer_bench --texts 2000 --extra 5000
+    python -m benchmarks.humanizer_bench --corpus texts.txt
+
+--corpus reads generated texts separated by lines with "---";
+without it a synthetic corpus in the style of the generator is used.
+--extra adds that many synthetic phrases to the replacement table to show
+how both versions scale with large per-project dictionaries.
+"""
+
+import argparse
+import random
+import re
+import time
+
+from services.humanizer import DEFAULT_REPLACEMENTS, Humanizer
+
+_SENTENCES = [
+    "Кроме того, круиз по Волге подарит незабываемые впечатления.",
+    "Теплоход **«Александр Пушкин»** заходит в самые живописные города.",
+    "Важно отметить, что в стоимость включено трехразовое питание.",
+    "Погрузитесь в мир русской истории во время экскурсий по кремлям.",
+    "Уникальная возможность увидеть **Кижи** с борта корабля.",
+    "Каюты оборудованы кондиционерами и собственным санузлом.",
+    "Более того,  на палубе   проходят вечерние концерты.",
+    "Маршрут подойдет и семьям с детьми, и тем, кто путешествует один.",
+    "Следовательно, бронировать места лучше заранее.",
+    "<b>Скидки</b> действуют для пенсионеров и `студентов`.",
+]
+_INTROS = ["", "", "", "Конечно, вот текст:\n", "## Речной круиз\n"]
+
+
+def legacy_humanize(text, replacements):
+    """The pre-compiled implementation: one re.sub per rule plus str.replace per phrase."""
+    text = re.sub(r'#+\s*', '', text)
+    text = re.sub(r'__', '', text)
+    text = re.sub(r'`', '', text)
+    text = re.sub(r'<[^>]*>', '', text)
+    text = re.sub(r"^(Конечно|Вот|Согласно вашему|Текст:|Статья:).*\n?", "", text, flags=re.IGNORECASE)
+    for old, new in replacements.items():
+        text = text.replace(old, new)
+    text = re.sub(r'[ \t]+', ' ', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    return text.strip()
+
+
+def synthetic_corpus(count, seed=42):
+    """Texts of ~1500 characters: 3-4 paragraphs with AI phrasing and markup."""
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        paragraphs = [
+            " ".join(rng.choice(_SENTENCES) for _ in range(rng.randint(3, 5)))
+            for _ in range(rng.randint(3, 4))
+        ]
+        texts.append(rng.choice(_INTROS) + "\n\n\n".join(paragraphs))
+    return texts
+
+
+def synthetic_replacements(count, seed=7):
+    """Distinct multi-word phrases that mostly do not occur in the corpus."""
+    rng = random.Random(seed)
+    words = ["отличный", "вариант", "путешествие", "маршрут", "сервис", "комфорт",
+             "незабываемый", "отдых", "программа", "экскурсия", "впечатление", "уровень"]
+    table = {}
+    while len(table) < count:
+        phrase = " ".join(rng.choice(words) for _ in range(rng.randint(2, 4)))
+        table[f"{phrase} {len(table)}"] = phrase
+    return table
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [t.strip() for t in re.split(r'(?m)^---\s*$', f.read()) if t.strip()]
+
+
+def bench(label, fn, texts, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for text in texts:
+            fn(text)
+        best = min(best, time.perf_counter() - started)
+    per_text = best / len(texts) * 1e6
+    print(f"{label:<28} {best * 1000:9.1f} ms  {per_text:8.1f} µs/текст")
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    arg_parser.add_argument("--texts", type=int, default=1000, help="размер синтетического корпуса")
+    arg_parser.add_argument("--corpus", help="файл с текстами, разделенными строкой ---")
+    arg_parser.add_argument("--extra", type=int, default=0, help="доп. фраз в словаре замен")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    texts = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.texts)
+    replacements = dict(DEFAULT_REPLACEMENTS)
+    replacements.update(synthetic_replacements(args.extra))
+
+    started = time.perf_counter()
+    humanizer = Humanizer(replacements)
+    compile_ms = (time.perf_counter() - started) * 1000
+
+    mismatches = sum(
+        humanizer.humanize(t) != legacy_humanize(t, replacements) for t in texts
+    )
+    print(f"Текстов: {len(texts)}, фраз в словаре: {len(replacements)}, "
+          f"компиляция: {compile_ms:.1f} ms, расхождений с legacy: {mismatches}")
+
+    legacy = bench("legacy (multi-pass)", lambda t: legacy_humanize(t, replacements),
+                   texts, args.repeat)
+    compiled = bench("compiled (single-pass)", humanizer.humanize, texts, args.repeat)
+    print(f"Ускорение: x{legacy / compiled:.1f}")
+
+
+if __name__ == "__main__":
+    main()
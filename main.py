@@ -1,10 +1,30 @@
 """
 Main API Entry Point
+Crawl, generation and export run as background jobs (services/jobs.py) in
+worker processes; the API only queues them, streams their progress over
+server-sent events and serves the export files.
 """
 
-from fastapi import FastAPI
+import asyncio
+import json
+import os
+from datetime import datetime
+from typing import List, Literal, Optional
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-# from services import sheets, parser, ai_engine
+from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, field_validator
+
+from services import export, humanizer, jobs
+
+load_dotenv()
+
+# Как часто поток событий опрашивает таблицу задач и шлет keep-alive
+EVENTS_POLL_INTERVAL = 0.5
+EVENTS_KEEPALIVE = 15.0
 
 app = FastAPI(title="Magic SEO Studio API")
 
@@ -16,9 +36,181 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+class CrawlJob(BaseModel):
+    """Collect pages from a source page, a site crawl or a sitemap."""
+    sheet_id: str
+    source_url: str
+    mode: Literal["page", "crawl", "sitemap"] = "page"
+    head_only: bool = False
+    max_depth: int = 2
+    max_pages: int = 1000
+    include: List[str] = []
+    exclude: List[str] = []
+    modified_since: Optional[datetime] = None
+
+
+class MetaJob(BaseModel):
+    """Generate meta descriptions; without indices - for rows where it is empty."""
+    sheet_id: str
+    indices: Optional[List[int]] = None
+    batch_size: Optional[int] = None
+
+
+class TextJob(BaseModel):
+    """Generate page texts; without indices - for rows where Text is empty."""
+    sheet_id: str
+    indices: Optional[List[int]] = None
+    speculative_drafts: int = 0
+    # Имя файла словаря замен из HUMANIZER_DICTIONARIES_DIR (не путь)
+    dictionary: Optional[str] = None
+
+    @field_validator("dictionary")
+    @classmethod
+    def _known_dictionary(cls, value):
+        if value is not None and value not in humanizer.list_dictionaries():
+            raise ValueError("Unknown dictionary; see GET /dictionaries")
+        return value
+
+
+class ExportJob(BaseModel):
+    """Export the project to a file."""
+    sheet_id: str
+    format: Literal["xlsx", "xml", "csv", "jsonl", "parquet"] = "xlsx"
+
+
+async def _submit(kind: str, body: BaseModel):
+    # mode="json": даты уходят в задачу строками ISO
+    params = body.model_dump(mode="json", exclude_none=True)
+    job_id = await run_in_threadpool(jobs.submit, kind, params)
+    return {"id": job_id, "status": jobs.QUEUED}
+
+
+async def _get_job_or_404(job_id: str):
+    job = await run_in_threadpool(jobs.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
 @app.get("/")
 def read_root():
     """Root endpoint to check API status."""
     return {"message": "Magic SEO Studio API is running"}
 
-# Include routers or logic here
+
+@app.get("/dictionaries")
+def list_dictionaries():
+    """Project dictionaries a text job may use (file names)."""
+    return humanizer.list_dictionaries()
+
+
+@app.post("/jobs/crawl", status_code=202)
+async def create_crawl_job(body: CrawlJob):
+    """Queues a crawl job."""
+    return await _submit("crawl", body)
+
+
+@app.post("/jobs/meta", status_code=202)
+async def create_meta_job(body: MetaJob):
+    """Queues a meta description job."""
+    return await _submit("meta", body)
+
+
+@app.post("/jobs/text", status_code=202)
+async def create_text_job(body: TextJob):
+    """Queues a text generation job."""
+    return await _submit("text", body)
+
+
+@app.post("/jobs/export", status_code=202)
+async def create_export_job(body: ExportJob):
+    """Queues an export job; download the file from /jobs/{id}/result."""
+    return await _submit("export", body)
+
+
+@app.get("/jobs")
+async def list_jobs(sheet_id: Optional[str] = None, limit: int = 20):
+    """Most recent jobs, optionally for one project."""
+    return await run_in_threadpool(jobs.list_jobs, sheet_id, limit)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Job state: status, progress, partial output, result or error."""
+    return await _get_job_or_404(job_id)
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """
+    Server-sent events: "progress" whenever the job state changes and a
+    final "end" event once it is done, failed or cancelled.
+    """
+    await _get_job_or_404(job_id)
+
+    async def _events():
+        last = None
+        last_sent = asyncio.get_running_loop().time()
+        while not await request.is_disconnected():
+            job = await run_in_threadpool(jobs.get_job, job_id)
+            if job is None:
+                return
+            state = {
+                key: job[key]
+                for key in ("id", "status", "done", "total", "message", "partial", "result", "error")
+            }
+            now = asyncio.get_running_loop().time()
+            if state != last:
+                last, last_sent = state, now
+                finished = job["status"] not in jobs.ACTIVE_STATUSES
+                event = "end" if finished else "progress"
+                yield f"event: {event}\ndata: {json.dumps(state, ensure_ascii=False)}\n\n"
+                if finished:
+                    return
+            elif now - last_sent >= EVENTS_KEEPALIVE:
+                # Комментарий SSE не дает прокси закрыть молчащее соединение
+                last_sent = now
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(EVENTS_POLL_INTERVAL)
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Cancels a queued or running job."""
+    await _get_job_or_404(job_id)
+    if not await run_in_threadpool(jobs.cancel, job_id):
+        raise HTTPException(status_code=409, detail="Job is not running")
+    return await _get_job_or_404(job_id)
+
+
+@app.post("/jobs/{job_id}/resume")
+async def resume_job(job_id: str):
+    """Re-queues a failed or cancelled job; it continues from its checkpoint."""
+    await _get_job_or_404(job_id)
+    if not await run_in_threadpool(jobs.resume, job_id):
+        raise HTTPException(status_code=409, detail="Only failed or cancelled jobs can be resumed")
+    return await _get_job_or_404(job_id)
+
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    """Downloads the file produced by a finished export job."""
+    job = await _get_job_or_404(job_id)
+    if job["kind"] != "export":
+        raise HTTPException(status_code=400, detail="Only export jobs produce a file")
+    if job["status"] != jobs.DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    path = job["result"]["path"]
+    if not os.path.exists(path):
+        raise HTTPException(status_code=410, detail="Export file is no longer available")
+    exporter = export.get_exporter(job["result"]["format"])
+    return FileResponse(
+        path, media_type=exporter.media_type, filename=f"project.{exporter.extension}"
+    )
@@ -3,77 +3,178 @@ AI Engine Service
 Handles interactions with Google Gemini API for text generation.
 """
 
+import asyncio
+import json
+import logging
+import os
 import re
 import random
-import google.generativeai as genai
+import time
+from google.api_core import exceptions as google_exceptions
+
+from services import aio, humanizer, llm_cache, model_registry, rate_limiter, text_quality
+
+logger = logging.getLogger(__name__)
+
+# Верхняя граница потоков для генерации; реальную параллельность держит лимитер
+MAX_CONCURRENCY = rate_limiter.GEMINI_MAX_CONCURRENCY
+# Примерный объем ответа для учета токенов в лимитере
+_EXPECTED_OUTPUT_TOKENS = 600
+
+class GenerationError(Exception):
+    """Raised when Gemini could not produce content. Never written into the sheet."""
+
+# Допустимая длина meta description
+META_MIN_CHARS = 140
+META_MAX_CHARS = 160
+# Сколько строк упаковывать в один запрос пакетной генерации
+META_BATCH_SIZE = int(os.getenv("META_BATCH_SIZE", "20"))
 
 def configure_gemini(api_key):
-    """Configures the Gemini API with the provided key."""
-    genai.configure(api_key=api_key)
+    """
+    Configures the Gemini API with the provided key.
+    Cheap to call repeatedly: the SDK is reconfigured only when the key changes.
+    """
+    model_registry.get_registry().configure(api_key)
 
-def humanize_text(text):
+def humanize_text(text, replacements_path=None):
     """
     Advanced Humanizer Pipeline.
     Strips AI patterns, markdown, and formatting garbage.
+    replacements_path: extra (per-project) replacement dictionary.
     """
-    # 1. Жесткая очистка от технического Markdown (кроме жирного шрифта) и HTML
-    text = re.sub(r'#+\s*', '', text)   # Заголовки (обычно не нужны в ячейке)
-    # text = re.sub(r'\*\*', '', text)    # Жирный шрифт - ТЕПЕРЬ ОСТАВЛЯЕМ
-    text = re.sub(r'__', '', text)      # Курсив
-    text = re.sub(r'`', '', text)       # Код
-    text = re.sub(r'<[^>]*>', '', text) # HTML-теги
-
-    # 2. Удаление типичных вступлений AI
-    text = re.sub(r"^(Конечно|Вот|Согласно вашему|Текст:|Статья:).*\n?", "", text, flags=re.IGNORECASE)
-    
-    # 3. Замена "AI-лексики" на человеческую (русский вариант)
-    replacements = {
-        "Кроме того,": "А еще,",
-        "Более того,": "Также,",
-        "В заключение,": "В общем,",
-        "Следовательно,": "Так что,",
-        "Важно отметить, что": "",
-        "Стоит подчеркнуть, что": "",
-        "Является идеальным выбором": "Отлично подойдет",
-        "Предлагает широкий спектр": "Тут есть всё:",
-        "Уникальная возможность": "Шанс",
-        "Погрузитесь в мир": "Попробуйте",
-    }
-    for old, new in replacements.items():
-        text = text.replace(old, new)
-
-    # 4. Финальная чистка лишних пробелов, но сохранение ДВОЙНЫХ переносов для абзацев
-    text = re.sub(r'[ \t]+', ' ', text) # Схлопываем лишние пробелы в строке
-    text = re.sub(r'\n{3,}', '\n\n', text) # Максимум 2 переноса строки
-    
-    return text.strip()
-
-def _get_model():
-    """Returns a working GenerativeModel instance with fallback logic based on diagnostics."""
-    models_to_try = [
-        'gemini-flash-latest', 
-        'gemini-pro-latest', 
-        'gemini-1.5-flash', 
-        'gemini-pro'
-    ]
-    last_err = None
-    for model_name in models_to_try:
-        try:
-            model = genai.GenerativeModel(model_name)
-            # Simple test call is expensive, so we just return the model and handle errors later
-            return model
-        except Exception as e:
-            last_err = e
-            continue
-    raise last_err or Exception("No working Gemini model found")
+    return humanizer.humanize_text(text, replacements_path)
 
-def generate_new_description(title, keywords, old_description, _content_context=""):
+def _is_model_failure(exc):
+    """API-side errors count against model health; content errors (blocked answer) do not."""
+    return isinstance(exc, google_exceptions.GoogleAPIError) or rate_limiter.is_retryable(exc)
+
+def _call_model(name, prompt, params):
+    """One request to one model under the rate limiter, reported to the registry."""
+    registry = model_registry.get_registry()
+    model = registry.get_model(name)
+
+    def _request():
+        response = model.generate_content(prompt, generation_config=params or None)
+        return response.text
+
+    tokens = rate_limiter.estimate_tokens(prompt) + _EXPECTED_OUTPUT_TOKENS
+    started = time.monotonic()
+    try:
+        text = rate_limiter.get_limiter().call(_request, tokens)
+    except Exception as e:
+        if _is_model_failure(e):
+            registry.record_failure(name)
+        raise
+    registry.record_success(name, time.monotonic() - started)
+    return text
+
+async def _acall_model(name, prompt, params, on_partial=None):
     """
-    Module 2: Generate New Description without AI pattern, specific length constraints.
+    Async counterpart of _call_model() on generate_content_async.
+    With on_partial the response is streamed and on_partial(text_so_far) is
+    called for every chunk; a retried call starts the partial text over.
     """
+    registry = model_registry.get_registry()
+    model = registry.get_model(name)
+
+    async def _request():
+        if on_partial is None:
+            response = await model.generate_content_async(prompt, generation_config=params or None)
+            return response.text
+        response = await model.generate_content_async(
+            prompt, generation_config=params or None, stream=True
+        )
+        parts = []
+        async for chunk in response:
+            try:
+                parts.append(chunk.text)
+            except ValueError:
+                # Служебный чанк без текста (finish_reason и т.п.)
+                continue
+            on_partial("".join(parts))
+        return "".join(parts)
+
+    tokens = rate_limiter.estimate_tokens(prompt) + _EXPECTED_OUTPUT_TOKENS
+    started = time.monotonic()
     try:
-        model = _get_model()
-        prompt = f"""
+        text = await rate_limiter.get_limiter().acall(_request, tokens)
+    except Exception as e:
+        if _is_model_failure(e):
+            registry.record_failure(name)
+        raise
+    registry.record_success(name, time.monotonic() - started)
+    return text
+
+def _generate(prompt, **params):
+    """
+    Runs a prompt on the healthiest model and returns the raw text.
+    Goes through the response cache (a cached answer from any model is reused)
+    and falls back to the next model in the registry when a call fails.
+    """
+    names = model_registry.get_registry().candidates()
+    cache = llm_cache.get_cache()
+    if cache is not None:
+        cached = cache.get_any(llm_cache.make_key(name, prompt, params) for name in names)
+        if cached is not None:
+            return cached
+
+    last_error = None
+    for name in names:
+        try:
+            if cache is None:
+                return _call_model(name, prompt, params)
+            return cache.get_or_compute(
+                llm_cache.make_key(name, prompt, params), name,
+                lambda name=name: _call_model(name, prompt, params),
+            )
+        except Exception as e: # pylint: disable=broad-exception-caught
+            last_error = e
+    raise last_error or GenerationError("No working Gemini model found")
+
+async def _agenerate(prompt, on_partial=None, **params):
+    """
+    Async counterpart of _generate().
+    on_partial(text_so_far) receives the answer while it streams in; a cached
+    answer is reported once in full.
+    """
+    names = model_registry.get_registry().candidates()
+    cache = llm_cache.get_cache()
+    if cache is not None:
+        cached = await cache.aget_any(llm_cache.make_key(name, prompt, params) for name in names)
+        if cached is not None:
+            if on_partial is not None:
+                on_partial(cached)
+            return cached
+
+    last_error = None
+    for name in names:
+        try:
+            if cache is None:
+                return await _acall_model(name, prompt, params, on_partial)
+            return await cache.aget_or_compute(
+                llm_cache.make_key(name, prompt, params), name,
+                lambda name=name: _acall_model(name, prompt, params, on_partial),
+            )
+        except Exception as e: # pylint: disable=broad-exception-caught
+            last_error = e
+    raise last_error or GenerationError("No working Gemini model found")
+
+def cache_stats():
+    """Hit/miss counters of the response cache (empty if disabled)."""
+    cache = llm_cache.get_cache()
+    return cache.stats() if cache is not None else {}
+
+def limiter_stats():
+    """Current concurrency window and throttling counters of the Gemini limiter."""
+    return rate_limiter.get_limiter().stats()
+
+def model_stats():
+    """Per-model latency, error rate and breaker state."""
+    return model_registry.get_registry().stats()
+
+def _description_prompt(title, keywords, old_description):
+    return f"""
     Act as an SEO expert. Write a meta description (Russian language).
     Target:
     - [Keyword phrase near start] + [Specific benefit/diff] + [Call to action]
@@ -85,30 +186,115 @@ def generate_new_description(title, keywords, old_description, _content_context=
 
     Output ONLY the description. No quotes.
     """
-        response = model.generate_content(prompt)
-        text = response.text.strip()
-        if len(text) > 160:
-            text = text[:157] + "..."
-        return text
+
+def _finalize_description(text):
+    text = text.strip()
+    if len(text) > 160:
+        text = text[:157] + "..."
+    if not text:
+        raise ValueError("empty response")
+    return text
+
+def generate_new_description(title, keywords, old_description, _content_context=""):
+    """
+    Module 2: Generate New Description without AI pattern, specific length constraints.
+    Raises GenerationError on failure.
+    """
+    try:
+        prompt = _description_prompt(title, keywords, old_description)
+        return _finalize_description(_generate(prompt))
     except Exception as e: # pylint: disable=broad-exception-caught
-        return f"Error: {str(e)}"
+        raise GenerationError(f"Meta description failed: {e}") from e
 
-# pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
-def run_multi_agent_text_generation(title, link, keywords, _description, page_context, api_key):
+async def agenerate_new_description(title, keywords, old_description, _content_context=""):
+    """Async version of generate_new_description()."""
+    try:
+        prompt = _description_prompt(title, keywords, old_description)
+        return _finalize_description(await _agenerate(prompt))
+    except Exception as e: # pylint: disable=broad-exception-caught
+        raise GenerationError(f"Meta description failed: {e}") from e
+
+def _strip_code_fence(text):
+    return re.sub(r'^```(?:json)?\s*|\s*```$', '', text.strip())
+
+def _parse_json_array(text):
+    """Parses a JSON array from a model answer, tolerating code fences and wrappers."""
+    data = json.loads(_strip_code_fence(text))
+    if isinstance(data, dict):
+        # Иногда модель заворачивает массив в объект: {"items": [...]}
+        data = next((v for v in data.values() if isinstance(v, list)), [])
+    return data if isinstance(data, list) else []
+
+def generate_descriptions_batch(items):
     """
-    Module 3: Multi-Agent System (Strict Implementation).
+    Batched Module 2: one Gemini request for many pages.
+    items: list of dicts {"id", "title", "keywords", "description"}.
+    Returns {id: new_description}. Items whose answer is missing or outside
+    META_MIN_CHARS..META_MAX_CHARS are retried one by one with
+    generate_new_description; items that still fail are left out of the result.
     """
-    configure_gemini(api_key)
+    pages = [
+        {
+            "id": str(item["id"]),
+            "title": item.get("title", ""),
+            "keywords": item.get("keywords", ""),
+            "old_description": item.get("description", ""),
+        }
+        for item in items
+    ]
+    prompt = f"""
+    Act as an SEO expert. Write a meta description (Russian language) for EACH page below.
+    Target:
+    - [Keyword phrase near start] + [Specific benefit/diff] + [Call to action]
+    Constraints:
+    - Length: 140-155 characters (strict) for every description.
+    - Use the page's keywords.
+    - Base on context from the page's title and old_description.
+    - Tone: Natural, no spam. No quotes.
+
+    PAGES (JSON):
+    {json.dumps(pages, ensure_ascii=False, indent=1)}
+
+    Output ONLY a JSON array with one object per page, keeping the ids:
+    [{{"id": "<id>", "description": "<meta description>"}}]
+    """
+
+    answers = {}
     try:
-        model = _get_model()
-        
-        # --- 1. Агент-копирайтер (генерация черновика) ---
-        prompt_a = f"""
+        raw = _generate(prompt, response_mime_type="application/json")
+        for entry in _parse_json_array(raw):
+            if isinstance(entry, dict) and "id" in entry:
+                answers[str(entry["id"])] = str(entry.get("description", "")).strip()
+    except Exception as e: # pylint: disable=broad-exception-caught
+        logger.warning("Batch description request failed, retrying items one by one: %s", e)
+
+    results = {}
+    for item in items:
+        text = answers.get(str(item["id"]), "")
+        if not META_MIN_CHARS <= len(text) <= META_MAX_CHARS:
+            try:
+                text = generate_new_description(
+                    item.get("title", ""), item.get("keywords", ""), item.get("description", "")
+                )
+            except GenerationError as e:
+                logger.warning("Description for row %s failed: %s", item['id'], e)
+                continue
+        results[item["id"]] = text
+    return results
+
+# Максимум итераций Критик -> Редактор
+MAX_REVIEW_ITERATIONS = 3
+# Сколько страниц одновременно ведет асинхронный конвейер
+TEXT_PIPELINE_CONCURRENCY = int(os.getenv("TEXT_PIPELINE_CONCURRENCY", "200"))
+
+def _draft_prompt(title, link, keywords, description, page_context):
+    """Агент-копирайтер (генерация черновика)."""
+    return f"""
         ROLE: Архетип: "Свой парень". Популярный автор travel-текстов, эксперт по круизам.
         TASK: Напиши текст для страницы сайта: {title} ({link}).
         CONTEXT:
         - Ключевые слова: {keywords}
-        - Description: {_description}
+        - Description: {description}
         - Смысловой контекст страницы: {page_context[:2000]}
         
         STYLE & MISSION:
@@ -127,19 +313,15 @@ def run_multi_agent_text_generation(title, link, keywords, _description, page_co
         
         Выдай только текст.
         """
-        draft_response = model.generate_content(prompt_a)
-        current_text = draft_response.text.strip()
-        
-        # --- Цикл доработки (Агент-Критик + Агент-Редактор) ---
-        max_iterations = 3
-        for i in range(max_iterations):
-            # 2. Агент-критик (оценка)
-            prompt_b = f"""
+
+def _critic_prompt(text, keywords):
+    """Агент-критик (оценка)."""
+    return f"""
             ROLE: Строгий Критик/Редактор.
             TASK: Оцени текст по 10-балльной шкале.
             
             TEXT:
-            {current_text}
+            {text}
             
             METRICS (1-10):
             1) Google SEO-friendly (учет ключевых слов: {keywords})
@@ -147,27 +329,19 @@ def run_multi_agent_text_generation(title, link, keywords, _description, page_co
             3) Качество написания (ритм, отсутствие "воды")
             4) Humanize (отсутствие признаков AI, естественность)
             
-            OUTPUT FORMAT:
-            SCORES: [S1, S2, S3, S4]
-            FEEDBACK: [Список конкретных замечаний для исправления]
+            OUTPUT FORMAT (JSON):
+            {{"scores": {{"seo": S1, "originality": S2, "quality": S3, "humanize": S4}},
+              "feedback": ["конкретное замечание для исправления", "..."]}}
             """
-            critic_response = model.generate_content(prompt_b)
-            feedback = critic_response.text
-            
-            # Парсим оценки (упрощенно)
-            scores = re.findall(r'\b([0-9]|10)\b', feedback)
-            is_perfect = all(int(s) >= 9 for s in scores[:4]) if len(scores) >= 4 else False
-            
-            if is_perfect:
-                break
-                
-            # 3. Агент-редактор (исправление)
-            prompt_c = f"""
+
+def _editor_prompt(text, feedback):
+    """Агент-редактор (исправление)."""
+    return f"""
             ROLE: Экспертный Редактор.
             TASK: Исправь текст на основе замечаний Критика, чтобы по ВСЕМ пунктам стало 10/10.
             
             ORIGINAL TEXT:
-            {current_text}
+            {text}
             
             CRITIC FEEDBACK:
             {feedback}
@@ -181,18 +355,313 @@ def run_multi_agent_text_generation(title, link, keywords, _description, page_co
             
             Выдай только финальный отшлифованный текст.
             """
-            editor_response = model.generate_content(prompt_c)
-            current_text = editor_response.text.strip()
 
-        # --- Финальная очистка (Humanizer Pipeline) ---
-        # 1. Regex очистка от технического мусора (оставляем только нужное)
-        current_text = re.sub(r'<[^>]*>', '', current_text) # HTML
-        current_text = re.sub(r'#+\s*', '', current_text)   # Headers
-        
-        # 2. Humanizer post-process
-        current_text = humanize_text(current_text)
+_SCORE_KEYS = ("seo", "originality", "quality", "humanize")
+
+def _parse_critique(raw):
+    """
+    Parses the critic answer into {"scores": [4 ints], "feedback": [str]}.
+    Expects JSON; falls back to the legacy "SCORES: [..]" line.
+    """
+    try:
+        data = json.loads(_strip_code_fence(raw))
+        scores = data.get("scores", {})
+        if isinstance(scores, dict):
+            scores = [scores.get(k) for k in _SCORE_KEYS]
+        feedback = data.get("feedback", [])
+        if isinstance(feedback, str):
+            feedback = [feedback]
+        return {
+            "scores": [int(s) for s in scores if isinstance(s, (int, float))],
+            "feedback": [str(f) for f in feedback if str(f).strip()],
+        }
+    except (ValueError, AttributeError, TypeError):
+        match = re.search(r'SCORES:\s*\[([^\]]*)\]', raw)
+        scores = [int(s) for s in re.findall(r'\d+', match.group(1))] if match else []
+        return {"scores": scores, "feedback": [raw.strip()]}
+
+def _is_perfect(scores):
+    return len(scores) == len(_SCORE_KEYS) and all(s >= 9 for s in scores)
+
+def _review_feedback(local, critique):
+    """Замечания для редактора: локальные проверки + отзыв критика (если был)."""
+    lines = list(local["issues"])
+    if critique:
+        lines.extend(critique["feedback"])
+    return "\n".join(f"- {line}" for line in lines)
+
+def _finalize_text(text, replacements_path=None):
+    """Финальная очистка (Humanizer Pipeline) со словарем проекта, если он задан."""
+    text = humanize_text(text, replacements_path)
+    if not text:
+        raise ValueError("empty response")
+    return text
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+def run_multi_agent_text_generation(title, link, keywords, _description, page_context, api_key,
+                                    replacements_path=None):
+    """
+    Module 3: Multi-Agent System (Strict Implementation).
+    Each review round first runs the local text_quality checks; a text that
+    passes them is accepted without calling the LLM critic.
+    replacements_path: project replacement dictionary for the final humanizer pass.
+    Raises GenerationError on failure.
+    """
+    configure_gemini(api_key)
+    try:
+        # --- 1. Агент-копирайтер (генерация черновика) ---
+        prompt_a = _draft_prompt(title, link, keywords, _description, page_context)
+        current_text = _generate(prompt_a).strip()
         
-        return current_text
+        # --- Цикл доработки (Агент-Критик + Агент-Редактор) ---
+        critic_satisfied = False
+        for _ in range(MAX_REVIEW_ITERATIONS):
+            # Локальная проверка: если текст уже соответствует ТЗ, критик не нужен
+            local = text_quality.score_text(current_text, keywords)
+            if local["passed"]:
+                break
+            critique = None
+            if not critic_satisfied:
+                critique = _parse_critique(_generate(
+                    _critic_prompt(current_text, keywords), response_mime_type="application/json"
+                ))
+                critic_satisfied = _is_perfect(critique["scores"])
+            feedback = _review_feedback(local, critique)
+            current_text = _generate(_editor_prompt(current_text, feedback)).strip()
+
+        return _finalize_text(current_text, replacements_path)
+
+    except Exception as e:
+        raise GenerationError(f"Multi-Agent Gen failed: {e}") from e
+
+def _stage_callback(on_partial, stage):
+    """Binds a stage name to an on_partial(stage, text) callback (None stays None)."""
+    if on_partial is None:
+        return None
+    return lambda text: on_partial(stage, text)
+
+async def arun_multi_agent_text_generation(title, link, keywords, _description, page_context,
+                                           api_key=None, on_partial=None, replacements_path=None):
+    """
+    Async version of run_multi_agent_text_generation() on generate_content_async.
+    Many pages can run their chains concurrently on one event loop.
+    on_partial(stage, text) receives the draft and editor answers while they
+    stream in (stage is "draft" or "editor").
+    Raises GenerationError on failure.
+    """
+    if api_key:
+        configure_gemini(api_key)
+    try:
+        prompt_a = _draft_prompt(title, link, keywords, _description, page_context)
+        current_text = (await _agenerate(
+            prompt_a, on_partial=_stage_callback(on_partial, "draft")
+        )).strip()
+
+        critic_satisfied = False
+        for _ in range(MAX_REVIEW_ITERATIONS):
+            local = text_quality.score_text(current_text, keywords)
+            if local["passed"]:
+                break
+            critique = None
+            if not critic_satisfied:
+                critique = _parse_critique(await _agenerate(
+                    _critic_prompt(current_text, keywords), response_mime_type="application/json"
+                ))
+                critic_satisfied = _is_perfect(critique["scores"])
+            feedback = _review_feedback(local, critique)
+            current_text = (await _agenerate(
+                _editor_prompt(current_text, feedback),
+                on_partial=_stage_callback(on_partial, "editor"),
+            )).strip()
+
+        return _finalize_text(current_text, replacements_path)
+
+    except Exception as e:
+        raise GenerationError(f"Multi-Agent Gen failed: {e}") from e
+
+# Варианты черновиков для спекулятивного режима: (температура, стилевой акцент)
+SPECULATIVE_VARIANTS = [
+    (0.7, ""),
+    (1.0, "Сделай акцент на эмоциях и впечатлениях от путешествия."),
+    (0.9, "Сделай акцент на практической пользе и конкретных деталях маршрута."),
+    (1.2, "Начни с неожиданной детали или вопроса к читателю."),
+]
+
+def _ranking_prompt(drafts, keywords):
+    """Агент-критик для спекулятивного режима: выбирает лучший из черновиков."""
+    numbered = "\n\n".join(f"DRAFT {i}:\n{text}" for i, text in enumerate(drafts))
+    return f"""
+            ROLE: Строгий Критик/Редактор.
+            TASK: Сравни черновики и выбери лучший по метрикам:
+            1) Google SEO-friendly (учет ключевых слов: {keywords})
+            2) Оригинальность (индивидуальность стиля)
+            3) Качество написания (ритм, отсутствие "воды")
+            4) Humanize (отсутствие признаков AI, естественность)
+            
+            {numbered}
+            
+            OUTPUT FORMAT (JSON):
+            {{"best": <номер лучшего черновика>,
+              "feedback": ["конкретное замечание к лучшему черновику", "..."]}}
+            """
+
+def _parse_ranking(raw, count):
+    """Returns (best_index, feedback lines); defaults to the first draft."""
+    try:
+        data = json.loads(_strip_code_fence(raw))
+        best = int(data.get("best", 0))
+        feedback = data.get("feedback", [])
+        if isinstance(feedback, str):
+            feedback = [feedback]
+        feedback = [str(f) for f in feedback if str(f).strip()]
+    except (ValueError, AttributeError, TypeError):
+        best, feedback = 0, []
+    return (best if 0 <= best < count else 0), feedback
+
+async def arun_speculative_text_generation(title, link, keywords, _description, page_context,
+                                           drafts=3, api_key=None, on_partial=None,
+                                           replacements_path=None):
+    """
+    Low-latency variant of the multi-agent chain for urgent pages.
+    Generates `drafts` drafts concurrently with different temperatures and
+    styles, lets one critic call pick the best, then runs a single editor pass
+    on the winner. Critical path: 3 round trips instead of up to 7.
+    on_partial(stage, text) receives the winning draft and the editor pass.
+    Raises GenerationError on failure.
+    """
+    if api_key:
+        configure_gemini(api_key)
+    try:
+        base_prompt = _draft_prompt(title, link, keywords, _description, page_context)
+        variants = [SPECULATIVE_VARIANTS[i % len(SPECULATIVE_VARIANTS)] for i in range(drafts)]
+        answers = await asyncio.gather(
+            *(
+                _agenerate(f"{base_prompt}\n        STYLE HINT: {hint}\n" if hint else base_prompt,
+                           temperature=temperature)
+                for temperature, hint in variants
+            ),
+            return_exceptions=True,
+        )
+        candidates = [a.strip() for a in answers if isinstance(a, str) and a.strip()]
+        if not candidates:
+            errors = [a for a in answers if isinstance(a, BaseException)]
+            raise errors[0] if errors else ValueError("empty response")
+
+        feedback_lines = []
+        best = 0
+        if len(candidates) > 1:
+            best, feedback_lines = _parse_ranking(
+                await _agenerate(
+                    _ranking_prompt(candidates, keywords), response_mime_type="application/json"
+                ),
+                len(candidates),
+            )
+        winner = candidates[best]
+        if on_partial is not None:
+            on_partial("draft", winner)
+
+        local = text_quality.score_text(winner, keywords)
+        if not local["passed"] or feedback_lines:
+            feedback = "\n".join(f"- {line}" for line in local["issues"] + feedback_lines)
+            winner = (await _agenerate(
+                _editor_prompt(winner, feedback),
+                on_partial=_stage_callback(on_partial, "editor"),
+            )).strip()
+
+        return _finalize_text(winner, replacements_path)
 
     except Exception as e:
-        return f"Error in Multi-Agent Gen: {str(e)}"
+        raise GenerationError(f"Speculative Gen failed: {e}") from e
+
+def run_speculative_text_generation(title, link, keywords, _description, page_context,
+                                    drafts=3, api_key=None, replacements_path=None):
+    """Sync wrapper over arun_speculative_text_generation()."""
+    return aio.run(arun_speculative_text_generation(
+        title, link, keywords, _description, page_context, drafts, api_key,
+        replacements_path=replacements_path,
+    ))
+
+async def _agenerate_texts(rows, context_fn, concurrency, speculative_drafts, stream,
+                           replacements_path=None):
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    async def _one(idx, row):
+        def on_partial(stage, text):
+            events.put_nowait(
+                {"idx": idx, "stage": stage, "text": text, "error": None, "done": False}
+            )
+
+        event = {"idx": idx, "stage": "done", "text": None, "error": None, "done": True}
+        async with semaphore:
+            try:
+                page_context = ""
+                if context_fn is not None:
+                    # Загрузка страницы синхронная - уводим ее в пул потоков
+                    page_context = await loop.run_in_executor(None, context_fn, row)
+                fields = {
+                    "title": row.get("Title"),
+                    "link": row.get("Link"),
+                    "keywords": row.get("Keywords"),
+                    "_description": row.get("Description"),
+                    "page_context": page_context or "",
+                    "on_partial": on_partial if stream else None,
+                    "replacements_path": replacements_path,
+                }
+                if speculative_drafts:
+                    event["text"] = await arun_speculative_text_generation(
+                        **fields, drafts=speculative_drafts
+                    )
+                else:
+                    event["text"] = await arun_multi_agent_text_generation(**fields)
+            except Exception as e: # pylint: disable=broad-exception-caught
+                event["error"] = e
+        events.put_nowait(event)
+
+    tasks = [asyncio.ensure_future(_one(idx, row)) for idx, row in rows]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            event = await events.get()
+            if event["done"]:
+                remaining -= 1
+            yield event
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def stream_text_generation(rows, context_fn=None, concurrency=TEXT_PIPELINE_CONCURRENCY,
+                           speculative_drafts=0, replacements_path=None):
+    """
+    Streaming variant of iter_text_generation(): yields event dicts
+    {"idx", "stage", "text", "error", "done"}. Events with done=False carry the
+    text generated so far for the row (stage "draft" or "editor"); the single
+    done=True event per row carries the final text or the error.
+    Closing the generator cancels pages still in progress.
+    """
+    return aio.iterate(
+        _agenerate_texts(list(rows), context_fn, concurrency, speculative_drafts, stream=True,
+                         replacements_path=replacements_path)
+    )
+
+def iter_text_generation(rows, context_fn=None, concurrency=TEXT_PIPELINE_CONCURRENCY,
+                         speculative_drafts=0, replacements_path=None):
+    """
+    Runs the multi-agent chain for many rows on the shared event loop.
+    rows: iterable of (idx, row_dict) with Title/Link/Keywords/Description.
+    context_fn(row) returns page context text (called in a worker thread).
+    speculative_drafts > 0 switches to the speculative parallel-draft chain.
+    replacements_path: project replacement dictionary for the humanizer.
+    Yields (idx, text, error) as pages finish; exactly one of text/error is set.
+    Closing the generator cancels pages still in progress.
+    """
+    events = aio.iterate(
+        _agenerate_texts(list(rows), context_fn, concurrency, speculative_drafts, stream=False,
+                         replacements_path=replacements_path)
+    )
+    try:
+        for event in events:
+            yield event["idx"], event["text"], event["error"]
+    finally:
+        events.close()
@@ -0,0 +1,117 @@
+"""
+Async Runtime
+Runs a single background asyncio loop shared by the services, so sync callers
+(the Streamlit script, thread pools) can drive coroutines without creating a
+new loop per call.
+"""
+
+import asyncio
+import concurrent.futures
+import os
+import queue
+import threading
+
+# Потоки для коротких блокирующих операций корутин (SQLite, zlib, запись файлов).
+# Пул по умолчанию для них не годится: в нем работает синхронный код, который
+# сам ждет корутины через run(), и при занятом пуле обе стороны ждут друг друга
+IO_WORKERS = int(os.getenv("AIO_IO_WORKERS", "8"))
+
+_LOOP = None
+_IO_EXECUTOR = None
+_LOCK = threading.Lock()
+
+
+def get_loop():
+    """Returns the shared background event loop, starting it on first use."""
+    global _LOOP  # pylint: disable=global-statement
+    with _LOCK:
+        if _LOOP is None or _LOOP.is_closed():
+            _LOOP = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=_LOOP.run_forever, name="services-aio", daemon=True
+            )
+            thread.start()
+    return _LOOP
+
+
+def get_io_executor():
+    """Returns the dedicated thread pool used by run_io()."""
+    global _IO_EXECUTOR  # pylint: disable=global-statement
+    with _LOCK:
+        if _IO_EXECUTOR is None:
+            _IO_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+                IO_WORKERS, thread_name_prefix="services-io"
+            )
+    return _IO_EXECUTOR
+
+
+async def run_io(fn, *args):
+    """
+    Awaits fn(*args) in the dedicated I/O pool, off the event loop.
+    fn must not wait for coroutines itself (no run()/iterate() inside).
+    """
+    return await asyncio.get_running_loop().run_in_executor(get_io_executor(), fn, *args)
+
+
+def run(coro, timeout=None):
+    """
+    Runs a coroutine on the background loop and blocks until it finishes.
+    Must not be called from the loop thread itself.
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+
+def iterate(agen, maxsize=256):
+    """
+    Consumes an async iterator from sync code.
+    Items are handed over through a bounded queue, so a slow consumer slows the
+    producer down instead of buffering everything. Closing the returned
+    generator (or breaking out of it) cancels the producer.
+    """
+    items = queue.Queue(maxsize)
+    done = object()
+
+    async def _put(item):
+        while True:
+            try:
+                items.put_nowait(item)
+                return
+            except queue.Full:
+                await asyncio.sleep(0.01)
+
+    async def _pump():
+        try:
+            async for item in agen:
+                await _put((True, item))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            await _put((False, e))
+            return
+        finally:
+            aclose = getattr(agen, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        await _put((True, done))
+
+    future = asyncio.run_coroutine_threadsafe(_pump(), get_loop())
+
+    def _consume():
+        try:
+            while True:
+                ok, item = items.get()
+                if not ok:
+                    raise item
+                if item is done:
+                    return
+                yield item
+        finally:
+            future.cancel()
+            # Разблокируем продюсер, если он ждет места в очереди
+            while not items.empty():
+                items.get_nowait()
+
+    return _consume()
@@ -0,0 +1,86 @@
+"""
+Crawler Service
+Breadth-first site crawler with a deduplicating frontier.
+"""
+
+from collections import deque
+from contextlib import closing
+from fnmatch import fnmatch
+from functools import partial
+from urllib.parse import urlparse
+
+from services import fetcher, parser
+
+
+class Frontier:
+    """
+    FIFO queue of (url, depth) pairs with a visited set.
+    Each URL is enqueued at most once per crawl, no matter how many pages link to it.
+    """
+
+    def __init__(self, include=None, exclude=None):
+        self.include = [p for p in (include or []) if p]
+        self.exclude = [p for p in (exclude or []) if p]
+        self._queue = deque()
+        self._seen = set()
+
+    def __len__(self):
+        return len(self._queue)
+
+    @property
+    def seen_count(self):
+        """Number of distinct URLs ever enqueued."""
+        return len(self._seen)
+
+    def allowed(self, url):
+        """Checks the URL path against include/exclude glob patterns."""
+        path = urlparse(url).path or "/"
+        if self.include and not any(fnmatch(path, p) for p in self.include):
+            return False
+        return not any(fnmatch(path, p) for p in self.exclude)
+
+    def add(self, url, depth, force=False):
+        """Enqueues a URL unless it was seen before or is filtered out."""
+        if url in self._seen:
+            return False
+        if not force and not self.allowed(url):
+            return False
+        self._seen.add(url)
+        self._queue.append((url, depth))
+        return True
+
+    def pop_level(self, limit):
+        """Pops up to `limit` URLs that share the depth of the queue head."""
+        if not self._queue:
+            return None, []
+        depth = self._queue[0][1]
+        batch = []
+        while self._queue and self._queue[0][1] == depth and len(batch) < limit:
+            batch.append(self._queue.popleft()[0])
+        return depth, batch
+
+
+def crawl_site(start_url, max_depth=2, max_pages=500, include=None, exclude=None):
+    """
+    Crawls a site breadth-first starting from start_url.
+    Each page is downloaded once; its links and metadata come from the same response.
+    Yields metadata dicts ({"Title", "Link", "Description"}) for every fetched page.
+    """
+    start = parser.normalize_url(start_url, start_url)
+    base_domain = urlparse(start).netloc
+    frontier = Frontier(include, exclude)
+    frontier.add(start, 0, force=True)
+    parse = partial(parser.parse_page, base_domain=base_domain)
+
+    fetched = 0
+    while frontier and fetched < max_pages:
+        depth, batch = frontier.pop_level(max_pages - fetched)
+        fetched += len(batch)
+        with closing(fetcher.iter_fetch(batch, transform=parse)) as results:
+            for _url, page in results:
+                if page is None:
+                    continue
+                if depth < max_depth:
+                    for link in page["links"]:
+                        frontier.add(link, depth + 1)
+                yield page["meta"]
@@ -1,50 +1,134 @@
 """
 Export Service
-Handles exporting data to Excel and XML formats.
+Handles exporting data to Excel, XML, CSV, JSON Lines and Parquet. Every
+writer streams rows from an iterator, so memory stays flat regardless of
+project size; EXPORTERS maps a format to its writer, extension and MIME type.
 """
 
+import collections
+import csv
+import functools
+import hashlib
 import io
-import xml.etree.ElementTree as ET
-import pandas as pd
+import itertools
+import json
+import math
+import os
+import re
+import threading
+from xml.sax.saxutils import escape
+
+# Готовые файлы держим в памяти по хэшу содержимого: столько штук и не больше N МБ
+EXPORT_CACHE_ENTRIES = int(os.getenv("EXPORT_CACHE_ENTRIES", "8"))
+EXPORT_CACHE_MAX_BYTES = int(os.getenv("EXPORT_CACHE_MAX_MB", "200")) * 1024 * 1024
+
+# Строк в одной группе Parquet (и в одной пачке записи CSV/JSONL)
+PARQUET_ROW_GROUP_SIZE = 10000
+
+# Ширина колонок в Excel (остальные - DEFAULT_COLUMN_WIDTH)
+COLUMN_WIDTHS = {"Text": 60, "New Description": 40, "Description": 40}
+DEFAULT_COLUMN_WIDTH = 20
+
+
+def _columns(rows, columns):
+    """Returns (columns, rows): without explicit columns they come from the first row."""
+    rows = iter(rows)
+    if columns is not None:
+        return list(columns), rows
+    first = next(rows, None)
+    if first is None:
+        return [], rows
+    return list(first), itertools.chain([first], rows)
+
+
+def _cell_value(value):
+    """Empty cells for None/NaN, native Python values for numpy scalars."""
+    if value is None:
+        return ""
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return ""
+    return value
+
+
+def write_excel(rows, fileobj, columns=None):
+    """
+    Streams rows (an iterable of dicts) into an .xlsx written to fileobj.
+    Uses openpyxl write-only mode: rows go to disk as they come, so memory
+    does not grow with the project. Without columns the keys of the first
+    row are used. Returns the number of data rows written.
+    """
+    # pylint: disable=import-outside-toplevel
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE, Cell
+    from openpyxl.styles import Alignment
+    from openpyxl.utils import get_column_letter
+
+    columns, rows = _columns(rows, columns)
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet("Sheet1")
+    # Один стиль на все ячейки (перенос текста, выравнивание по верху): регистрируем
+    # его в книге один раз, ячейки получают готовый массив индексов стиля
+    template = WriteOnlyCell(worksheet)
+    template.alignment = Alignment(wrap_text=True, vertical='top', horizontal='left')
+    style = template._style  # pylint: disable=protected-access
+
+    # В write-only режиме ширину колонок задаем до первой строки
+    for idx, column in enumerate(columns, start=1):
+        worksheet.column_dimensions[get_column_letter(idx)].width = COLUMN_WIDTHS.get(
+            column, DEFAULT_COLUMN_WIDTH
+        )
+
+    def _cell(value):
+        value = _cell_value(value)
+        if isinstance(value, str):
+            # Управляющие символы из HTML openpyxl не пропускает
+            value = ILLEGAL_CHARACTERS_RE.sub("", value)
+        elif not isinstance(value, (int, float, bool)):
+            value = str(value)
+        return Cell(worksheet, row=1, column=1, value=value, style_array=style)
+
+    worksheet.append([_cell(column) for column in columns])
+    count = 0
+    for row in rows:
+        worksheet.append([_cell(row.get(column)) for column in columns])
+        count += 1
+    workbook.save(fileobj)
+    return count
+
 
 def export_to_excel(data: list):
     """
     Converts list of dicts to Excel bytes with formatting.
     """
-    df = pd.DataFrame(data)
     output = io.BytesIO()
-    
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Sheet1')
-        
-        # Получаем объект openpyxl для форматирования
-        workbook = writer.book
-        worksheet = writer.sheets['Sheet1']
-        
-        # Импортируем стили
-        from openpyxl.styles import Alignment
-        
-        # Задаем ширину колонок и перенос текста
-        for idx, column in enumerate(df.columns):
-            col_letter = chr(65 + idx) # A, B, C...
-            
-            # Настраиваем ширину в зависимости от контента
-            if column == "Text":
-                worksheet.column_dimensions[col_letter].width = 60
-            elif column in ["New Description", "Description"]:
-                worksheet.column_dimensions[col_letter].width = 40
-            else:
-                worksheet.column_dimensions[col_letter].width = 20
-                
-            # Применяем перенос текста ко всей колонке (кроме заголовка - хотя можно и к нему)
-            for cell in worksheet[col_letter]:
-                cell.alignment = Alignment(wrap_text=True, vertical='top', horizontal='left')
-
+    # Как и раньше в DataFrame: колонки - объединение ключей всех строк
+    write_excel(data, output, columns=dict.fromkeys(k for row in data for k in row))
     return output.getvalue()
 
-def export_to_xml(data: list):
+# Символы, запрещенные в XML 1.0 (управляющие, кроме табуляции и переводов строки)
+_XML_ILLEGAL_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+# Допустимые символы имени тега (буквы любого алфавита, цифры, _ - .)
+_XML_NAME_RE = re.compile(r'[^\w.\-]')
+XML_CHUNK_SIZE = 64 * 1024
+
+
+@functools.lru_cache(maxsize=256)
+def xml_tag(name):
+    """Column name -> valid XML tag: spaces to underscores, "/" dropped, other junk to "_"."""
+    tag = _XML_NAME_RE.sub("_", str(name).replace(" ", "_").replace("/", ""))
+    if not tag or not (tag[0].isalpha() or tag[0] == "_"):
+        tag = "_" + tag
+    return tag
+
+
+def iter_xml(rows, columns=None, root="project", row_tag="row", chunk_size=XML_CHUNK_SIZE):
     """
-    Converts list of dicts to simple XML bytes.
+    Serializes rows (an iterable of dicts) as XML incrementally and yields
+    UTF-8 chunks of about chunk_size bytes, so a download can start (and a
+    file be written) before the whole project is serialized.
     Structure:
     <project>
       <row>
@@ -52,19 +136,226 @@ def export_to_xml(data: list):
         ...
       </row>
     </project>
+    Without columns every row is written with its own keys.
     """
-    root = ET.Element("project")
+    parts = [f"<?xml version='1.0' encoding='utf-8'?>\n<{root}>"]
+    size = 0
+    for row in rows:
+        parts.append(f"<{row_tag}>")
+        for key in (columns if columns is not None else row):
+            tag = xml_tag(key)
+            value = _cell_value(row.get(key))
+            text = escape(_XML_ILLEGAL_RE.sub("", str(value)))
+            parts.append(f"<{tag}>{text}</{tag}>" if text else f"<{tag} />")
+            size += len(text)
+        parts.append(f"</{row_tag}>")
+        if size >= chunk_size:
+            yield "".join(parts).encode("utf-8")
+            parts = []
+            size = 0
+    parts.append(f"</{root}>")
+    yield "".join(parts).encode("utf-8")
 
-    for row in data:
-        row_elem = ET.SubElement(root, "row")
-        for k, v in row.items():
-            # sanitation for xml tags (spaces to underscores)
-            tag_name = str(k).replace(" ", "_").replace("/", "")
-            child = ET.SubElement(row_elem, tag_name)
-            child.text = str(v)
-
-    # Pretty print? Minidom or just tostring
-    tree = ET.ElementTree(root)
+
+def write_xml(rows, fileobj, columns=None):
+    """
+    Streams rows as XML into fileobj (a file or a response stream).
+    Returns the number of rows written.
+    """
+    count = 0
+
+    def _counted():
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+
+    for chunk in iter_xml(_counted(), columns):
+        fileobj.write(chunk)
+    return count
+
+
+def export_to_xml(data: list):
+    """
+    Converts list of dicts to simple XML bytes (see iter_xml for the structure).
+    """
+    return b"".join(iter_xml(data))
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def write_csv(rows, fileobj, columns=None):
+    """
+    Streams rows as CSV into a binary fileobj. UTF-8 with BOM, so Excel
+    opens Cyrillic text correctly. Returns the number of data rows written.
+    """
+    columns, rows = _columns(rows, columns)
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    writer = csv.writer(text)
+    writer.writerow(columns)
+    count = 0
+    for batch in _batches(rows, PARQUET_ROW_GROUP_SIZE):
+        writer.writerows([_cell_value(row.get(column)) for column in columns] for row in batch)
+        count += len(batch)
+    # Отцепляем обертку, чтобы она не закрыла файл вызывающего
+    text.flush()
+    text.detach()
+    return count
+
+
+def write_jsonl(rows, fileobj, columns=None):
+    """
+    Streams rows as JSON Lines (one object per row) into a binary fileobj.
+    Without columns every row is written with its own keys.
+    Returns the number of rows written.
+    """
+    count = 0
+    for batch in _batches(rows, PARQUET_ROW_GROUP_SIZE):
+        lines = []
+        for row in batch:
+            keys = columns if columns is not None else row
+            lines.append(json.dumps(
+                {key: _cell_value(row.get(key)) for key in keys}, ensure_ascii=False, default=str
+            ))
+        fileobj.write(("\n".join(lines) + "\n").encode("utf-8"))
+        count += len(batch)
+    return count
+
+
+def _parquet_value(value):
+    """Cell -> nullable string: empty cells become nulls, everything else str()."""
+    value = _cell_value(value)
+    if value == "":
+        return None
+    return value if isinstance(value, str) else str(value)
+
+
+def write_parquet(rows, fileobj, columns=None, row_group_size=PARQUET_ROW_GROUP_SIZE):
+    """
+    Streams rows into a Parquet file, one row group per row_group_size rows
+    (requires pyarrow). Every column is a nullable string: the schema must be
+    fixed before the first group is written, and project cells (checkboxes
+    from the editor next to "TRUE" from the sheet, numbers next to text) do
+    not have stable types. Empty cells are nulls.
+    Returns the number of rows written.
+    """
+    try:
+        import pyarrow as pa  # pylint: disable=import-outside-toplevel
+        import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+    except ImportError as e:
+        raise RuntimeError("Для экспорта в Parquet установите pyarrow") from e
+
+    columns, rows = _columns(rows, columns)
+    schema = pa.schema([pa.field(str(column), pa.string()) for column in columns])
+    count = 0
+    with pq.ParquetWriter(fileobj, schema) as writer:
+        for batch in _batches(rows, row_group_size):
+            data = {
+                str(column): [_parquet_value(row.get(column)) for row in batch] for column in columns
+            }
+            writer.write_table(pa.Table.from_pydict(data, schema=schema), row_group_size=row_group_size)
+            count += len(batch)
+    return count
+
+
+Exporter = collections.namedtuple("Exporter", ["write", "extension", "media_type", "label"])
+
+# Реестр форматов: writer(rows, fileobj, columns=None) пишет строки из итератора в файл
+EXPORTERS = {
+    "xlsx": Exporter(
+        write_excel, "xlsx",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "Excel (.xlsx)",
+    ),
+    "xml": Exporter(write_xml, "xml", "text/xml", "XML (.xml)"),
+    "csv": Exporter(write_csv, "csv", "text/csv", "CSV (.csv)"),
+    "jsonl": Exporter(write_jsonl, "jsonl", "application/x-ndjson", "JSON Lines (.jsonl)"),
+    "parquet": Exporter(write_parquet, "parquet", "application/vnd.apache.parquet", "Parquet (.parquet)"),
+}
+
+
+def get_exporter(fmt: str) -> Exporter:
+    """Exporter for a format name from EXPORTERS."""
+    if fmt not in EXPORTERS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    return EXPORTERS[fmt]
+
+
+def export_bytes(fmt: str, data, columns=None) -> bytes:
+    """Exports rows in the given format into memory (for download buttons)."""
     output = io.BytesIO()
-    tree.write(output, encoding='utf-8', xml_declaration=True)
+    get_exporter(fmt).write(data, output, columns)
     return output.getvalue()
+
+
+def content_key(fmt: str, data, columns=None) -> str:
+    """Hash of the format, columns and row contents (None and NaN count as empty)."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([fmt, list(columns) if columns is not None else None]).encode("utf-8"))
+    for row in data:
+        items = [[key, _cell_value(value)] for key, value in row.items()]
+        digest.update(json.dumps(items, ensure_ascii=False, default=str).encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+class ExportCache:
+    """LRU of built export files keyed by content hash, bounded by count and total size."""
+
+    def __init__(self, max_entries=EXPORT_CACHE_ENTRIES, max_bytes=EXPORT_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._files = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            payload = self._files.get(key)
+            if payload is None:
+                self.misses += 1
+                return None
+            self._files.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def put(self, key, payload):
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._files:
+                self._size -= len(self._files.pop(key))
+            self._files[key] = payload
+            self._size += len(payload)
+            while len(self._files) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._files.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._files.clear()
+            self._size = 0
+
+
+_export_cache = ExportCache()
+
+
+def cached_export(fmt: str, data: list, columns=None) -> bytes:
+    """
+    Like export_bytes, but an unchanged project (same content_key) is served
+    from the in-memory cache instead of being rendered again.
+    """
+    key = content_key(fmt, data, columns)
+    payload = _export_cache.get(key)
+    if payload is None:
+        payload = export_bytes(fmt, data, columns)
+        _export_cache.put(key, payload)
+    return payload
@@ -0,0 +1,262 @@
+"""
+Fetcher Service
+Async HTTP engine with a shared keep-alive connection pool.
+"""
+
+import asyncio
+import codecs
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import httpx
+
+from services import aio, page_cache
+
+try:
+    import h2  # noqa: F401  # pylint: disable=unused-import
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
+    "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
+}
+
+# Лимиты можно переопределить через .env
+MAX_CONNECTIONS = int(os.getenv("FETCH_MAX_CONNECTIONS", "50"))
+MAX_PER_HOST = int(os.getenv("FETCH_MAX_PER_HOST", "8"))
+TIMEOUT = float(os.getenv("FETCH_TIMEOUT", "10"))
+# Предел чтения в потоковом режиме (если <head> или <h1> так и не встретились)
+HEAD_MAX_BYTES = int(os.getenv("FETCH_HEAD_MAX_BYTES", str(512 * 1024)))
+
+
+class AsyncFetcher:
+    """
+    Wraps one httpx.AsyncClient, so every request reuses pooled connections.
+    Concurrency is capped globally and per host.
+    """
+
+    def __init__(self, max_connections=MAX_CONNECTIONS, max_per_host=MAX_PER_HOST,
+                 timeout=TIMEOUT, http2=HTTP2_AVAILABLE):
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.http2 = http2
+        self._client = None
+        self._global_slots = None
+        self._host_slots = {}
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                timeout=self.timeout,
+                headers=DEFAULT_HEADERS,
+                follow_redirects=True,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+            self._global_slots = asyncio.Semaphore(self.max_connections)
+        return self._client
+
+    def _host_slot(self, url):
+        host = urlparse(url).netloc.lower()
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = self._host_slots[host] = asyncio.Semaphore(self.max_per_host)
+        return slot
+
+    async def fetch(self, url, headers=None):
+        """
+        Downloads a URL.
+        Never raises: network errors are reported in the "error" field.
+        """
+        client = self._get_client()
+        async with self._global_slots, self._host_slot(url):
+            try:
+                response = await client.get(url, headers=headers)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                return {
+                    "url": url, "status": None, "headers": {},
+                    "text": "", "error": str(e),
+                }
+        return {
+            "url": url,
+            "status": response.status_code,
+            "headers": dict(response.headers),
+            "text": response.text,
+            "error": None,
+        }
+
+    async def fetch_page(self, url, max_age=None):
+        """
+        Cache-aware fetch.
+        Entries younger than max_age (default PAGE_CACHE_TTL) are served from disk
+        without a request; older ones are revalidated with If-None-Match /
+        If-Modified-Since, and a 304 answer reuses the stored body and fields.
+        The result carries a "fields" dict with previously extracted data.
+        Cache reads and writes (SQLite + zlib) run in the aio I/O pool, so they
+        neither stall the event loop nor wait behind sync callers that occupy
+        the default executor (e.g. context loaders calling fetch()).
+        """
+        cache = page_cache.get_cache()
+        if cache is None:
+            result = await self.fetch(url)
+            result["fields"] = {}
+            return result
+
+        max_age = page_cache.CACHE_TTL if max_age is None else max_age
+        entry = await aio.run_io(cache.get, url)
+        if entry and time.time() - entry["fetched_at"] < max_age:
+            return entry
+
+        headers = {}
+        if entry:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        result = await self.fetch(url, headers or None)
+        if entry and result["status"] == 304:
+            await aio.run_io(cache.touch, url)
+            return entry
+        if not result["error"] and result["status"] == 200:
+            await aio.run_io(cache.put, url, result)
+        result["fields"] = {}
+        return result
+
+    async def fetch_head(self, url, extractor, max_bytes=HEAD_MAX_BYTES):
+        """
+        Streams the response body into extractor.feed() chunk by chunk and
+        drops the connection as soon as extractor.done is true, so only the
+        beginning of the page is transferred. The body is not kept or cached;
+        the result carries the extractor instead of "text".
+        """
+        client = self._get_client()
+        async with self._global_slots, self._host_slot(url):
+            try:
+                async with client.stream("GET", url) as response:
+                    received = 0
+                    if response.status_code == 200:
+                        # Лимит max_bytes считается в байтах тела (после Content-Encoding),
+                        # а не в символах: кириллица в UTF-8 занимает по 2 байта
+                        decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(
+                            errors="replace"
+                        )
+                        async for chunk in response.aiter_bytes():
+                            received += len(chunk)
+                            extractor.feed(decoder.decode(chunk))
+                            if extractor.done or received >= max_bytes:
+                                break
+                    return {
+                        "url": url,
+                        "status": response.status_code,
+                        "headers": dict(response.headers),
+                        "extractor": extractor,
+                        "received": received,
+                        "error": None,
+                    }
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                return {
+                    "url": url, "status": None, "headers": {},
+                    "extractor": extractor, "received": 0, "error": str(e),
+                }
+
+    async def download(self, url, fileobj):
+        """
+        Writes the raw body of a 200 response into fileobj (raises httpx errors
+        otherwise) and returns the number of bytes. The whole body is read
+        before returning, so the connection and slots are not held while a
+        slow consumer processes the content.
+        Content-Encoding is decoded by httpx; gzip *files* are passed through as is.
+        """
+        client = self._get_client()
+        size = 0
+        async with self._global_slots, self._host_slot(url):
+            async with client.stream("GET", url) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes():
+                    await aio.run_io(fileobj.write, chunk)
+                    size += len(chunk)
+        return size
+
+    async def fetch_many(self, urls, transform=None, extractor_factory=None):
+        """
+        Downloads URLs concurrently and yields (url, result) as they complete.
+        urls may be any iterable (it is consumed lazily). transform, if given,
+        is applied to each result in a worker thread so HTML parsing does not
+        block the event loop. With extractor_factory, pages are streamed
+        through fetch_head() instead of being downloaded in full.
+        """
+        loop = asyncio.get_running_loop()
+        window = self.max_connections * 2
+
+        async def _one(url):
+            if extractor_factory is not None:
+                result = await self.fetch_head(url, extractor_factory(url))
+            else:
+                result = await self.fetch_page(url)
+            if transform is not None:
+                result = await loop.run_in_executor(None, transform, result)
+            return url, result
+
+        url_iter = iter(urls)
+        pending = set()
+        try:
+            while True:
+                while len(pending) < window:
+                    url = next(url_iter, None)
+                    if url is None:
+                        break
+                    pending.add(asyncio.ensure_future(_one(url)))
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def aclose(self):
+        """Closes pooled connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+_FETCHER = None
+_FETCHER_LOCK = threading.Lock()
+
+
+def get_fetcher():
+    """Returns the process-wide fetcher."""
+    global _FETCHER  # pylint: disable=global-statement
+    with _FETCHER_LOCK:
+        if _FETCHER is None:
+            _FETCHER = AsyncFetcher()
+    return _FETCHER
+
+
+def fetch(url, max_age=None):
+    """Sync wrapper: cache-aware download of one URL through the shared pool."""
+    return aio.run(get_fetcher().fetch_page(url, max_age))
+
+
+def fetch_head(url, extractor):
+    """Sync wrapper: streams the start of one page into extractor."""
+    return aio.run(get_fetcher().fetch_head(url, extractor))
+
+
+def iter_fetch(urls, transform=None, extractor_factory=None):
+    """Sync wrapper over fetch_many: yields (url, result) as pages complete."""
+    return aio.iterate(get_fetcher().fetch_many(urls, transform, extractor_factory))
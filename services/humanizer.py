@@ -0,0 +1,175 @@
+"""
+Humanizer Service
+Post-processing of generated texts: strips markup and AI intros, replaces AI
+phrasing with human wording and normalizes whitespace in a few precompiled
+passes. The replacement table is compiled into one trie-shaped regex, so
+thousands of phrases cost about as much as ten.
+"""
+
+import csv
+import functools
+import json
+import os
+import re
+
+# "AI-лексика" -> человеческий вариант (русский)
+DEFAULT_REPLACEMENTS = {
+    "Кроме того,": "А еще,",
+    "Более того,": "Также,",
+    "В заключение,": "В общем,",
+    "Следовательно,": "Так что,",
+    "Важно отметить, что": "",
+    "Стоит подчеркнуть, что": "",
+    "Является идеальным выбором": "Отлично подойдет",
+    "Предлагает широкий спектр": "Тут есть всё:",
+    "Уникальная возможность": "Шанс",
+    "Погрузитесь в мир": "Попробуйте",
+}
+
+# Путь к дополнительному словарю замен, подключаемому по умолчанию
+EXTRA_REPLACEMENTS_PATH = os.getenv("HUMANIZER_REPLACEMENTS", "")
+# Словари проектов: задачи выбирают их только по имени файла в этой папке
+DICTIONARIES_DIR = os.getenv(
+    "HUMANIZER_DICTIONARIES_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "dictionaries"),
+)
+DICTIONARY_EXTENSIONS = (".json", ".tsv", ".csv")
+
+# Заголовки, курсив, код и HTML-теги (жирный ** оставляем) - одним проходом.
+# Класс символов в начале дает движку быстрый поиск кандидатов, ветка
+# выбирается ретроспективной проверкой уже совпавшего символа.
+_MARKUP_RE = re.compile(r'[#_`<](?:(?<=#)#*\s*|(?<=_)_|(?<=`)|(?<=<)[^>]*>)')
+# Типичные вступления AI - только в самом начале текста
+_INTRO_RE = re.compile(r"^(Конечно|Вот|Согласно вашему|Текст:|Статья:).*\n?", re.IGNORECASE)
+# Лишние пробелы в строке и больше двух переносов подряд (абзацы сохраняем)
+_SPACES_RE = re.compile(r'[ \t]{2,}|\t')
+_NEWLINES_RE = re.compile(r'\n{3,}')
+
+
+def _trie_pattern(phrases):
+    """
+    Builds a regex equivalent to `phrase1|phrase2|...` but shaped as a trie:
+    matching at a position walks one branch instead of trying every phrase,
+    and the longest phrase wins when one is a prefix of another.
+    """
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def _build(node):
+        terminal = "" in node
+        branches = [re.escape(char) + _build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if terminal:
+            # Жадная необязательная группа: сначала пробуем более длинную фразу
+            return "(?:" + body + ")?"
+        return body
+
+    return _build(trie)
+
+
+def load_replacements(path):
+    """
+    Loads a replacement dictionary from a .json object ({"фраза": "замена"})
+    or a tab/comma separated file with "фраза<TAB>замена" rows.
+    """
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return {str(k): str(v) for k, v in data.items()}
+
+    with open(path, encoding="utf-8", newline="") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        delimiter = "\t" if "\t" in sample else ","
+        return {
+            row[0]: row[1] if len(row) > 1 else ""
+            for row in csv.reader(f, delimiter=delimiter)
+            if row and row[0]
+        }
+
+
+def list_dictionaries():
+    """File names of the project dictionaries available in DICTIONARIES_DIR."""
+    try:
+        names = os.listdir(DICTIONARIES_DIR)
+    except OSError:
+        return []
+    return sorted(
+        name for name in names
+        if name.lower().endswith(DICTIONARY_EXTENSIONS)
+        and os.path.isfile(os.path.join(DICTIONARIES_DIR, name))
+    )
+
+
+def resolve_dictionary(name):
+    """
+    Path of the project dictionary `name` (a bare file name from
+    list_dictionaries()). Anything else - subpaths, "..", symlinks leading
+    out of DICTIONARIES_DIR, other extensions - raises ValueError.
+    """
+    root = os.path.realpath(DICTIONARIES_DIR)
+    if (
+        not name or name != os.path.basename(name) or name in (".", "..")
+        or not name.lower().endswith(DICTIONARY_EXTENSIONS)
+    ):
+        raise ValueError(f"Недопустимое имя словаря: {name!r}")
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.dirname(path) != root or not os.path.isfile(path):
+        raise ValueError(f"Словарь не найден: {name!r}")
+    return path
+
+
+class Humanizer:
+    """Compiled humanizer for one replacement table."""
+
+    def __init__(self, replacements=None):
+        self.replacements = dict(DEFAULT_REPLACEMENTS if replacements is None else replacements)
+        phrases = [p for p in self.replacements if p]
+        self._replace_re = re.compile(_trie_pattern(phrases)) if phrases else None
+
+    def with_replacements(self, extra):
+        """Returns a new Humanizer with extra phrases added (extra wins on conflicts)."""
+        merged = dict(self.replacements)
+        merged.update(extra)
+        return Humanizer(merged)
+
+    def _replace(self, match):
+        return self.replacements[match.group()]
+
+    def humanize(self, text):
+        """Strips AI patterns, markdown and formatting garbage from text."""
+        # Проверки `in` идут на C и дешевле прохода regex по чистому тексту
+        if "#" in text or "_" in text or "`" in text or "<" in text:
+            text = _MARKUP_RE.sub("", text)
+        text = _INTRO_RE.sub("", text, count=1)
+        if self._replace_re is not None:
+            text = self._replace_re.sub(self._replace, text)
+        if "  " in text or "\t" in text:
+            text = _SPACES_RE.sub(" ", text)
+        if "\n\n\n" in text:
+            text = _NEWLINES_RE.sub("\n\n", text)
+        return text.strip()
+
+
+@functools.lru_cache(maxsize=32)
+def get_humanizer(path=None):
+    """
+    Returns a cached Humanizer: the default table plus HUMANIZER_REPLACEMENTS
+    (if set) plus the dictionary at path, e.g. a per-project one.
+    """
+    humanizer = Humanizer()
+    for extra_path in (EXTRA_REPLACEMENTS_PATH, path):
+        if extra_path:
+            humanizer = humanizer.with_replacements(load_replacements(extra_path))
+    return humanizer
+
+
+def humanize_text(text, replacements_path=None):
+    """Humanizes text with the cached humanizer for replacements_path."""
+    return get_humanizer(replacements_path).humanize(text)
@@ -0,0 +1,702 @@
+"""
+Jobs Service
+Persistent background jobs (crawl, meta and text generation, export) that
+run in detached worker processes instead of the Streamlit script thread or
+the API process. Jobs live in a SQLite table with progress, partial output,
+a checkpoint for resuming and a cancel flag; clients only submit jobs and
+poll their state.
+
+Run a worker by hand with:  python -m services.jobs worker
+"""
+
+import concurrent.futures
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import closing
+from datetime import datetime
+
+from services.page_cache import CACHE_DIR
+
+JOBS_DB = os.path.join(CACHE_DIR, "jobs.sqlite")
+# Готовые файлы экспорта (имя - id задачи)
+EXPORTS_DIR = os.path.join(CACHE_DIR, "exports")
+# Завершенные задачи (и их файлы экспорта) хранятся столько секунд
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", str(7 * 24 * 3600)))
+# Сколько рабочих процессов держать при наличии задач и сколько они ждут новых
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+WORKER_IDLE_TIMEOUT = float(os.getenv("JOB_WORKER_IDLE_TIMEOUT", "120"))
+HEARTBEAT_INTERVAL = 5.0
+# Задача без пульса дольше этого считается брошенной и возвращается в очередь
+STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "60"))
+# Сколько раз брошенную задачу можно перезапустить, прежде чем она считается сбойной
+# (задача, которая роняет процесс, иначе перезапускалась бы бесконечно)
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Через сколько секунд после отмены процесс с зависшей задачей завершается принудительно
+CANCEL_GRACE = float(os.getenv("JOB_CANCEL_GRACE", "30"))
+# Как часто задача пишет прогресс в базу
+PROGRESS_INTERVAL = 0.5
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler when the job has been cancelled."""
+
+
+def _connect():
+    os.makedirs(os.path.dirname(JOBS_DB), exist_ok=True)
+    conn = sqlite3.connect(JOBS_DB, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT,
+            sheet_id TEXT,
+            params TEXT,
+            status TEXT,
+            done INTEGER DEFAULT 0,
+            total INTEGER DEFAULT 0,
+            message TEXT DEFAULT '',
+            partial TEXT,
+            checkpoint TEXT,
+            result TEXT,
+            error TEXT,
+            cancel_requested REAL,
+            worker_pid INTEGER,
+            attempts INTEGER DEFAULT 0,
+            heartbeat_at REAL,
+            created_at REAL,
+            started_at REAL,
+            finished_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+        CREATE INDEX IF NOT EXISTS jobs_sheet ON jobs (sheet_id, created_at);
+        CREATE TABLE IF NOT EXISTS workers (
+            pid INTEGER PRIMARY KEY,
+            heartbeat_at REAL
+        );
+        """
+    )
+    return conn
+
+
+_conn = None
+_conn_lock = threading.RLock()
+
+
+def _db():
+    """Process-wide connection (autocommit; writes are single statements or explicit transactions)."""
+    global _conn  # pylint: disable=global-statement
+    with _conn_lock:
+        if _conn is None:
+            _conn = _connect()
+    return _conn
+
+
+def _decode(row):
+    if row is None:
+        return None
+    job = dict(row)
+    for field in ("params", "partial", "checkpoint", "result"):
+        job[field] = json.loads(job[field]) if job[field] else None
+    return job
+
+
+# --- API для интерфейса ---
+
+def submit(kind: str, params: dict) -> str:
+    """Queues a job and makes sure workers are running. Returns the job id."""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job_id = uuid.uuid4().hex
+    with _conn_lock:
+        _db().execute(
+            "INSERT INTO jobs (id, kind, sheet_id, params, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, params.get("sheet_id"), json.dumps(params, ensure_ascii=False, default=str),
+             QUEUED, time.time()),
+        )
+    ensure_workers()
+    return job_id
+
+
+def get_job(job_id: str):
+    """Job as a dict (params/partial/checkpoint/result decoded), or None."""
+    with _conn_lock:
+        return _decode(_db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+
+def list_jobs(sheet_id: str = None, limit: int = 20):
+    """Most recent jobs, optionally for one project."""
+    with _conn_lock:
+        if sheet_id is None:
+            rows = _db().execute(
+                "SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        else:
+            rows = _db().execute(
+                "SELECT * FROM jobs WHERE sheet_id = ? ORDER BY created_at DESC LIMIT ?",
+                (sheet_id, limit),
+            ).fetchall()
+    return [_decode(row) for row in rows]
+
+
+def cancel(job_id: str) -> bool:
+    """
+    Cancels a job: a queued job is dropped right away, a running one stops at
+    its next step (in-flight requests are cancelled); if it does not stop
+    within CANCEL_GRACE seconds its worker process is terminated.
+    """
+    now = time.time()
+    with _conn_lock:
+        conn = _db()
+        dropped = conn.execute(
+            "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+            (CANCELLED, now, job_id, QUEUED),
+        ).rowcount
+        requested = conn.execute(
+            "UPDATE jobs SET cancel_requested = ? WHERE id = ? AND status = ? "
+            "AND cancel_requested IS NULL",
+            (now, job_id, RUNNING),
+        ).rowcount
+    return bool(dropped or requested)
+
+
+def resume(job_id: str) -> bool:
+    """Re-queues a failed or cancelled job; it continues from its checkpoint."""
+    with _conn_lock:
+        resumed = _db().execute(
+            "UPDATE jobs SET status = ?, error = NULL, cancel_requested = NULL, finished_at = NULL, "
+            "attempts = 0 "
+            "WHERE id = ? AND status IN (?, ?)",
+            (QUEUED, job_id, FAILED, CANCELLED),
+        ).rowcount
+    if resumed:
+        ensure_workers()
+    return bool(resumed)
+
+
+def cleanup(max_age: float = JOB_RETENTION) -> int:
+    """
+    Deletes jobs finished more than max_age seconds ago, then every export
+    file whose job is gone (including .tmp leftovers of crashed workers).
+    Returns the number of deleted jobs.
+    """
+    cutoff = time.time() - max_age
+    with _conn_lock:
+        conn = _db()
+        deleted = conn.execute(
+            "DELETE FROM jobs WHERE status IN (?, ?, ?) AND finished_at < ?",
+            (DONE, FAILED, CANCELLED, cutoff),
+        ).rowcount
+        known = {job_id for (job_id,) in conn.execute("SELECT id FROM jobs")}
+    try:
+        names = os.listdir(EXPORTS_DIR)
+    except FileNotFoundError:
+        return deleted
+    for name in names:
+        if name.split(".", 1)[0] not in known:
+            try:
+                os.remove(os.path.join(EXPORTS_DIR, name))
+            except OSError:
+                pass
+    return deleted
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def ensure_workers(count: int = JOB_WORKERS):
+    """Starts detached worker processes until `count` are alive (only if jobs are queued)."""
+    now = time.time()
+    with _conn_lock:
+        conn = _db()
+        workers = conn.execute("SELECT pid, heartbeat_at FROM workers").fetchall()
+        alive = [w["pid"] for w in workers if now - w["heartbeat_at"] < STALE_AFTER and _pid_alive(w["pid"])]
+        if alive:
+            conn.execute(f"DELETE FROM workers WHERE pid NOT IN ({','.join('?' * len(alive))})", alive)
+        else:
+            conn.execute("DELETE FROM workers")
+        queued = conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)
+        ).fetchone()[0]
+    for _ in range(min(count - len(alive), queued)):
+        log_path = os.path.join(CACHE_DIR, "jobs-worker.log")
+        with open(log_path, "ab") as log:
+            process = subprocess.Popen(  # pylint: disable=consider-using-with
+                [sys.executable, "-m", "services.jobs", "worker"],
+                cwd=_ROOT,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                stdin=subprocess.DEVNULL,
+                # Отдельная сессия: процесс переживает перезапуск скрипта и закрытие вкладки
+                start_new_session=True,
+            )
+        with _conn_lock:
+            _db().execute(
+                "INSERT OR REPLACE INTO workers (pid, heartbeat_at) VALUES (?, ?)", (process.pid, now)
+            )
+
+
+# --- Исполнение задач ---
+
+class JobContext:
+    """What a handler sees: params, progress reporting, checkpoint and cancellation."""
+
+    def __init__(self, job):
+        self.job_id = job["id"]
+        self.params = job["params"] or {}
+        self.checkpoint = job["checkpoint"] or {}
+        self.cancelled = False
+        self._last_write = 0.0
+        # (строка, этап), чей первый частичный вывод уже записан
+        self._partials_seen = set()
+
+    def check_cancelled(self):
+        """Raises JobCancelled if the job has been cancelled."""
+        if self.cancelled:
+            raise JobCancelled()
+
+    def progress(self, done, total, message="", partial=None, force=False):
+        """
+        Stores progress (throttled to PROGRESS_INTERVAL unless force=True).
+        The first partial output of each row and stage is written at once, so
+        the UI shows new content without waiting for the throttle window.
+        """
+        now = time.monotonic()
+        partial_key = (partial.get("idx"), partial.get("stage")) if isinstance(partial, dict) else None
+        # Строки генерируются параллельно: сравниваем с множеством, а не с последним ключом
+        fresh = partial_key is not None and partial_key not in self._partials_seen
+        if not force and not fresh and now - self._last_write < PROGRESS_INTERVAL:
+            return
+        self._last_write = now
+        if fresh:
+            self._partials_seen.add(partial_key)
+        with _conn_lock:
+            _db().execute(
+                "UPDATE jobs SET done = ?, total = ?, message = ?, partial = ?, checkpoint = ? WHERE id = ?",
+                (done, total, message,
+                 json.dumps(partial, ensure_ascii=False) if partial is not None else None,
+                 json.dumps(self.checkpoint, ensure_ascii=False, default=str), self.job_id),
+            )
+
+
+def _claim(pid):
+    """
+    Takes the oldest queued job, or returns None. Abandoned jobs are re-queued
+    first; those already started JOB_MAX_ATTEMPTS times are failed instead.
+    """
+    now = time.time()
+    with _conn_lock:
+        conn = _db()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_pid = NULL, error = ?, partial = NULL, "
+                "finished_at = ? WHERE status = ? AND heartbeat_at < ? AND attempts >= ?",
+                (
+                    FAILED,
+                    f"Процесс задачи аварийно завершался {JOB_MAX_ATTEMPTS} раз(а) подряд",
+                    now, RUNNING, now - STALE_AFTER, JOB_MAX_ATTEMPTS,
+                ),
+            )
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_pid = NULL WHERE status = ? AND heartbeat_at < ?",
+                (QUEUED, RUNNING, now - STALE_AFTER),
+            )
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, worker_pid = ?, attempts = attempts + 1, "
+                    "started_at = COALESCE(started_at, ?), heartbeat_at = ? WHERE id = ?",
+                    (RUNNING, pid, now, now, row["id"]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    return _decode(row)
+
+
+def _finish(ctx, status, result=None, error=None):
+    with _conn_lock:
+        _db().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, partial = NULL, checkpoint = ?, "
+            "finished_at = ? WHERE id = ?",
+            (status, json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+             error, json.dumps(ctx.checkpoint, ensure_ascii=False, default=str), time.time(), ctx.job_id),
+        )
+
+
+def _heartbeat(pid, state, stop):
+    """Keeps the job and worker alive in the table and watches the cancel flag."""
+    while not stop.wait(HEARTBEAT_INTERVAL):
+        now = time.time()
+        ctx = state.get("ctx")
+        with _conn_lock:
+            conn = _db()
+            conn.execute("UPDATE workers SET heartbeat_at = ? WHERE pid = ?", (now, pid))
+            if ctx is None:
+                continue
+            conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (now, ctx.job_id))
+            requested = conn.execute(
+                "SELECT cancel_requested FROM jobs WHERE id = ?", (ctx.job_id,)
+            ).fetchone()[0]
+        if requested:
+            ctx.cancelled = True
+            if now - requested > CANCEL_GRACE:
+                # Обработчик не реагирует - завершаем процесс, задача уже помечена отмененной
+                _finish(ctx, CANCELLED, error="Остановлена принудительно")
+                os._exit(1)  # pylint: disable=protected-access
+
+
+def work(idle_timeout: float = WORKER_IDLE_TIMEOUT):
+    """Worker loop: runs queued jobs one by one, exits after idle_timeout seconds without work."""
+    pid = os.getpid()
+    with _conn_lock:
+        _db().execute(
+            "INSERT OR REPLACE INTO workers (pid, heartbeat_at) VALUES (?, ?)", (pid, time.time())
+        )
+    # Каждый рабочий процесс при старте убирает устаревшие задачи и файлы
+    cleanup()
+    state = {}
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(pid, state, stop), daemon=True).start()
+    idle_since = time.monotonic()
+    try:
+        while True:
+            job = _claim(pid)
+            if job is None:
+                if time.monotonic() - idle_since > idle_timeout:
+                    return
+                time.sleep(1.0)
+                continue
+            ctx = JobContext(job)
+            state["ctx"] = ctx
+            try:
+                result = HANDLERS[job["kind"]](ctx)
+                _finish(ctx, DONE, result=result)
+            except JobCancelled:
+                _finish(ctx, CANCELLED)
+            except Exception as e: # pylint: disable=broad-exception-caught
+                _finish(ctx, CANCELLED if ctx.cancelled else FAILED, error=str(e))
+            finally:
+                state.pop("ctx", None)
+                idle_since = time.monotonic()
+    finally:
+        stop.set()
+        with _conn_lock:
+            _db().execute("DELETE FROM workers WHERE pid = ?", (pid,))
+
+
+# --- Обработчики ---
+
+def _project_row(meta):
+    """Дополняет метаданные страницы пустыми колонками проекта."""
+    meta["Выбрать"] = False
+    meta["Keywords"] = ""
+    meta["New Description"] = ""
+    meta["Text"] = ""
+    return meta
+
+
+def _run_crawl(ctx):
+    """
+    Collects pages into the project. params: sheet_id, source_url,
+    mode ("page" | "crawl" | "sitemap"), head_only, max_depth, max_pages,
+    include, exclude, modified_since (ISO date).
+    """
+    # pylint: disable=import-outside-toplevel
+    from itertools import islice
+    from services import crawler, parser, project_store, sitemap
+
+    p = ctx.params
+    sheet_id = p["sheet_id"]
+    project_store.open_project(sheet_id)
+    existing = project_store.links(sheet_id)
+    pending = []
+    added = 0
+    scanned = 0
+    batch_size = 25
+    total = 0
+    errors = []
+
+    def _collect(link, meta):
+        nonlocal added, scanned, pending
+        ctx.check_cancelled()
+        scanned += 1
+        if meta and meta["Link"] not in existing:
+            existing.add(meta["Link"])
+            pending.append(_project_row(meta))
+            added += 1
+        if len(pending) >= batch_size:
+            project_store.add_rows(sheet_id, pending)
+            pending = []
+        ctx.progress(scanned, total, f"Обработано: {scanned}, добавлено: {added}: {link}")
+
+    try:
+        if p["mode"] == "crawl":
+            total = int(p.get("max_pages", 1000))
+            pages = crawler.crawl_site(
+                p["source_url"],
+                max_depth=int(p.get("max_depth", 2)),
+                max_pages=total,
+                include=p.get("include") or [],
+                exclude=p.get("exclude") or [],
+            )
+            with closing(pages) as results:
+                for meta in results:
+                    _collect(meta["Link"], meta)
+        elif p["mode"] == "sitemap":
+            modified_since = (
+                datetime.fromisoformat(p["modified_since"]) if p.get("modified_since") else None
+            )
+            # Ссылки из sitemap читаются потоком и уходят на сбор метаданных порциями
+            with closing(sitemap.iter_sitemap_urls(p["source_url"], modified_since)) as entries:
+
+                def _new_links():
+                    try:
+                        for loc, _ in entries:
+                            if loc not in existing:
+                                yield loc
+                    except sitemap.SitemapError as e:
+                        # Нечитаемые sitemap не обрывают импорт, но попадают в результат
+                        errors.extend(e.errors)
+
+                new_links = _new_links()
+                while True:
+                    chunk = list(dict.fromkeys(islice(new_links, 500)))
+                    if not chunk:
+                        break
+                    total += len(chunk)
+                    with closing(parser.iter_page_metadata(chunk, head_only=p.get("head_only"))) as results:
+                        for link, meta in results:
+                            _collect(link, meta)
+        else:
+            res = parser.parse_source_page(p["source_url"])
+            if "error" in res:
+                raise RuntimeError(res["error"])
+            new_links = [link for link in res["links"] if link not in existing]
+            total = len(new_links)
+            with closing(parser.iter_page_metadata(new_links, head_only=p.get("head_only"))) as results:
+                for link, meta in results:
+                    _collect(link, meta)
+    finally:
+        # Уже собранное сохраняем и при отмене
+        if pending:
+            project_store.add_rows(sheet_id, pending)
+    if errors and not scanned:
+        raise RuntimeError("; ".join(errors))
+    message = f"Готово. Добавлено страниц: {added}"
+    if errors:
+        message += f". Не прочитано sitemap: {len(errors)}"
+    ctx.progress(scanned, total, message, force=True)
+    return {"scanned": scanned, "added": added, "errors": errors}
+
+
+def _with_selection(updates, params):
+    """Снимает галочку "Выбрать" с готовой строки, если строки выбирались вручную."""
+    if params.get("selected"):
+        updates["Выбрать"] = False
+    return updates
+
+
+def _default_indices(ctx, rows, column):
+    """
+    Fixes the job's target rows in the checkpoint: the given indices or, when
+    none were given, the rows where column is empty at the first start (so a
+    resumed job keeps the same targets).
+    """
+    if "indices" not in ctx.checkpoint:
+        indices = ctx.params.get("indices")
+        if indices is None:
+            indices = [i for i, row in enumerate(rows) if not str(row.get(column, "")).strip()]
+        ctx.checkpoint["indices"] = list(indices)
+
+
+def _run_meta(ctx):
+    """
+    Generates meta descriptions. params: sheet_id, indices (row positions;
+    default: rows with an empty "New Description"), batch_size, selected
+    (clear the "Выбрать" mark of finished rows).
+    Rows finished before a restart are skipped (checkpoint).
+    """
+    # pylint: disable=import-outside-toplevel
+    from services import ai_engine, project_store
+
+    p = ctx.params
+    sheet_id = p["sheet_id"]
+    ai_engine.configure_gemini(os.getenv("GEMINI_API_KEY"))
+    rows = project_store.get_project_data(sheet_id)
+    _default_indices(ctx, rows, "New Description")
+    done = set(ctx.checkpoint.get("done", []))
+    indices = [i for i in ctx.checkpoint["indices"] if i < len(rows) and i not in done]
+    batch_size = int(p.get("batch_size") or ai_engine.META_BATCH_SIZE)
+    batches = [indices[start:start + batch_size] for start in range(0, len(indices), batch_size)]
+    total = len(ctx.checkpoint["indices"])
+    processed = total - len(indices)
+    failed = 0
+
+    def _batch(batch):
+        items = [
+            {
+                "id": idx,
+                "title": rows[idx].get("Title", ""),
+                "keywords": rows[idx].get("Keywords", ""),
+                "description": rows[idx].get("Description", ""),
+            }
+            for idx in batch
+        ]
+        return ai_engine.generate_descriptions_batch(items)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=ai_engine.MAX_CONCURRENCY) as executor:
+        futures = {executor.submit(_batch, batch): batch for batch in batches}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                ctx.check_cancelled()
+                batch = futures[future]
+                try:
+                    results = future.result()
+                except Exception: # pylint: disable=broad-exception-caught
+                    results = {}
+                failed += len(batch) - len(results)
+                for idx, text in results.items():
+                    project_store.update_row(sheet_id, idx, _with_selection({"New Description": text}, p))
+                # В контрольной точке только успешные строки: при возобновлении неудачные повторятся
+                done.update(results)
+                processed += len(batch)
+                ctx.checkpoint["done"] = sorted(done)
+                ctx.progress(processed, total, f"{rows[batch[-1]].get('Title', '')}")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    ctx.progress(processed, total, f"Готово. Не удалось: {failed}", force=True)
+    return {"generated": processed - failed, "failed": failed}
+
+
+def _run_text(ctx):
+    """
+    Generates page texts. params: sheet_id, indices (default: rows with an
+    empty "Text"), speculative_drafts, selected, dictionary (file name of a
+    project dictionary in humanizer.DICTIONARIES_DIR).
+    The text being written is published as partial output.
+    """
+    # pylint: disable=import-outside-toplevel
+    from services import ai_engine, humanizer, parser, project_store
+
+    p = ctx.params
+    sheet_id = p["sheet_id"]
+    replacements_path = None
+    if p.get("dictionary"):
+        # Только файл из папки словарей; битый словарь роняет задачу сразу, а не каждую страницу
+        replacements_path = humanizer.resolve_dictionary(p["dictionary"])
+        humanizer.get_humanizer(replacements_path)
+    ai_engine.configure_gemini(os.getenv("GEMINI_API_KEY"))
+    rows = project_store.get_project_data(sheet_id)
+    _default_indices(ctx, rows, "Text")
+    done = set(ctx.checkpoint.get("done", []))
+    indexed_rows = [(i, rows[i]) for i in ctx.checkpoint["indices"] if i < len(rows) and i not in done]
+    total = len(ctx.checkpoint["indices"])
+    processed = total - len(indexed_rows)
+    failed = 0
+
+    def load_page_context(row):
+        return parser.fetch_page_content(row.get("Link")) or "Контент недоступен"
+
+    events = ai_engine.stream_text_generation(
+        indexed_rows, context_fn=load_page_context,
+        speculative_drafts=int(p.get("speculative_drafts") or 0),
+        replacements_path=replacements_path,
+    )
+    with closing(events):
+        for event in events:
+            # Закрытие генератора отменяет запросы, которые еще в работе
+            ctx.check_cancelled()
+            idx = event["idx"]
+            title = rows[idx].get("Title", "")
+            if not event["done"]:
+                ctx.progress(processed, total, title, partial={
+                    "idx": idx, "title": title, "stage": event["stage"], "text": event["text"],
+                })
+                continue
+            processed += 1
+            if event["error"] is not None:
+                failed += 1
+            else:
+                project_store.update_row(sheet_id, idx, _with_selection({"Text": event["text"]}, p))
+                done.add(idx)
+                ctx.checkpoint["done"] = sorted(done)
+            ctx.progress(processed, total, title, force=True)
+    ctx.progress(processed, total, f"Готово. Не удалось: {failed}", force=True)
+    return {"generated": processed - failed, "failed": failed}
+
+
+def _run_export(ctx):
+    """
+    Exports the project to a file in EXPORTS_DIR. params: sheet_id,
+    format (a key of export.EXPORTERS). The result holds the file path.
+    """
+    # pylint: disable=import-outside-toplevel
+    from services import export, project_store
+
+    p = ctx.params
+    fmt = p.get("format", "xlsx")
+    exporter = export.get_exporter(fmt)
+    rows = project_store.get_project_data(p["sheet_id"])
+    ctx.check_cancelled()
+    ctx.progress(0, len(rows), "Формируем файл...", force=True)
+    os.makedirs(EXPORTS_DIR, exist_ok=True)
+    path = os.path.join(EXPORTS_DIR, f"{ctx.job_id}.{exporter.extension}")
+    with open(path + ".tmp", "wb") as f:
+        exporter.write(rows, f)
+    os.replace(path + ".tmp", path)
+    ctx.progress(len(rows), len(rows), "Готово", force=True)
+    return {"path": path, "format": fmt, "rows": len(rows)}
+
+
+HANDLERS = {
+    "crawl": _run_crawl,
+    "meta": _run_meta,
+    "text": _run_text,
+    "export": _run_export,
+}
+
+
+def _main(argv):
+    if argv[:1] != ["worker"]:
+        print("usage: python -m services.jobs worker")
+        return 2
+    # pylint: disable=import-outside-toplevel
+    from dotenv import load_dotenv
+    from services import project_store
+    load_dotenv(os.path.join(_ROOT, ".env"))
+    try:
+        work()
+    finally:
+        # Перед выходом отправляем в таблицу то, что успели записать локально
+        project_store.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -0,0 +1,249 @@
+"""
+LLM Cache Service
+Content-addressed cache for Gemini responses, keyed on model, prompt and
+generation parameters. Backed by SQLite with TTL and LRU eviction; identical
+requests issued concurrently share one API call. The async methods run SQLite
+in the aio I/O pool, never on the event loop.
+"""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from services import aio
+from services.page_cache import CACHE_DIR
+
+CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+# Время последнего обращения (для LRU) копится в памяти и пишется пачкой
+TOUCH_BATCH = 100
+
+
+def make_key(model_name, prompt, params=None):
+    """Stable hash of everything that influences the model output."""
+    payload = json.dumps(
+        {"model": model_name, "prompt": prompt, "params": params or {}},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """SQLite response store with in-flight request coalescing."""
+
+    def __init__(self, path, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # _lock - счетчики и запросы в работе (берется на event loop, коротко),
+        # _db_lock - соединение SQLite (только из потоков)
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._inflight = {}
+        self._touched = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                created_at REAL,
+                accessed_at REAL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        """Returns a cached response or None (expired entries count as missing)."""
+        now = time.time()
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+        with self._lock:
+            self._touched[key] = now
+            due = len(self._touched) >= TOUCH_BATCH
+        if due:
+            with self._db_lock:
+                self._flush_touched()
+        return row[0]
+
+    def _flush_touched(self):
+        """Writes the batched access times (caller holds _db_lock)."""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        if touched:
+            self._conn.executemany(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                [(at, key) for key, at in touched.items()],
+            )
+            self._conn.commit()
+
+    def get_any(self, keys):
+        """Returns the first cached response among keys (counted as a hit), or None."""
+        for key in keys:
+            cached = self.get(key)
+            if cached is not None:
+                with self._lock:
+                    self.hits += 1
+                return cached
+        return None
+
+    async def aget_any(self, keys):
+        """get_any() off the event loop."""
+        return await aio.run_io(self.get_any, list(keys))
+
+    def put(self, key, model_name, response):
+        """Stores a response and evicts least recently used entries over the limit."""
+        now = time.time()
+        with self._db_lock:
+            # Свежие обращения должны попасть в базу до выбора вытесняемых записей
+            self._flush_touched()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, model_name, response, now, now),
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY accessed_at LIMIT ?)",
+                    (overflow,),
+                )
+                with self._lock:
+                    self.evictions += overflow
+            self._conn.commit()
+
+    def _claim(self, key):
+        """Registers the caller as the owner of a request, or returns the owner's future."""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = concurrent.futures.Future()
+            self._inflight[key] = future
+            return future, True
+
+    def _release(self, key):
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    def get_or_compute(self, key, model_name, compute):
+        """
+        Returns the cached response for key, or calls compute() once and stores
+        its result. Concurrent callers with the same key wait for that one call.
+        """
+        cached = self.get(key)
+        if cached is not None:
+            with self._lock:
+                self.hits += 1
+            return cached
+
+        future, owner = self._claim(key)
+        if not owner:
+            return future.result()
+
+        try:
+            # Пока мы ждали, ответ мог сохранить другой поток
+            cached = self.get(key)
+            if cached is not None:
+                with self._lock:
+                    self.hits += 1
+                future.set_result(cached)
+                return cached
+            with self._lock:
+                self.misses += 1
+            response = compute()
+            if response:
+                self.put(key, model_name, response)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._release(key)
+
+    async def aget_or_compute(self, key, model_name, acompute):
+        """
+        Async counterpart of get_or_compute(): acompute is a zero-argument
+        coroutine function. Coalesces with both sync and async callers.
+        """
+        cached = await aio.run_io(self.get, key)
+        if cached is not None:
+            with self._lock:
+                self.hits += 1
+            return cached
+
+        future, owner = self._claim(key)
+        if not owner:
+            # shield: отмена ожидающей корутины не должна отменять общий запрос
+            return await asyncio.shield(asyncio.wrap_future(future))
+
+        try:
+            with self._lock:
+                self.misses += 1
+            response = await acompute()
+            if response:
+                await aio.run_io(self.put, key, model_name, response)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._release(key)
+
+    def stats(self):
+        """Hit/miss counters for this process."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache():
+    """Returns the process-wide LLM cache, or None if caching is disabled."""
+    global _CACHE  # pylint: disable=global-statement
+    if not CACHE_ENABLED:
+        return None
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = LLMCache(os.path.join(CACHE_DIR, "llm.sqlite"))
+    return _CACHE
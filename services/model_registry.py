@@ -0,0 +1,145 @@
+"""
+Model Registry
+Process-wide Gemini configuration and model instances with health-based routing.
+Tracks latency and error rate per model, routes requests to the fastest healthy
+one and takes failing models out of rotation with a circuit breaker.
+"""
+
+import os
+import threading
+import time
+
+import google.generativeai as genai
+
+# Порядок - приоритет при равном здоровье
+MODEL_NAMES = [
+    name.strip()
+    for name in os.getenv(
+        "GEMINI_MODELS", "gemini-flash-latest,gemini-pro-latest"
+    ).split(",")
+    if name.strip()
+]
+# Сколько ошибок подряд размыкают "предохранитель" модели и на сколько секунд
+BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "3"))
+BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "60"))
+# Сглаживание EWMA для задержки и доли ошибок
+_ALPHA = 0.2
+
+
+class ModelHealth:
+    """Rolling health of one model name."""
+
+    def __init__(self, priority):
+        self.priority = priority
+        self.latency = None
+        self.error_rate = 0.0
+        self.failures_in_row = 0
+        self.opened_at = None
+        self.calls = 0
+
+    def is_open(self, now):
+        """True while the breaker keeps the model out of rotation."""
+        return self.opened_at is not None and now - self.opened_at < BREAKER_COOLDOWN
+
+    def score(self):
+        """
+        Lower is better. Measured healthy models first, by expected latency
+        inflated by the error rate; then untried models by priority; models
+        whose last calls failed go last, the more failures the later.
+        """
+        if self.failures_in_row:
+            return (2, self.failures_in_row, self.priority)
+        if self.latency is None:
+            return (1, 0.0, self.priority)
+        return (0, self.latency * (1 + 4 * self.error_rate), self.priority)
+
+
+class ModelRegistry:
+    """Configures genai once and hands out shared GenerativeModel instances."""
+
+    def __init__(self, names=None):
+        self.names = list(names or MODEL_NAMES)
+        self._health = {name: ModelHealth(i) for i, name in enumerate(self.names)}
+        self._models = {}
+        self._api_key = None
+        self._lock = threading.Lock()
+
+    def configure(self, api_key):
+        """Configures the SDK; repeated calls with the same key are no-ops."""
+        with self._lock:
+            if api_key == self._api_key:
+                return
+            genai.configure(api_key=api_key)
+            self._api_key = api_key
+            # Модели держат ссылку на старый клиент - пересоздадим их
+            self._models.clear()
+
+    def get_model(self, name):
+        """Returns the shared GenerativeModel for name."""
+        with self._lock:
+            model = self._models.get(name)
+            if model is None:
+                model = self._models[name] = genai.GenerativeModel(name)
+            return model
+
+    def candidates(self):
+        """
+        Model names to try, best first. Models with an open breaker are skipped;
+        if every breaker is open, the one that opened first gets a trial call.
+        """
+        now = time.monotonic()
+        with self._lock:
+            closed = [n for n in self.names if not self._health[n].is_open(now)]
+            if closed:
+                return sorted(closed, key=lambda n: self._health[n].score())
+            return [min(self.names, key=lambda n: self._health[n].opened_at)]
+
+    def record_success(self, name, latency):
+        """Feeds a successful call into the model's health."""
+        with self._lock:
+            health = self._health[name]
+            health.calls += 1
+            health.latency = (
+                latency if health.latency is None
+                else (1 - _ALPHA) * health.latency + _ALPHA * latency
+            )
+            health.error_rate *= 1 - _ALPHA
+            health.failures_in_row = 0
+            health.opened_at = None
+
+    def record_failure(self, name):
+        """Feeds a failed call into the model's health; may open the breaker."""
+        with self._lock:
+            health = self._health[name]
+            health.calls += 1
+            health.error_rate = (1 - _ALPHA) * health.error_rate + _ALPHA
+            health.failures_in_row += 1
+            if health.failures_in_row >= BREAKER_THRESHOLD:
+                health.opened_at = time.monotonic()
+
+    def stats(self):
+        """Per-model health snapshot."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                name: {
+                    "latency": h.latency,
+                    "error_rate": h.error_rate,
+                    "calls": h.calls,
+                    "open": h.is_open(now),
+                }
+                for name, h in self._health.items()
+            }
+
+
+_REGISTRY = None
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_registry():
+    """Returns the process-wide model registry."""
+    global _REGISTRY  # pylint: disable=global-statement
+    with _REGISTRY_LOCK:
+        if _REGISTRY is None:
+            _REGISTRY = ModelRegistry()
+    return _REGISTRY
@@ -0,0 +1,198 @@
+"""
+Page Cache Service
+On-disk cache of downloaded pages keyed by canonical URL.
+Stores the body, response headers, validators (ETag / Last-Modified) and
+fields extracted from the page, so metadata and content extraction share
+one download and one parse.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import urlsplit, urlunsplit
+
+CACHE_DIR = os.getenv(
+    "PAGE_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), ".cache"),
+)
+# Сколько секунд запись считается свежей без повторной проверки на сервере
+CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", str(24 * 3600)))
+CACHE_ENABLED = os.getenv("PAGE_CACHE_ENABLED", "1") != "0"
+# Вытеснение: записи старше MAX_AGE удаляются, а при превышении MAX_MB
+# удаляются самые давно проверенные, пока кэш не сожмется до 90% лимита
+CACHE_MAX_AGE = int(os.getenv("PAGE_CACHE_MAX_AGE", str(30 * 24 * 3600)))
+CACHE_MAX_MB = float(os.getenv("PAGE_CACHE_MAX_MB", "500"))
+# Проверка лимитов раз в столько записей (и при открытии кэша)
+PRUNE_EVERY = 500
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonical_url(url):
+    """Lowercases scheme/host, drops default ports and fragments."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != _DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    path = parts.path or "/"
+    return urlunsplit((scheme, host, path, parts.query, ""))
+
+
+class PageCache:
+    """SQLite-backed page store, safe to share between threads."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                status INTEGER,
+                headers TEXT,
+                body BLOB,
+                etag TEXT,
+                last_modified TEXT,
+                fields TEXT,
+                fetched_at REAL,
+                size INTEGER
+            )
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(pages)")}
+        if "size" not in columns:
+            # Кэш, созданный до появления вытеснения
+            self._conn.execute("ALTER TABLE pages ADD COLUMN size INTEGER")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS pages_fetched_at ON pages (fetched_at)"
+        )
+        self._conn.commit()
+        self._puts = 0
+        self.prune()
+
+    def get(self, url):
+        """Returns the cached entry as a fetcher-style result, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, headers, body, etag, last_modified, fields, fetched_at "
+                "FROM pages WHERE url = ?",
+                (canonical_url(url),),
+            ).fetchone()
+        if row is None:
+            return None
+        status, headers, body, etag, last_modified, fields, fetched_at = row
+        return {
+            "url": url,
+            "status": status,
+            "headers": json.loads(headers),
+            "text": zlib.decompress(body).decode("utf-8") if body else "",
+            "error": None,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fields": json.loads(fields) if fields else {},
+            "fetched_at": fetched_at,
+        }
+
+    def put(self, url, result):
+        """Stores a fresh 200 response; previously extracted fields are dropped."""
+        headers = result["headers"]
+        body = zlib.compress(result["text"].encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages "
+                "(url, status, headers, body, etag, last_modified, fields, fetched_at, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, NULL, ?, ?)",
+                (
+                    canonical_url(url),
+                    result["status"],
+                    json.dumps(headers),
+                    body,
+                    headers.get("etag"),
+                    headers.get("last-modified"),
+                    time.time(),
+                    len(body),
+                ),
+            )
+            self._conn.commit()
+            self._puts += 1
+            due = self._puts % PRUNE_EVERY == 0
+        if due:
+            self.prune()
+
+    def touch(self, url):
+        """Marks an entry as revalidated (server answered 304)."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE pages SET fetched_at = ? WHERE url = ?",
+                (time.time(), canonical_url(url)),
+            )
+            self._conn.commit()
+
+    def prune(self, max_age=None, max_bytes=None):
+        """
+        Evicts entries not revalidated for max_age seconds (default
+        PAGE_CACHE_MAX_AGE), then the least recently validated ones while the
+        stored bodies exceed max_bytes (default PAGE_CACHE_MAX_MB).
+        Returns the number of removed entries.
+        """
+        max_age = CACHE_MAX_AGE if max_age is None else max_age
+        max_bytes = int(CACHE_MAX_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        with self._lock:
+            removed = self._conn.execute(
+                "DELETE FROM pages WHERE fetched_at < ?", (time.time() - max_age,)
+            ).rowcount
+            total = self._conn.execute(
+                "SELECT COALESCE(SUM(COALESCE(size, length(body))), 0) FROM pages"
+            ).fetchone()[0]
+            if total > max_bytes:
+                target = max_bytes * 0.9
+                evict = []
+                for url, size in self._conn.execute(
+                    "SELECT url, COALESCE(size, length(body), 0) FROM pages ORDER BY fetched_at"
+                ):
+                    if total <= target:
+                        break
+                    evict.append((url,))
+                    total -= size
+                self._conn.executemany("DELETE FROM pages WHERE url = ?", evict)
+                removed += len(evict)
+            self._conn.commit()
+        return removed
+
+    def set_fields(self, url, fields):
+        """Merges extracted fields (metadata, content...) into an entry."""
+        key = canonical_url(url)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fields FROM pages WHERE url = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return
+            merged = json.loads(row[0]) if row[0] else {}
+            merged.update(fields)
+            self._conn.execute(
+                "UPDATE pages SET fields = ? WHERE url = ?",
+                (json.dumps(merged, ensure_ascii=False), key),
+            )
+            self._conn.commit()
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache():
+    """Returns the process-wide page cache, or None if caching is disabled."""
+    global _CACHE  # pylint: disable=global-statement
+    if not CACHE_ENABLED:
+        return None
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = PageCache(os.path.join(CACHE_DIR, "pages.sqlite"))
+    return _CACHE
@@ -3,10 +3,20 @@ Parser Service
 Handles URL parsing, metadata fetching, and content extraction.
 """
 
+from html.parser import HTMLParser
 from urllib.parse import urljoin, urlparse, urldefrag
-import requests
 from bs4 import BeautifulSoup
 
+try:
+    import lxml.html as lxml_html
+except ImportError:  # lxml необязателен: без него <h1> ищем через html.parser
+    lxml_html = None
+
+from services import fetcher, page_cache
+
+# Сколько текста страницы сохраняем в кэше для AI-контекста
+CONTENT_CACHE_CHARS = 20000
+
 def normalize_url(base_url, link):
     """Normalizes a link to be absolute and without fragments."""
     # Make absolute
@@ -29,22 +39,8 @@ def is_valid_url(url, base_domain):
         return False
     return True
 
-def parse_source_page(source_url: str):
-    """Parses a source page for links."""
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
-        "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
-    }
-    try:
-        response = requests.get(source_url, timeout=10, headers=headers)
-        response.raise_for_status()
-    except Exception as e: # pylint: disable=broad-exception-caught
-        return {"error": f"Ошибка запроса: {str(e)}", "links": []}
-
-    soup = BeautifulSoup(response.text, 'html.parser')
-    base_domain = urlparse(source_url).netloc
-
+def _extract_links(soup, page_url, base_domain):
+    """Collects valid same-domain links from a parsed page."""
     links = set()
     for a in soup.find_all('a', href=True):
         href = a['href']
@@ -52,28 +48,13 @@ def parse_source_page(source_url: str):
         if href.startswith(('mailto:', 'tel:', 'javascript:', '#')):
             continue
 
-        normalized = normalize_url(source_url, href)
+        normalized = normalize_url(page_url, href)
         if is_valid_url(normalized, base_domain):
             links.add(normalized)
+    return links
 
-    return {"links": list(links), "count": len(links)}
-
-def fetch_page_metadata(url: str):
-    """Fetches title and description from a URL."""
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
-    }
-    try:
-        response = requests.get(url, timeout=10, headers=headers)
-        # We process even if 404? No, raise
-        if response.status_code != 200:
-            return None
-    except Exception: # pylint: disable=broad-exception-caught
-        return None
-
-    soup = BeautifulSoup(response.text, 'html.parser')
-
+def _extract_metadata(soup, url):
+    """Extracts title and description from a parsed page."""
     title = soup.title.string.strip() if soup.title and soup.title.string else ""
     if not title:
         # Fallback to h1 or url
@@ -93,28 +74,206 @@ def fetch_page_metadata(url: str):
         "Description": description
     }
 
-def fetch_page_content(url: str, max_chars: int = 5000):
+def _extract_content(soup, max_chars):
+    """Extracts visible body text. Mutates the soup, so call it last."""
+    # Remove scripts and styles
+    for script in soup(["script", "style", "nav", "footer", "header"]):
+        script.extract()
+
+    text = soup.get_text(separator=' ', strip=True)
+    return text[:max_chars]
+
+def _analyze(result, base_domain=None):
     """
-    Fetches the body text of a page for AI context.
+    Parses a fetched page once and extracts everything we need from it:
+    metadata, body text and (when base_domain is given) outgoing links.
+    Metadata and text are stored in the page cache, so later calls for the
+    same page skip both the download and the parse.
+    Returns None for failed pages.
     """
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
-    }
-    try:
-        response = requests.get(
-            url,
-            timeout=10,
-            headers=headers
-        )
-        if response.status_code != 200:
+    if result["error"] or result["status"] != 200:
+        return None
+    url = result["url"]
+    fields = result.get("fields") or {}
+    if base_domain is None and "meta" in fields and "content" in fields:
+        return {"meta": dict(fields["meta"], Link=url), "content": fields["content"]}
+
+    soup = BeautifulSoup(result["text"], 'html.parser')
+    analysis = {"meta": _extract_metadata(soup, url)}
+    if base_domain is not None:
+        analysis["links"] = _extract_links(soup, url, base_domain)
+    analysis["content"] = _extract_content(soup, CONTENT_CACHE_CHARS)
+
+    cache = page_cache.get_cache()
+    if cache is not None:
+        cache.set_fields(url, {"meta": analysis["meta"], "content": analysis["content"]})
+    return analysis
+
+def _metadata_from_result(result):
+    """Turns a fetcher result into metadata (None for failed pages)."""
+    analysis = _analyze(result)
+    return analysis["meta"] if analysis else None
+
+class _HeadMetadataExtractor(HTMLParser):
+    """
+    Incremental extractor for <title>, <meta name="description"> and <h1>.
+    Fed chunk by chunk while the page streams in; `done` turns true as soon as
+    the rest of the body cannot change the result. Only pages without a title
+    need the <h1>: for them the raw HTML is buffered up to the first </h1>
+    and handed to a fast parser once.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.description = None
+        self.head_closed = False
+        self._title_parts = []
+        self._in_title = False
+        self._title_seen = False
+        self._raw = []
+        self._h1_mode = False
+        self._h1_closed = False
+        self._tail = ""
+
+    @property
+    def title(self):
+        """Title collected so far."""
+        return "".join(self._title_parts).strip()
+
+    @property
+    def done(self):
+        """True when the remaining body is irrelevant."""
+        if self._h1_mode:
+            return self._h1_closed
+        if self.title and self.description is not None:
+            return True
+        return self.head_closed and bool(self.title)
+
+    def feed(self, data):
+        self._raw.append(data)
+        if self._h1_mode:
+            self._check_h1(data)
+            return
+        super().feed(data)
+        if self.head_closed and not self.title:
+            self._h1_mode = True
+            self._check_h1("".join(self._raw))
+
+    def _check_h1(self, data):
+        window = (self._tail + data).lower()
+        if "</h1" in window:
+            self._h1_closed = True
+        self._tail = window[-4:]
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title" and not self._title_seen:
+            self._in_title = True
+        elif tag == "meta" and self.description is None:
+            attrs = dict(attrs)
+            if (attrs.get("name") or "").lower() == "description":
+                self.description = (attrs.get("content") or "").strip()
+        elif tag in ("body", "h1"):
+            self.head_closed = True
+
+    def handle_endtag(self, tag):
+        if tag == "title" and self._in_title:
+            self._in_title = False
+            self._title_seen = True
+        elif tag == "head":
+            self.head_closed = True
+
+    def handle_data(self, data):
+        if self._in_title:
+            self._title_parts.append(data)
+
+    def _find_h1(self):
+        html = "".join(self._raw)
+        if not html.strip():
             return ""
-        soup = BeautifulSoup(response.text, 'html.parser')
+        if lxml_html is not None:
+            try:
+                h1 = lxml_html.fromstring(html).find(".//h1")
+                return h1.text_content().strip() if h1 is not None else ""
+            except Exception: # pylint: disable=broad-exception-caught
+                pass
+        h1 = BeautifulSoup(html, 'html.parser').find('h1')
+        return h1.text.strip() if h1 else ""
+
+    def metadata(self, url):
+        """Builds the same dict as fetch_page_metadata from what was read."""
+        title = self.title or self._find_h1() or url
+        return {
+            "Title": title,
+            "Link": url,
+            "Description": self.description or ""
+        }
+
+def _metadata_from_head(result):
+    """Turns a streamed fetch_head result into metadata (None for failed pages)."""
+    if result["error"] or result["status"] != 200:
+        return None
+    return result["extractor"].metadata(result["url"])
+
+def _new_head_extractor(_url):
+    return _HeadMetadataExtractor()
+
+def parse_page(result, base_domain):
+    """
+    Extracts both metadata and outgoing links from one fetcher result,
+    so a crawler does not have to download the page twice.
+    Returns None for failed or non-HTML responses.
+    """
+    if result["error"] or result["status"] != 200:
+        return None
+    content_type = result["headers"].get("content-type", "")
+    if content_type and "html" not in content_type:
+        return None
+    return _analyze(result, base_domain)
+
+def parse_source_page(source_url: str):
+    """Parses a source page for links."""
+    # Страница-источник всегда перепроверяется: на ней появляются новые ссылки
+    result = fetcher.fetch(source_url, max_age=0)
+    if result["error"]:
+        return {"error": f"Ошибка запроса: {result['error']}", "links": []}
+    if result["status"] >= 400:
+        return {"error": f"Ошибка запроса: HTTP {result['status']}", "links": []}
 
-        # Remove scripts and styles
-        for script in soup(["script", "style", "nav", "footer", "header"]):
-            script.extract()
+    soup = BeautifulSoup(result["text"], 'html.parser')
+    base_domain = urlparse(source_url).netloc
+
+    links = _extract_links(soup, source_url, base_domain)
+    return {"links": list(links), "count": len(links)}
 
-        text = soup.get_text(separator=' ', strip=True)
-        return text[:max_chars]
+def fetch_page_metadata(url: str, head_only: bool = False):
+    """
+    Fetches title and description from a URL.
+    head_only streams the page and stops right after <head> (or the first <h1>
+    for pages without a title) instead of downloading and parsing the full body;
+    such pages are not stored in the page cache.
+    """
+    if head_only:
+        return _metadata_from_head(fetcher.fetch_head(url, _HeadMetadataExtractor()))
+    return _metadata_from_result(fetcher.fetch(url))
+
+def iter_page_metadata(urls, head_only: bool = False):
+    """
+    Fetches metadata for many URLs concurrently over the shared pool.
+    Yields (url, metadata or None) in completion order.
+    """
+    if head_only:
+        return fetcher.iter_fetch(
+            urls, transform=_metadata_from_head, extractor_factory=_new_head_extractor
+        )
+    return fetcher.iter_fetch(urls, transform=_metadata_from_result)
+
+def fetch_page_content(url: str, max_chars: int = 5000):
+    """
+    Fetches the body text of a page for AI context.
+    Served from the page cache when the page was already crawled.
+    """
+    try:
+        analysis = _analyze(fetcher.fetch(url))
     except Exception: # pylint: disable=broad-exception-caught
         return ""
+    return analysis["content"][:max_chars] if analysis else ""
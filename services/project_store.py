@@ -0,0 +1,651 @@
+"""
+Project Store Service
+Local SQLite working copy of project sheets. Reads and writes go to disk;
+every local change is queued in an outbox that a background worker pushes
+to Google Sheets, and unchanged sheets are pulled back periodically, so the
+sheet is an eventually consistent mirror. The module-level functions mirror
+services/sheets.py.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from services import sheets
+from services.page_cache import CACHE_DIR
+from services.rate_limiter import backoff_delay, is_retryable
+
+# Как часто отправлять очередь изменений и проверять таблицу на чужие правки
+SYNC_PUSH_INTERVAL = float(os.getenv("PROJECT_SYNC_PUSH_INTERVAL", "2"))
+SYNC_PULL_INTERVAL = float(os.getenv("PROJECT_SYNC_PULL_INTERVAL", "60"))
+# Очередь может разбирать только один процесс: он держит аренду на столько секунд
+SYNC_LEASE_TTL = 120.0
+# После стольких неудачных попыток подряд (или сразу при неисправимой ошибке)
+# очередь таблицы откладывается в outbox_failed, а локальная копия перечитывается
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("PROJECT_SYNC_MAX_ATTEMPTS", "8"))
+
+STATE_NEW = "new"
+STATE_DESCRIPTION = "description"
+STATE_TEXT = "text"
+
+
+def row_state(row: dict) -> str:
+    """Generation state of a row: new, has a new description, or has a text."""
+    if str(row.get("Text") or "").strip():
+        return STATE_TEXT
+    if str(row.get("New Description") or "").strip():
+        return STATE_DESCRIPTION
+    return STATE_NEW
+
+
+def _project(row: dict, columns) -> dict:
+    if columns is None:
+        return row
+    return {h: row.get(h, "") for h in sheets.HEADERS if h in columns or h == "Link"}
+
+
+class ProjectStore:
+    """SQLite rows and outbox per sheet, safe to share between threads."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS rows (
+                sheet_id TEXT,
+                position INTEGER,
+                link TEXT,
+                state TEXT,
+                data TEXT,
+                PRIMARY KEY (sheet_id, position)
+            );
+            CREATE INDEX IF NOT EXISTS rows_link ON rows (sheet_id, link);
+            CREATE INDEX IF NOT EXISTS rows_state ON rows (sheet_id, state);
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sheet_id TEXT,
+                op TEXT,
+                payload TEXT,
+                created_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS outbox_sheet ON outbox (sheet_id, id);
+            CREATE TABLE IF NOT EXISTS projects (
+                sheet_id TEXT PRIMARY KEY,
+                pulled_at REAL,
+                revision TEXT,
+                pushed_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS sync_lease (
+                sheet_id TEXT PRIMARY KEY,
+                owner TEXT,
+                expires REAL
+            );
+            CREATE TABLE IF NOT EXISTS sync_errors (
+                sheet_id TEXT PRIMARY KEY,
+                attempts INTEGER,
+                error TEXT,
+                retry_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS outbox_failed (
+                id INTEGER PRIMARY KEY,
+                sheet_id TEXT,
+                op TEXT,
+                payload TEXT,
+                created_at REAL,
+                error TEXT,
+                failed_at REAL
+            );
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(projects)")}
+        # База, созданная до учета ревизий таблицы
+        for column, kind in (("revision", "TEXT"), ("pushed_at", "REAL")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE projects ADD COLUMN {column} {kind}")
+        self._conn.commit()
+
+    # --- Локальные чтения ---
+
+    def has_project(self, sheet_id):
+        """True if the sheet has been pulled into the store at least once."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM projects WHERE sheet_id = ?", (sheet_id,)
+            ).fetchone() is not None
+
+    def needs_pull(self, sheet_id):
+        """True if the local copy is known to differ from the sheet (dropped outbox)."""
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT pulled_at FROM projects WHERE sheet_id = ?", (sheet_id,)
+            ).fetchone()
+        return found is not None and found[0] is None
+
+    def revision(self, sheet_id):
+        """
+        Sheet revision (Drive modification time) the local copy matches: set by
+        a pull and carried forward by our own pushes. Shared by all processes.
+        """
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT revision FROM projects WHERE sheet_id = ?", (sheet_id,)
+            ).fetchone()
+        return found[0] if found else None
+
+    def _sync_marks(self, sheet_id):
+        """(revision, pushed_at): changes whenever any process pulls or pushes the sheet."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT revision, pushed_at FROM projects WHERE sheet_id = ?", (sheet_id,)
+            ).fetchone()
+
+    def is_stale(self, sheet_id):
+        """True if the sheet was changed by someone else since the local copy was synced."""
+        revision = sheets.get_revision(sheet_id)
+        return revision is None or revision != self.revision(sheet_id)
+
+    def sync_error(self, sheet_id):
+        """Last push error of the sheet (shared by all processes), or None."""
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT error FROM sync_errors WHERE sheet_id = ?", (sheet_id,)
+            ).fetchone()
+        return found[0] if found else None
+
+    def get_rows(self, sheet_id, columns=None):
+        """All rows of the project in sheet order."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT data FROM rows WHERE sheet_id = ? ORDER BY position", (sheet_id,)
+            )
+            return [_project(json.loads(data), columns) for (data,) in cursor]
+
+    def find_by_link(self, sheet_id, link):
+        """(position, row) of the first row with this Link, or None."""
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT position, data FROM rows WHERE sheet_id = ? AND link = ? "
+                "ORDER BY position LIMIT 1",
+                (sheet_id, link),
+            ).fetchone()
+        return (found[0], json.loads(found[1])) if found else None
+
+    def links(self, sheet_id):
+        """Set of Links already in the project."""
+        with self._lock:
+            cursor = self._conn.execute("SELECT link FROM rows WHERE sheet_id = ?", (sheet_id,))
+            return {link for (link,) in cursor}
+
+    def positions_by_state(self, sheet_id, state):
+        """Positions of rows in the given state (see row_state())."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT position FROM rows WHERE sheet_id = ? AND state = ? ORDER BY position",
+                (sheet_id, state),
+            )
+            return [position for (position,) in cursor]
+
+    def pending_ops(self, sheet_id=None):
+        """Number of local changes not yet pushed to the sheet."""
+        with self._lock:
+            if sheet_id is None:
+                return self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE sheet_id = ?", (sheet_id,)
+            ).fetchone()[0]
+
+    # --- Локальные записи (каждая ставит операцию в очередь) ---
+
+    def _enqueue(self, sheet_id, op, payload):
+        self._conn.execute(
+            "INSERT INTO outbox (sheet_id, op, payload, created_at) VALUES (?, ?, ?, ?)",
+            (sheet_id, op, json.dumps(payload, ensure_ascii=False, default=str), time.time()),
+        )
+
+    def _insert_rows(self, sheet_id, start, rows):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO rows (sheet_id, position, link, state, data) VALUES (?, ?, ?, ?, ?)",
+            [
+                (sheet_id, start + i, str(row.get("Link") or ""), row_state(row),
+                 json.dumps(row, ensure_ascii=False, default=str))
+                for i, row in enumerate(rows)
+            ],
+        )
+
+    def _set_rows(self, sheet_id, rows):
+        self._conn.execute("DELETE FROM rows WHERE sheet_id = ?", (sheet_id,))
+        self._insert_rows(sheet_id, 0, rows)
+
+    def add_rows(self, sheet_id, rows):
+        """Appends rows locally and queues the append."""
+        with self._lock:
+            end = self._conn.execute(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM rows WHERE sheet_id = ?", (sheet_id,)
+            ).fetchone()[0]
+            self._insert_rows(sheet_id, end, rows)
+            self._enqueue(sheet_id, "append", rows)
+            self._conn.commit()
+        return len(rows)
+
+    def update_row(self, sheet_id, row_index, updates):
+        """Updates cells of a 0-based row locally and queues the update."""
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT data FROM rows WHERE sheet_id = ? AND position = ?", (sheet_id, row_index)
+            ).fetchone()
+            if found is None:
+                return False
+            row = json.loads(found[0])
+            row.update(updates)
+            self._conn.execute(
+                "UPDATE rows SET link = ?, state = ?, data = ? WHERE sheet_id = ? AND position = ?",
+                (str(row.get("Link") or ""), row_state(row),
+                 json.dumps(row, ensure_ascii=False, default=str), sheet_id, row_index),
+            )
+            self._enqueue(sheet_id, "update", {"row": row_index, "updates": updates})
+            self._conn.commit()
+        return True
+
+    def replace_rows(self, sheet_id, rows):
+        """Replaces all rows locally and queues a full rewrite of the sheet."""
+        with self._lock:
+            self._set_rows(sheet_id, rows)
+            self._enqueue(sheet_id, "replace", rows)
+            self._conn.commit()
+
+    def save_rows(self, sheet_id, old_rows, new_rows):
+        """
+        Replaces all rows locally and queues a diff-based save (old_rows -> new_rows).
+        Columns missing from new_rows (e.g. Text loaded on demand) keep their
+        local values, matched by Link.
+        """
+        with self._lock:
+            by_link = {}
+            for row in self.get_rows(sheet_id):
+                by_link.setdefault(str(row.get("Link") or ""), row)
+
+            def _complete(rows):
+                return [
+                    {**{h: by_link.get(str(row.get("Link") or ""), {}).get(h, "")
+                        for h in sheets.HEADERS}, **row}
+                    for row in rows
+                ]
+
+            # Обе стороны дополняем одинаково - недостающие колонки не попадут в диф
+            new_rows = _complete(new_rows)
+            self._set_rows(sheet_id, new_rows)
+            self._enqueue(sheet_id, "save", {"old": _complete(old_rows), "new": new_rows})
+            self._conn.commit()
+
+    # --- Синхронизация с таблицей ---
+
+    def pull(self, sheet_id, full=False):
+        """
+        Replaces the local copy with the sheet content. A copy in sync is
+        refreshed incrementally (sheets.read_project_changes); full=True, a
+        first load or a copy that lost its outbox read the whole sheet.
+        Skipped (returns False)
+        while local changes are still waiting to be pushed, or when another
+        process pushed or pulled while the sheet was being read (what we read
+        may then be older than the local copy).
+        """
+        if self.pending_ops(sheet_id):
+            return False
+        base = self._sync_marks(sheet_id)
+        if full or base is None or self.needs_pull(sheet_id):
+            rows = sheets.get_project_data(sheet_id)
+        else:
+            rows = sheets.read_project_changes(sheet_id, self.get_rows(sheet_id))
+        revision = sheets.synced_revision(sheet_id)
+        with self._lock:
+            # BEGIN IMMEDIATE: проверка и запись атомарны и для других процессов
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self.pending_ops(sheet_id) or self._sync_marks(sheet_id) != base:
+                    self._conn.execute("ROLLBACK")
+                    return False
+                self._set_rows(sheet_id, rows)
+                self._conn.execute(
+                    "INSERT INTO projects (sheet_id, pulled_at, revision) VALUES (?, ?, ?) "
+                    "ON CONFLICT (sheet_id) DO UPDATE SET pulled_at = excluded.pulled_at, "
+                    "revision = excluded.revision",
+                    (sheet_id, time.time(), revision),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return True
+
+    def _lease(self, sheet_id, owner, release=False):
+        """Takes or renews (or releases) the cross-process right to push the sheet's outbox."""
+        now = time.time()
+        with self._lock:
+            if release:
+                self._conn.execute(
+                    "DELETE FROM sync_lease WHERE sheet_id = ? AND owner = ?", (sheet_id, owner)
+                )
+                self._conn.commit()
+                return True
+            taken = self._conn.execute(
+                "INSERT INTO sync_lease (sheet_id, owner, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT (sheet_id) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+                "WHERE sync_lease.expires < ? OR sync_lease.owner = excluded.owner",
+                (sheet_id, owner, now + SYNC_LEASE_TTL, now),
+            ).rowcount
+            self._conn.commit()
+        return taken == 1
+
+    def push(self, sheet_id):
+        """
+        Sends queued operations to the sheet in order; consecutive cell updates
+        go out as one batch. Stops at the first failure (the rest stays queued).
+        Several processes may share the store: only the lease holder pushes.
+        Returns the number of operations pushed.
+        """
+        with self._lock:
+            backoff = self._conn.execute(
+                "SELECT retry_at FROM sync_errors WHERE sheet_id = ?", (sheet_id,)
+            ).fetchone()
+        if backoff and backoff[0] and backoff[0] > time.time():
+            return 0
+        owner = f"{os.getpid()}:{threading.get_ident()}"
+        if not self._lease(sheet_id, owner):
+            return 0
+        try:
+            return self._push(sheet_id, owner)
+        finally:
+            self._lease(sheet_id, owner, release=True)
+
+    def _push(self, sheet_id, owner):
+        with self._lock:
+            ops = self._conn.execute(
+                "SELECT id, op, payload FROM outbox WHERE sheet_id = ? ORDER BY id", (sheet_id,)
+            ).fetchall()
+        if not ops:
+            return 0
+        base = self.revision(sheet_id)
+        # Копия совпадала с таблицей до отправки - тогда новая ревизия наша
+        in_sync = base is not None and sheets.get_revision(sheet_id) == base
+        pushed = 0
+        i = 0
+        while i < len(ops):
+            if not self._lease(sheet_id, owner):
+                break
+            try:
+                j = self._apply(sheet_id, ops, i)
+            except Exception as e: # pylint: disable=broad-exception-caught
+                self._push_failed(sheet_id, e)
+                break
+            with self._lock:
+                self._conn.execute(
+                    f"DELETE FROM outbox WHERE id IN ({','.join('?' * (j - i))})",
+                    [op_id for op_id, _, _ in ops[i:j]],
+                )
+                self._conn.execute("DELETE FROM sync_errors WHERE sheet_id = ?", (sheet_id,))
+                self._conn.execute(
+                    "UPDATE projects SET pushed_at = ? WHERE sheet_id = ?", (time.time(), sheet_id)
+                )
+                self._conn.commit()
+            pushed += j - i
+            i = j
+        if pushed and in_sync:
+            self._advance_revision(sheet_id, base, sheets.get_revision(sheet_id))
+        return pushed
+
+    def _advance_revision(self, sheet_id, base, revision):
+        """
+        Records the revision produced by our own push, so neither this nor any
+        other process pulls the sheet just because we wrote to it.
+        """
+        if revision is None:
+            return
+        with self._lock:
+            self._conn.execute(
+                "UPDATE projects SET revision = ? WHERE sheet_id = ? AND revision = ?",
+                (revision, sheet_id, base),
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def _apply(sheet_id, ops, i):
+        """Sends ops[i] (and following cell updates) to the sheet; returns the next index."""
+        op = ops[i][1]
+        if op == "update":
+            # Подряд идущие правки ячеек - одним batch_update
+            j = i
+            with sheets.SheetWriter(sheet_id, max_rows=len(ops), max_delay=3600) as writer:
+                while j < len(ops) and ops[j][1] == "update":
+                    payload = json.loads(ops[j][2])
+                    writer.update_row(payload["row"], payload["updates"])
+                    j += 1
+            return j
+        payload = json.loads(ops[i][2])
+        if op == "append":
+            sheets.add_rows(sheet_id, payload)
+        elif op == "replace":
+            sheets.replace_project_data(sheet_id, payload)
+        elif op == "save":
+            sheets.save_project_changes(sheet_id, payload["old"], payload["new"])
+        return i + 1
+
+    def _push_failed(self, sheet_id, error):
+        """
+        Records a failed push. Transient errors are retried with backoff; a
+        permanent error or OUTBOX_MAX_ATTEMPTS failures move the sheet's whole
+        queue to outbox_failed (later ops depend on the failed one) and mark
+        the local copy for a pull, so one bad op cannot block syncing forever.
+        """
+        transient = is_retryable(error) or isinstance(error, OSError)
+        now = time.time()
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT attempts FROM sync_errors WHERE sheet_id = ?", (sheet_id,)
+            ).fetchone()
+            attempts = (found[0] if found else 0) + 1
+            if transient and attempts < OUTBOX_MAX_ATTEMPTS:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sync_errors (sheet_id, attempts, error, retry_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (sheet_id, attempts, str(error), now + backoff_delay(attempts, base=2.0, cap=300.0)),
+                )
+            else:
+                dropped = self._conn.execute(
+                    "INSERT INTO outbox_failed (id, sheet_id, op, payload, created_at, error, failed_at) "
+                    "SELECT id, sheet_id, op, payload, created_at, ?, ? FROM outbox WHERE sheet_id = ?",
+                    (str(error), now, sheet_id),
+                ).rowcount
+                self._conn.execute("DELETE FROM outbox WHERE sheet_id = ?", (sheet_id,))
+                self._conn.execute(
+                    "UPDATE projects SET pulled_at = NULL WHERE sheet_id = ?", (sheet_id,)
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sync_errors (sheet_id, attempts, error, retry_at) "
+                    "VALUES (?, 0, ?, NULL)",
+                    (sheet_id, f"Не отправлено изменений: {dropped}, таблица будет перечитана ({error})"),
+                )
+            self._conn.commit()
+
+    def sheets_with_pending(self):
+        """Sheet ids that have queued operations."""
+        with self._lock:
+            cursor = self._conn.execute("SELECT DISTINCT sheet_id FROM outbox")
+            return [sheet_id for (sheet_id,) in cursor]
+
+
+class SyncWorker:
+    """Background thread that pushes outboxes and pulls tracked sheets."""
+
+    def __init__(self, store):
+        self.store = store
+        self.last_push = None
+        self._errors = {}
+        self._tracked = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def track(self, sheet_id):
+        """Starts mirroring the sheet (periodic pulls when nothing is pending)."""
+        with self._lock:
+            self._tracked.setdefault(sheet_id, time.monotonic())
+
+    def wakeup(self):
+        """Pushes right away instead of waiting for the next tick."""
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(SYNC_PUSH_INTERVAL)
+            self._wakeup.clear()
+            try:
+                pending = self.store.sheets_with_pending()
+            except sqlite3.Error:
+                continue
+            for sheet_id in pending:
+                try:
+                    # Ошибки Google Sheets store записывает сам (по таблице, для всех процессов)
+                    if self.store.push(sheet_id):
+                        self.last_push = time.time()
+                except Exception as e: # pylint: disable=broad-exception-caught
+                    self._errors[sheet_id] = e
+            now = time.monotonic()
+            with self._lock:
+                due = [
+                    s for s, pulled in self._tracked.items()
+                    if now - pulled >= SYNC_PULL_INTERVAL or self.store.needs_pull(s)
+                ]
+            for sheet_id in due:
+                try:
+                    if self.store.needs_pull(sheet_id) or self.store.is_stale(sheet_id):
+                        self.store.pull(sheet_id)
+                    self._errors.pop(sheet_id, None)
+                except Exception as e: # pylint: disable=broad-exception-caught
+                    # Повторим на следующей проверке
+                    self._errors[sheet_id] = e
+                with self._lock:
+                    self._tracked[sheet_id] = time.monotonic()
+
+    def status(self, sheet_id):
+        """Pending operation count, last successful push and the sheet's last error."""
+        error = self.store.sync_error(sheet_id) or self._errors.get(sheet_id)
+        return {
+            "pending": self.store.pending_ops(sheet_id),
+            "last_push": self.last_push,
+            "error": str(error) if error else None,
+        }
+
+
+_STORE = None
+_WORKER = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_store():
+    """Returns the process-wide project store and starts its sync worker."""
+    global _STORE, _WORKER  # pylint: disable=global-statement
+    with _STORE_LOCK:
+        if _STORE is None:
+            _STORE = ProjectStore(os.path.join(CACHE_DIR, "projects.sqlite"))
+            _WORKER = SyncWorker(_STORE)
+    return _STORE
+
+
+def get_sync_worker():
+    """Returns the background sync worker."""
+    get_store()
+    return _WORKER
+
+
+def _key(sheet_id):
+    return sheets.extract_id_from_url(sheet_id)
+
+
+def open_project(sheet_id: str, refresh: bool = False):
+    """
+    Makes the sheet available locally and starts mirroring it. The sheet is
+    pulled the first time; with refresh=True (explicit project load) local
+    changes are pushed first and the whole sheet is read again if it
+    changed (a full read also sees edits of Text cells alone), so edits made
+    in the sheet are never overwritten by a stale copy.
+    Returns the number of rows.
+    """
+    store = get_store()
+    key = _key(sheet_id)
+    if not store.has_project(key):
+        store.pull(key)
+    elif refresh:
+        store.push(key)
+        if store.needs_pull(key) or store.is_stale(key):
+            store.pull(key, full=True)
+    get_sync_worker().track(key)
+    return len(store.get_rows(key, columns=["Link"]))
+
+
+def get_project_data(sheet_id: str, columns: list = None):
+    """Rows of the local copy (same shape as sheets.get_project_data())."""
+    store = get_store()
+    key = _key(sheet_id)
+    if not store.has_project(key):
+        open_project(key)
+    return store.get_rows(key, columns)
+
+
+def refresh_project_data(sheet_id: str, data: list, columns: list = None):
+    """Pulls the sheet now if it changed; returns (rows, changed)."""
+    key = _key(sheet_id)
+    store = get_store()
+    if not store.is_stale(key) or not store.pull(key):
+        return data, False
+    return store.get_rows(key, columns), True
+
+
+def links(sheet_id: str) -> set:
+    """Links already in the project (indexed lookup in the local copy)."""
+    return get_store().links(_key(sheet_id))
+
+
+def flush():
+    """Pushes every queued change right now (e.g. before a worker process exits)."""
+    store = get_store()
+    for sheet_id in store.sheets_with_pending():
+        store.push(sheet_id)
+
+
+def add_rows(sheet_id: str, rows: list):
+    """Appends rows locally; the sheet gets them from the sync worker."""
+    count = get_store().add_rows(_key(sheet_id), rows)
+    get_sync_worker().wakeup()
+    return count
+
+
+def update_row(sheet_id: str, row_index: int, updates: dict):
+    """Updates cells locally; the sheet gets them from the sync worker."""
+    return get_store().update_row(_key(sheet_id), row_index, updates)
+
+
+def replace_project_data(sheet_id: str, new_data: list):
+    """Replaces the project locally and queues a full rewrite of the sheet."""
+    get_store().replace_rows(_key(sheet_id), new_data)
+    get_sync_worker().wakeup()
+    return True
+
+
+def save_project_changes(sheet_id: str, old_data: list, new_data: list) -> dict:
+    """Saves edits locally and queues a diff-based save of the sheet."""
+    store = get_store()
+    key = _key(sheet_id)
+    store.save_rows(key, old_data, new_data)
+    get_sync_worker().wakeup()
+    return {"rows": len(new_data), "pending": store.pending_ops(key)}
+
+
+def sync_status(sheet_id: str) -> dict:
+    """Sync state of the project for the UI."""
+    return get_sync_worker().status(_key(sheet_id))
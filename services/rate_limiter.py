@@ -0,0 +1,189 @@
+"""
+Rate Limiter Service
+Adaptive limiter for Gemini calls: token buckets for requests and tokens per
+minute, concurrency that grows and shrinks with the observed throttling rate
+(AIMD), and retries with jittered exponential backoff on 429/5xx.
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "60"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "5"))
+
+_RETRYABLE_CODES = {429, 500, 502, 503, 504}
+_RETRYABLE_MARKERS = ("429", "503", "quota", "rate limit", "resource has been exhausted",
+                      "overloaded", "unavailable", "deadline exceeded")
+
+
+def is_retryable(exc):
+    """True for throttling and transient server errors (429, 5xx, quota)."""
+    code = getattr(exc, "code", None)
+    try:
+        if int(code) in _RETRYABLE_CODES:
+            return True
+    except (TypeError, ValueError):
+        pass
+    message = str(exc).lower()
+    return any(marker in message for marker in _RETRYABLE_MARKERS)
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def estimate_tokens(text):
+    """Rough token count for quota accounting (≈3 chars per token for Russian)."""
+    return max(1, len(text) // 3)
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `per_minute` units per minute."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` units are available (0 if available now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        """Consumes units; call only after wait_time() returned 0."""
+        self.tokens -= min(amount, self.capacity)
+
+
+class AdaptiveLimiter:
+    """
+    Shared by every thread and coroutine that talks to Gemini.
+    Callers reserve a request slot and an estimated token amount; the allowed
+    concurrency halves on throttling and creeps back up while calls succeed.
+    """
+
+    def __init__(self, rpm=GEMINI_RPM, tpm=GEMINI_TPM,
+                 max_concurrency=GEMINI_MAX_CONCURRENCY, max_retries=GEMINI_MAX_RETRIES):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.limit = float(min(4, max_concurrency))
+        self.active = 0
+        self.error_rate = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, tokens):
+        """Takes a slot and returns 0, or returns how long to wait before retrying."""
+        with self._lock:
+            if self.active >= int(self.limit):
+                return 0.05
+            now = time.monotonic()
+            wait = max(self._requests.wait_time(1, now), self._tokens.wait_time(tokens, now))
+            if wait > 0:
+                return wait
+            self._requests.take(1)
+            self._tokens.take(tokens)
+            self.active += 1
+            self.requests += 1
+            return 0.0
+
+    def _release(self, throttled):
+        with self._lock:
+            self.active -= 1
+            self.error_rate = 0.9 * self.error_rate + 0.1 * (1.0 if throttled else 0.0)
+            if throttled:
+                self.throttled += 1
+                self.limit = max(1.0, self.limit / 2)
+            elif self.error_rate < 0.05:
+                self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+
+    def acquire(self, tokens=1):
+        """Blocks until a request slot and token budget are available."""
+        while True:
+            wait = self._try_acquire(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self, tokens=1):
+        """Async counterpart of acquire()."""
+        while True:
+            wait = self._try_acquire(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def call(self, fn, tokens=1):
+        """Runs fn() under the limiter, retrying throttled and transient failures."""
+        for attempt in range(self.max_retries + 1):
+            self.acquire(tokens)
+            throttled = False
+            try:
+                return fn()
+            except Exception as e:
+                throttled = is_retryable(e)
+                if not throttled or attempt == self.max_retries:
+                    raise
+            finally:
+                # Слот освобождается при любом исходе, включая отмену (BaseException)
+                self._release(throttled=throttled)
+            time.sleep(backoff_delay(attempt))
+        raise RuntimeError("unreachable")
+
+    async def acall(self, coro_fn, tokens=1):
+        """Async counterpart of call(): coro_fn is a zero-argument coroutine function."""
+        for attempt in range(self.max_retries + 1):
+            await self.aacquire(tokens)
+            throttled = False
+            try:
+                return await coro_fn()
+            except Exception as e:
+                throttled = is_retryable(e)
+                if not throttled or attempt == self.max_retries:
+                    raise
+            finally:
+                # asyncio.CancelledError - BaseException: без finally слот бы утек
+                self._release(throttled=throttled)
+            await asyncio.sleep(backoff_delay(attempt))
+        raise RuntimeError("unreachable")
+
+    def stats(self):
+        """Current concurrency window and counters."""
+        with self._lock:
+            return {
+                "concurrency": int(self.limit),
+                "active": self.active,
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "error_rate": self.error_rate,
+            }
+
+
+_LIMITER = None
+_LIMITER_LOCK = threading.Lock()
+
+
+def get_limiter():
+    """Returns the process-wide Gemini limiter."""
+    global _LIMITER  # pylint: disable=global-statement
+    with _LIMITER_LOCK:
+        if _LIMITER is None:
+            _LIMITER = AdaptiveLimiter()
+    return _LIMITER
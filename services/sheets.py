@@ -3,16 +3,45 @@ Sheets Service
 Handles Google Sheets interactions using gspread.
 """
 
+import math
 import os
+import threading
+import time
 from datetime import datetime
+from difflib import SequenceMatcher
 import gspread
+from gspread.utils import numericise, rowcol_to_a1
 from oauth2client.service_account import ServiceAccountCredentials
 
+from services.rate_limiter import backoff_delay, is_retryable
+
 import re
 
 # Build logic for authentication
 # Assuming credentials.json is in the root backend folder
 SCOPE = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+HEADERS = ["Выбрать", "Title", "Link", "Keywords", "Description", "New Description", "Text"]
+# Токен сервисного аккаунта живет час - пересоздаем клиента заранее
+CLIENT_TTL = int(os.getenv("SHEETS_CLIENT_TTL", "2700"))
+# Отложенная запись: сбрасываем буфер каждые N строк или T секунд
+FLUSH_ROWS = int(os.getenv("SHEETS_FLUSH_ROWS", "25"))
+FLUSH_SECONDS = float(os.getenv("SHEETS_FLUSH_SECONDS", "5"))
+WRITE_RETRIES = int(os.getenv("SHEETS_WRITE_RETRIES", "5"))
+# Постраничное чтение: строк за один batch_get
+PAGE_SIZE = int(os.getenv("SHEETS_PAGE_SIZE", "2000"))
+# Колонки для списка проекта; длинные тексты догружаются по требованию
+LIST_COLUMNS = [h for h in HEADERS if h != "Text"]
+# Диапазонов в одном batch_get при точечном чтении длинных колонок
+RANGES_PER_CALL = 100
+
+_client = None
+_client_created = 0.0
+_client_lock = threading.Lock()
+# sheet_id -> {"worksheet": Worksheet, "headers": [..]}
+_worksheets = {}
+_worksheets_lock = threading.Lock()
+# sheet_id -> время изменения файла на момент последней загрузки
+_sync_state = {}
 
 def extract_id_from_url(input_str: str) -> str:
     """Extracts the spreadsheet ID from a full Google Sheets URL or returns the ID if already one."""
@@ -27,8 +56,8 @@ def extract_id_from_url(input_str: str) -> str:
 
 import json
 
-def get_client():
-    """Authenticates and returns a gspread client."""
+def _authorize():
+    """Authenticates and returns a new gspread client."""
     # Priority 1: Environment variable (good for Railway)
     creds_json = os.getenv("GOOGLE_SHEETS_CREDENTIALS")
     if creds_json:
@@ -50,17 +79,80 @@ def get_client():
         "or ensure credentials.json exists in the root directory."
     )
 
+def get_client(refresh: bool = False):
+    """
+    Returns the shared gspread client, authorizing on first use.
+    The client is rebuilt after CLIENT_TTL seconds or when refresh=True
+    (e.g. after an auth error); cached worksheet handles are dropped with it.
+    """
+    global _client, _client_created  # pylint: disable=global-statement
+    with _client_lock:
+        if refresh or _client is None or time.monotonic() - _client_created > CLIENT_TTL:
+            _client = _authorize()
+            _client_created = time.monotonic()
+            invalidate()
+        return _client
+
+def _is_auth_error(exc) -> bool:
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None) == 401
+
+def _call(fn):
+    """
+    Runs fn(); on an auth error rebuilds the client and retries once.
+    fn must look up its worksheet via get_worksheet() so the retry uses the new client.
+    """
+    try:
+        return fn()
+    except gspread.exceptions.APIError as e:
+        if not _is_auth_error(e):
+            raise
+        get_client(refresh=True)
+        return fn()
+
+def invalidate(sheet_id: str = None):
+    """Drops cached worksheet handles and headers (all sheets if sheet_id is None)."""
+    with _worksheets_lock:
+        if sheet_id is None:
+            _worksheets.clear()
+        else:
+            _worksheets.pop(extract_id_from_url(sheet_id), None)
+
+def _get_handle(sheet_id: str) -> dict:
+    key = extract_id_from_url(sheet_id)
+    with _worksheets_lock:
+        handle = _worksheets.get(key)
+    if handle is None:
+        worksheet = _call(lambda: get_client().open_by_key(key).get_worksheet(0))
+        handle = {"worksheet": worksheet, "headers": None}
+        with _worksheets_lock:
+            handle = _worksheets.setdefault(key, handle)
+    return handle
+
+def get_worksheet(sheet_id: str):
+    """Returns the cached first worksheet of the project sheet."""
+    return _get_handle(sheet_id)["worksheet"]
+
+def get_headers(sheet_id: str, refresh: bool = False) -> list:
+    """Returns the cached header row of the project sheet."""
+    handle = _get_handle(sheet_id)
+    if refresh or handle["headers"] is None:
+        headers = _call(lambda: get_worksheet(sheet_id).row_values(1))
+        handle = _get_handle(sheet_id)
+        handle["headers"] = headers
+    return handle["headers"]
+
 def create_project_sheet(project_name: str):
     """Creates a new Google Sheet for the project."""
-    client = get_client()
-    sh = client.create(project_name)
-    sh.share(client.auth.service_account_email, perm_type='user', role='owner')
+    sh = _call(lambda: get_client().create(project_name))
+    sh.share(get_client().auth.service_account_email, perm_type='user', role='owner')
     # Or share with user's email if provided
 
     # Initialize headers
     worksheet = sh.get_worksheet(0)
-    headers = ["Выбрать", "Title", "Link", "Keywords", "Description", "New Description", "Text"]
-    worksheet.append_row(headers)
+    worksheet.append_row(HEADERS)
+    with _worksheets_lock:
+        _worksheets[sh.id] = {"worksheet": worksheet, "headers": list(HEADERS)}
 
     # Return metadata
     return {
@@ -70,45 +162,201 @@ def create_project_sheet(project_name: str):
         "created_at": datetime.now().isoformat()
     }
 
-def get_project_data(sheet_id: str):
-    """Fetches all data from the project sheet."""
-    client = get_client()
-    sh = client.open_by_key(extract_id_from_url(sheet_id))
-    worksheet = sh.get_worksheet(0)
-    data = worksheet.get_all_records()
+def _column_ranges(headers: list, columns: list, first_row: int, last_row: int) -> list:
+    """
+    Splits the requested columns into contiguous runs.
+    Returns [(column names, A1 range)] for rows first_row..last_row.
+    """
+    indices = sorted(headers.index(c) + 1 for c in columns)
+    runs = []
+    start = 0
+    for end in range(1, len(indices) + 1):
+        if end == len(indices) or indices[end] != indices[end - 1] + 1:
+            runs.append((
+                headers[indices[start] - 1:indices[end - 1]],
+                f"{rowcol_to_a1(first_row, indices[start])}:{rowcol_to_a1(last_row, indices[end - 1])}",
+            ))
+            start = end
+    return runs
+
+def _fill(rows: list, names: list, values: list):
+    """Puts one batch_get range into rows; numbers are numericised like get_all_records()."""
+    for i, row in enumerate(rows):
+        cells = values[i] if i < len(values) else []
+        for k, name in enumerate(names):
+            row[name] = numericise(cells[k]) if k < len(cells) else ""
+
+def _read_page(sheet_id: str, headers: list, columns: list, first_row: int, last_row: int) -> list:
+    """Reads the given columns of sheet rows first_row..last_row with one batch_get."""
+    runs = _column_ranges(headers, columns, first_row, last_row)
+    value_ranges = _call(lambda: get_worksheet(sheet_id).batch_get([r for _, r in runs]))
+    # Пустые строки в конце диапазона API не возвращает
+    count = max((len(values) for values in value_ranges), default=0)
+    rows = [{} for _ in range(count)]
+    for (names, _), values in zip(runs, value_ranges):
+        _fill(rows, names, values)
+    return rows
+
+def _read_rows(sheet_id: str, headers: list, columns: list, page_size: int) -> list:
+    """Reads the given columns of all data rows, page by page."""
+    data = []
+    first_row = 2
+    while True:
+        page = _read_page(sheet_id, headers, columns, first_row, first_row + page_size - 1)
+        data.extend(page)
+        if len(page) < page_size:
+            return data
+        first_row += page_size
+
+def _read_cells(sheet_id: str, headers: list, columns: list, rows: list, indices: list,
+                page_size: int):
+    """
+    Reads columns only for the data rows at the given 0-based indices (into
+    rows): contiguous indices share one range, ranges go out in batches.
+    """
+    spans = []
+    for i in indices:
+        if spans and spans[-1][1] == i - 1 and i - spans[-1][0] < page_size:
+            spans[-1][1] = i
+        else:
+            spans.append([i, i])
+    requests = [
+        (start, end, names, a1_range)
+        for start, end in spans
+        for names, a1_range in _column_ranges(headers, columns, start + 2, end + 2)
+    ]
+    for chunk in range(0, len(requests), RANGES_PER_CALL):
+        batch = requests[chunk:chunk + RANGES_PER_CALL]
+        value_ranges = _call(
+            lambda batch=batch: get_worksheet(sheet_id).batch_get([r[3] for r in batch])
+        )
+        for (start, end, names, _), values in zip(batch, value_ranges):
+            _fill(rows[start:end + 1], names, values)
+
+def get_revision(sheet_id: str):
+    """
+    Drive modification time of the spreadsheet, or None if unavailable.
+    Any write (ours included) changes it.
+    """
+    spreadsheet = get_worksheet(sheet_id).spreadsheet
+    try:
+        getter = getattr(spreadsheet, "get_lastUpdateTime", None)
+        return getter() if getter else spreadsheet.lastUpdateTime
+    except (gspread.exceptions.APIError, AttributeError, KeyError):
+        return None
+
+def get_project_data(sheet_id: str, columns: list = None, page_size: int = PAGE_SIZE):
+    """
+    Fetches project rows page by page with ranged batch_get reads.
+    columns limits the read to those columns (Link is always included);
+    None reads every column. Numbers are numericised as get_all_records()
+    did, empty cells are "".
+    """
+    headers = get_headers(sheet_id, refresh=True)
+    wanted = [h for h in headers if columns is None or h in columns or h == "Link"]
+    # Время фиксируем до чтения: правки во время загрузки увидит следующий refresh
+    updated = get_revision(sheet_id)
+    data = _read_rows(sheet_id, headers, wanted, page_size)
+    _sync_state[extract_id_from_url(sheet_id)] = updated
     return data
 
+def _same_cell(old, new) -> bool:
+    # Локальная копия может хранить True там, где таблица отдает "TRUE"
+    return str(old if old is not None else "").lower() == str(new).lower()
+
+def read_project_changes(sheet_id: str, data: list, columns: list = None,
+                         page_size: int = PAGE_SIZE) -> list:
+    """
+    Incremental re-read of a project previously loaded as data (same
+    columns). The short LIST_COLUMNS are read in full; long columns (Text)
+    only for rows that are new or whose short cells changed - the rest keep
+    their values from data. The Sheets API has no per-row change feed, so
+    an edit of a long cell alone is not seen here; get_project_data()
+    (an explicit project load) picks it up.
+    """
+    headers = get_headers(sheet_id, refresh=True)
+    wanted = [h for h in headers if columns is None or h in columns or h == "Link"]
+    short = [h for h in wanted if h in LIST_COLUMNS]
+    long_columns = [h for h in wanted if h not in LIST_COLUMNS]
+    updated = get_revision(sheet_id)
+    rows = _read_rows(sheet_id, headers, short, page_size)
+    changed = []
+    for i, row in enumerate(rows):
+        old = data[i] if i < len(data) else None
+        if (
+            old is not None and all(h in old for h in long_columns)
+            and all(_same_cell(old.get(h), row[h]) for h in short)
+        ):
+            row.update({h: old[h] for h in long_columns})
+        else:
+            changed.append(i)
+    if long_columns and changed:
+        _read_cells(sheet_id, headers, long_columns, rows, changed, page_size)
+    _sync_state[extract_id_from_url(sheet_id)] = updated
+    return rows
+
+def synced_revision(sheet_id: str):
+    """Revision the last get_project_data() in this process read (None if unknown)."""
+    return _sync_state.get(extract_id_from_url(sheet_id))
+
+def is_modified(sheet_id: str) -> bool:
+    """True if the spreadsheet changed since the last get_project_data() (or is unknown)."""
+    updated = get_revision(sheet_id)
+    return updated is None or _sync_state.get(extract_id_from_url(sheet_id)) != updated
+
+def refresh_project_data(sheet_id: str, data: list, columns: list = None):
+    """
+    Re-reads the project only if the spreadsheet changed since the last load,
+    incrementally (see read_project_changes()).
+    Returns (rows, changed): the given data as is when nothing changed.
+    """
+    if not is_modified(sheet_id):
+        return data, False
+    return read_project_changes(sheet_id, data, columns), True
+
+def get_column_values(sheet_id: str, column: str, row_count: int,
+                      page_size: int = PAGE_SIZE) -> list:
+    """
+    Reads one column (e.g. Text on demand) for the first row_count data rows,
+    page by page. Returns exactly row_count values.
+    """
+    headers = get_headers(sheet_id)
+    if column not in headers:
+        return [""] * row_count
+    col_idx = headers.index(column) + 1
+    values = []
+    for first_row in range(2, row_count + 2, page_size):
+        last_row = min(first_row + page_size, row_count + 2) - 1
+        a1_range = f"{rowcol_to_a1(first_row, col_idx)}:{rowcol_to_a1(last_row, col_idx)}"
+        page = _call(lambda a1_range=a1_range: get_worksheet(sheet_id).get(a1_range))
+        values.extend(cells[0] if cells else "" for cells in page)
+        # Пустые ячейки в конце страницы API не возвращает
+        values.extend([""] * (last_row - first_row + 1 - len(page)))
+    return values
+
 def add_rows(sheet_id: str, rows: list):
     """
     Appends new rows to the sheet.
     rows: list of dicts matching headers
     """
-    client = get_client()
-    sh = client.open_by_key(extract_id_from_url(sheet_id))
-    worksheet = sh.get_worksheet(0)
-
     # Convert dicts to list of lists based on headers
-    headers = worksheet.row_values(1)
+    headers = get_headers(sheet_id)
     values = []
     for row in rows:
         row_values = [row.get(h, "") for h in headers]
         values.append(row_values)
 
-    worksheet.append_rows(values)
+    _call(lambda: get_worksheet(sheet_id).append_rows(values))
     return len(values)
 
 def update_row(sheet_id: str, row_index: int, updates: dict):
     """Updates specific cells in a row."""
     # row_index is 0-based index from data (so actual row is index + 2 because of header)
-    client = get_client()
-    sh = client.open_by_key(extract_id_from_url(sheet_id))
-    worksheet = sh.get_worksheet(0)
+    headers = get_headers(sheet_id)
+    if any(col_name not in headers for col_name in updates):
+        # Колонку могли добавить в таблицу вручную - перечитаем заголовки
+        headers = get_headers(sheet_id, refresh=True)
 
-    headers = worksheet.row_values(1)
-
-    # We can use batch update or cell updates.
-    # For now, simple cell updates might be slow but safe
-    # Or construct a range update
     cells_to_update = []
     actual_row = row_index + 2
 
@@ -118,7 +366,7 @@ def update_row(sheet_id: str, row_index: int, updates: dict):
             cells_to_update.append(gspread.Cell(actual_row, col_idx, value))
 
     if cells_to_update:
-        worksheet.update_cells(cells_to_update)
+        _call(lambda: get_worksheet(sheet_id).update_cells(cells_to_update))
 
     return True
 
@@ -127,16 +375,15 @@ def replace_project_data(sheet_id: str, new_data: list):
     Replaces the entire sheet content with new_data.
     Safest for 'Save All' in a small project.
     """
-    client = get_client()
-    sh = client.open_by_key(extract_id_from_url(sheet_id))
-    worksheet = sh.get_worksheet(0)
+    worksheet = get_worksheet(sheet_id)
 
     # clear
     worksheet.clear()
 
-    # Headers
-    headers = ["Выбрать", "Title", "Link", "Keywords", "Description", "New Description", "Text"]
+    # Headers - схема перезаписывается, обновляем и кэш заголовков
+    headers = HEADERS
     worksheet.append_row(headers)
+    _get_handle(sheet_id)["headers"] = list(headers)
 
     # Rows
     # Ensure order matches headers
@@ -150,3 +397,222 @@ def replace_project_data(sheet_id: str, new_data: list):
         worksheet.append_rows(values)
 
     return True
+
+def _row_ranges(row_index: int, headers: list, updates: dict) -> list:
+    """
+    batch_update entries for cell updates of a 0-based data row;
+    adjacent columns go out as one range.
+    """
+    cols = sorted(
+        (headers.index(col) + 1, value) for col, value in updates.items() if col in headers
+    )
+    data = []
+    start = 0
+    for end in range(1, len(cols) + 1):
+        if end == len(cols) or cols[end][0] != cols[end - 1][0] + 1:
+            data.append({
+                "range": rowcol_to_a1(row_index + 2, cols[start][0]),
+                "values": [[value for _, value in cols[start:end]]],
+            })
+            start = end
+    return data
+
+def _cell_value(value) -> str:
+    """Value as it is stored in the sheet: empty for None/NaN, str otherwise."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    return str(value)
+
+def _dimension_request(request: str, sheet_id: int, start: int, end: int) -> dict:
+    return {request: {
+        "range": {"sheetId": sheet_id, "dimension": "ROWS", "startIndex": start, "endIndex": end},
+        **({"inheritFromBefore": False} if request == "insertDimension" else {}),
+    }}
+
+def save_project_changes(sheet_id: str, old_data: list, new_data: list) -> dict:
+    """
+    Saves new_data over old_data (the last known sheet content) by diffing them.
+    Deleted and inserted rows go out as one structural batch, changed cells and
+    inserted values as one values batch, so the cost scales with the edit.
+    Only columns present in new_data are compared, so rows loaded without
+    Text keep their texts. Falls back to replace_project_data() when the sheet
+    does not match old_data (other headers or rows changed behind our back);
+    partially loaded data cannot be rewritten that way and raises ValueError.
+    Returns {"updated": cells, "inserted": rows, "deleted": rows, "replaced": bool}.
+    """
+    summary = {"updated": 0, "inserted": 0, "deleted": 0, "replaced": False}
+    headers = get_headers(sheet_id, refresh=True)
+    worksheet = get_worksheet(sheet_id)
+
+    # Сверяем снимок с таблицей по колонке Link - иначе диф уйдет не в те строки
+    in_sync = headers == HEADERS
+    if in_sync:
+        sheet_links = _call(lambda: get_worksheet(sheet_id).col_values(headers.index("Link") + 1))[1:]
+        known_links = [_cell_value(row.get("Link")) for row in old_data]
+        while known_links and not known_links[-1]:
+            known_links.pop()
+        in_sync = sheet_links == known_links
+    columns = [h for h in headers if not new_data or h in new_data[0]]
+    if not in_sync:
+        if len(columns) < len(headers):
+            raise ValueError(
+                "Таблица изменилась с момента загрузки, а тексты загружены не полностью. "
+                "Обновите данные и повторите сохранение."
+            )
+        replace_project_data(sheet_id, new_data)
+        summary["replaced"] = True
+        return summary
+
+    old_rows = [tuple(_cell_value(row.get(h)) for h in columns) for row in old_data]
+    new_rows = [tuple(_cell_value(row.get(h)) for h in columns) for row in new_data]
+    opcodes = SequenceMatcher(None, old_rows, new_rows, autojunk=False).get_opcodes()
+
+    structure = []
+    values = []
+    # Структурные правки снизу вверх: индексы выше по листу остаются валидными
+    for tag, i1, i2, j1, j2 in reversed(opcodes):
+        if tag == "equal":
+            continue
+        paired = min(i2 - i1, j2 - j1) if tag == "replace" else 0
+        if i1 + paired < i2:
+            structure.append(_dimension_request("deleteDimension", worksheet.id, i1 + paired + 1, i2 + 1))
+            summary["deleted"] += i2 - i1 - paired
+        if j1 + paired < j2:
+            structure.append(_dimension_request("insertDimension", worksheet.id, i1 + paired + 1,
+                                                i1 + paired + 1 + j2 - j1 - paired))
+            values.append({
+                "range": rowcol_to_a1(j1 + paired + 2, 1),
+                "values": [
+                    [_cell_value(row.get(h)) for h in headers] for row in new_data[j1 + paired:j2]
+                ],
+            })
+            summary["inserted"] += j2 - j1 - paired
+        # Совпавшие по позиции строки обновляем по ячейкам (в новых координатах)
+        for offset in range(paired):
+            old_row, new_row = old_rows[i1 + offset], new_rows[j1 + offset]
+            changed = {h: new_row[k] for k, h in enumerate(columns) if old_row[k] != new_row[k]}
+            values.extend(_row_ranges(j1 + offset, headers, changed))
+            summary["updated"] += len(changed)
+
+    if structure:
+        _call(lambda: get_worksheet(sheet_id).spreadsheet.batch_update({"requests": structure}))
+    if values:
+        _call(lambda: get_worksheet(sheet_id).batch_update(values))
+    return summary
+
+class SheetWriter:
+    """
+    Write-behind buffer for per-row cell updates.
+    Updates to the same row are merged and sent as one batch_update every
+    max_rows rows or max_delay seconds (a background thread handles the
+    timer), retrying throttled writes with backoff. Use as a context manager
+    or call close() so the tail of the buffer is always written. A failed
+    background write keeps its rows buffered and is raised by the next
+    flush()/close() (or update_row()) if they still cannot be written.
+    """
+
+    def __init__(self, sheet_id: str, max_rows: int = FLUSH_ROWS,
+                 max_delay: float = FLUSH_SECONDS, max_retries: int = WRITE_RETRIES):
+        self.sheet_id = sheet_id
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.written_rows = 0
+        self._pending = {}
+        self._first_pending = None
+        self._error = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def update_row(self, row_index: int, updates: dict):
+        """Queues cell updates for a 0-based data row (same contract as update_row())."""
+        if self._closed.is_set():
+            raise RuntimeError("SheetWriter is closed")
+        if self._error is not None:
+            # Фоновая запись не прошла - пробуем сейчас и сообщаем вызывающему, если снова нет
+            self.flush()
+        with self._lock:
+            self._pending.setdefault(row_index, {}).update(updates)
+            if self._first_pending is None:
+                self._first_pending = time.monotonic()
+            full = len(self._pending) >= self.max_rows
+        if full:
+            self.flush()
+
+    def _run(self):
+        while not self._closed.wait(self.max_delay / 2):
+            with self._lock:
+                due = (
+                    self._first_pending is not None
+                    and time.monotonic() - self._first_pending >= self.max_delay
+                )
+            if due:
+                try:
+                    self.flush()
+                except Exception as e: # pylint: disable=broad-exception-caught
+                    # Строки остались в буфере; flush()/close() повторят запись
+                    # и поднимут ошибку, если она не пройдет и тогда
+                    self._error = e
+
+    def _batch(self, pending: dict) -> list:
+        headers = get_headers(self.sheet_id)
+        if any(col not in headers for updates in pending.values() for col in updates):
+            headers = get_headers(self.sheet_id, refresh=True)
+        data = []
+        for row_index, updates in sorted(pending.items()):
+            data.extend(_row_ranges(row_index, headers, updates))
+        return data
+
+    def flush(self):
+        """Writes everything buffered so far; raises if the write keeps failing."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._first_pending = None
+            if not pending:
+                error, self._error = self._error, None
+                if error is not None:
+                    raise error
+                return
+            try:
+                data = self._batch(pending)
+                for attempt in range(self.max_retries + 1):
+                    try:
+                        if data:
+                            _call(lambda: get_worksheet(self.sheet_id).batch_update(data))
+                        break
+                    except gspread.exceptions.APIError as e:
+                        if not is_retryable(e) or attempt == self.max_retries:
+                            raise
+                        time.sleep(backoff_delay(attempt))
+            except Exception as e:
+                self._error = e
+                # Возвращаем строки в буфер, не затирая более свежие правки
+                with self._lock:
+                    for row_index, updates in pending.items():
+                        merged = dict(updates)
+                        merged.update(self._pending.get(row_index, {}))
+                        self._pending[row_index] = merged
+                    if self._first_pending is None:
+                        self._first_pending = time.monotonic()
+                raise
+            self.written_rows += len(pending)
+            self._error = None
+
+    def close(self):
+        """Stops the timer thread and writes the rest of the buffer; raises if that fails."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._thread.join()
+        self.flush()
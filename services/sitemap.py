@@ -0,0 +1,176 @@
+"""
+Sitemap Service
+Discovers sitemaps via robots.txt and streams page URLs out of sitemap.xml,
+sitemap indexes and .xml.gz files without loading them into memory. Each
+file is spooled to a temporary file first, so a slow consumer never keeps
+an HTTP connection open (and idle) while it processes the URLs.
+"""
+
+import tempfile
+import zlib
+from contextlib import closing
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from urllib.parse import urljoin, urlparse
+
+from services import aio, fetcher, parser
+
+# Защита от циклов и слишком глубокой вложенности индексов
+MAX_INDEX_DEPTH = 3
+_READ_CHUNK = 64 * 1024
+
+
+class SitemapError(Exception):
+    """
+    Raised after all readable sitemaps were streamed if some could not be
+    read; errors holds "url: reason" strings.
+    """
+
+    def __init__(self, errors):
+        super().__init__(f"Не удалось прочитать sitemap: {len(errors)} ({errors[0]})")
+        self.errors = errors
+
+
+def _local_name(tag):
+    """Strips the XML namespace: '{http://...}loc' -> 'loc'."""
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_lastmod(value):
+    """Parses a W3C datetime (YYYY-MM-DD or full ISO 8601) into an aware datetime."""
+    if not value:
+        return None
+    value = value.strip().replace("Z", "+00:00")
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def _is_outdated(lastmod, modified_since):
+    if modified_since is None:
+        return False
+    parsed = parse_lastmod(lastmod)
+    return parsed is not None and parsed < modified_since
+
+
+async def _discover(site_url):
+    parsed = urlparse(site_url)
+    origin = f"{parsed.scheme}://{parsed.netloc}"
+    result = await fetcher.get_fetcher().fetch(urljoin(origin, "/robots.txt"))
+
+    sitemaps = []
+    if not result["error"] and result["status"] == 200:
+        for line in result["text"].splitlines():
+            key, _, value = line.partition(":")
+            if key.strip().lower() == "sitemap" and value.strip():
+                sitemaps.append(urljoin(origin, value.strip()))
+    return sitemaps or [urljoin(origin, "/sitemap.xml")]
+
+
+async def _iter_entries(url):
+    """
+    Downloads one sitemap file to a temporary file, then parses it incrementally.
+    Yields ("url" | "sitemap", loc, lastmod) as soon as each entry closes and
+    drops parsed elements right away, so memory stays flat for 50k-URL files.
+    """
+    with tempfile.TemporaryFile() as spool:
+        await fetcher.get_fetcher().download(url, spool)
+        spool.seek(0)
+        for entry in _parse_entries(spool):
+            yield entry
+
+
+def _parse_entries(spool):
+    """Pull-parses a spooled sitemap (plain or gzip) into entries."""
+    pull = ET.XMLPullParser(events=("start", "end"))
+    decompressor = None
+    first_chunk = True
+    root = None
+    loc = lastmod = None
+
+    for chunk in iter(lambda: spool.read(_READ_CHUNK), b""):
+        if first_chunk:
+            first_chunk = False
+            if chunk[:2] == b"\x1f\x8b":
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        pull.feed(chunk)
+
+        for event, elem in pull.read_events():
+            if event == "start":
+                if root is None:
+                    root = elem
+                continue
+            tag = _local_name(elem.tag)
+            if tag == "loc":
+                loc = (elem.text or "").strip()
+            elif tag == "lastmod":
+                lastmod = (elem.text or "").strip()
+            elif tag in ("url", "sitemap"):
+                if loc:
+                    yield tag, loc, lastmod
+                loc = lastmod = None
+                root.clear()
+    pull.close()
+
+
+async def _iter_urls(sitemap_urls, modified_since, errors):
+    visited = set()
+    stack = [(u, 0) for u in reversed(sitemap_urls)]
+    while stack:
+        url, depth = stack.pop()
+        if url in visited:
+            continue
+        visited.add(url)
+
+        children = []
+        try:
+            async for kind, loc, lastmod in _iter_entries(url):
+                if kind == "sitemap":
+                    # Целиком пропускаем дочерние sitemap, не менявшиеся с прошлого импорта
+                    if depth < MAX_INDEX_DEPTH and not _is_outdated(lastmod, modified_since):
+                        children.append((loc, depth + 1))
+                elif not _is_outdated(lastmod, modified_since):
+                    yield loc, lastmod
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # Остальные sitemap читаем дальше, ошибку отдаем вызывающему в конце
+            reason = str(e).splitlines()[0] if str(e) else type(e).__name__
+            errors.append(f"{url}: {reason}")
+        stack.extend(reversed(children))
+
+
+def discover_sitemaps(site_url):
+    """Returns sitemap URLs listed in robots.txt (or the default /sitemap.xml)."""
+    return aio.run(_discover(site_url))
+
+
+def iter_sitemap_urls(source_url, modified_since=None):
+    """
+    Streams (url, lastmod) pairs for the site.
+    source_url may be a sitemap itself (*.xml / *.xml.gz) or any page of the site,
+    in which case sitemaps are discovered through robots.txt. Nested indexes are
+    followed. With modified_since (aware datetime), URLs and child sitemaps whose
+    lastmod is older are skipped. Only same-domain HTML links are yielded.
+    Sitemaps that could not be downloaded or parsed are skipped; once the rest
+    has been streamed, SitemapError lists them.
+    """
+    base_domain = urlparse(source_url).netloc
+    path = urlparse(source_url).path.lower()
+    if path.endswith((".xml", ".xml.gz")):
+        sitemap_urls = [source_url]
+    else:
+        sitemap_urls = discover_sitemaps(source_url)
+
+    errors = []
+    with closing(aio.iterate(_iter_urls(sitemap_urls, modified_since, errors))) as entries:
+        for loc, lastmod in entries:
+            normalized = parser.normalize_url(loc, loc)
+            if parser.is_valid_url(normalized, base_domain):
+                yield normalized, lastmod
+    if errors:
+        raise SitemapError(errors)
@@ -0,0 +1,111 @@
+"""
+Text Quality Service
+Fast local checks for generated page texts: length, paragraphs, keyword
+coverage, bold markup, AI clichés and leftover markdown/HTML. Runs before the
+LLM critic so texts that already meet the brief skip it entirely.
+"""
+
+import re
+
+MIN_CHARS = 1400
+MAX_CHARS = 1600
+MIN_PARAGRAPHS = 3
+MAX_PARAGRAPHS = 4
+MIN_BOLD = 2
+MAX_BOLD = 6
+# Доля ключевых фраз, которые должны встретиться в тексте
+MIN_KEYWORD_COVERAGE = 0.8
+
+BANNED_CLICHES = [
+    "кроме того",
+    "более того",
+    "важно отметить",
+    "стоит подчеркнуть",
+    "в заключение",
+    "следовательно,",
+    "является идеальным выбором",
+    "широкий спектр",
+    "уникальная возможность",
+    "погрузитесь в мир",
+    "подчеркивает",
+]
+
+_BOLD_RE = re.compile(r'\*\*[^*\n]+?\*\*')
+_PARAGRAPH_SPLIT_RE = re.compile(r'\n\s*\n')
+_LEFTOVER_RE = re.compile(r'(?m)^\s*#+\s|<[^>]+>|`|__|^\s*(?:[-*•]|\d+[.)])\s')
+_WORD_RE = re.compile(r'\w+')
+
+
+def split_keywords(keywords):
+    """Splits a Keywords cell into phrases (comma, semicolon or newline separated)."""
+    return [k.strip() for k in re.split(r'[,;\n]', str(keywords or "")) if k.strip()]
+
+
+def _stem(word):
+    # Грубая основа для русского: отбрасываем окончание, чтобы "круизы" совпало с "круизов"
+    return word[:max(4, len(word) - 2)] if len(word) > 4 else word
+
+
+def keyword_coverage(text, keywords):
+    """Share of keyword phrases whose every word stem occurs in the text."""
+    phrases = split_keywords(keywords)
+    if not phrases:
+        return 1.0
+    words = _WORD_RE.findall(text.lower())
+    found = 0
+    for phrase in phrases:
+        stems = [_stem(w) for w in _WORD_RE.findall(phrase.lower())]
+        if stems and all(any(w.startswith(s) for w in words) for s in stems):
+            found += 1
+    return found / len(phrases)
+
+
+def score_text(text, keywords=""):
+    """
+    Checks a text against the brief.
+    Returns {"passed": bool, "issues": [..], "metrics": {..}}; issues are
+    phrased as instructions, so they can be handed to the editor as is.
+    """
+    visible = text.replace("**", "")
+    length = len(visible.strip())
+    paragraphs = [p for p in _PARAGRAPH_SPLIT_RE.split(text.strip()) if p.strip()]
+    bold = len(_BOLD_RE.findall(text))
+    coverage = keyword_coverage(visible, keywords)
+    lowered = visible.lower()
+    cliches = [c for c in BANNED_CLICHES if c in lowered]
+    leftovers = _LEFTOVER_RE.findall(text)
+
+    issues = []
+    if length < MIN_CHARS:
+        issues.append(f"Текст короткий: {length} символов, нужно {MIN_CHARS}–{MAX_CHARS}. Расширь его.")
+    elif length > MAX_CHARS:
+        issues.append(f"Текст длинный: {length} символов, нужно {MIN_CHARS}–{MAX_CHARS}. Сократи его.")
+    if not MIN_PARAGRAPHS <= len(paragraphs) <= MAX_PARAGRAPHS:
+        issues.append(
+            f"Абзацев {len(paragraphs)}, нужно {MIN_PARAGRAPHS}–{MAX_PARAGRAPHS} "
+            "(разделяй абзацы пустой строкой)."
+        )
+    if coverage < MIN_KEYWORD_COVERAGE:
+        missing = [
+            k for k in split_keywords(keywords) if keyword_coverage(visible, k) < 1.0
+        ]
+        issues.append(f"Не хватает ключевых слов: {', '.join(missing)}.")
+    if not MIN_BOLD <= bold <= MAX_BOLD:
+        issues.append(f"Жирным (**) выделено {bold} фраз, нужно {MIN_BOLD}–{MAX_BOLD} ключевых.")
+    if cliches:
+        issues.append(f"Убери AI-клише: {', '.join(cliches)}.")
+    if leftovers:
+        issues.append("Убери заголовки (#), списки, HTML и прочую разметку кроме **жирного**.")
+
+    return {
+        "passed": not issues,
+        "issues": issues,
+        "metrics": {
+            "length": length,
+            "paragraphs": len(paragraphs),
+            "bold": bold,
+            "keyword_coverage": coverage,
+            "cliches": len(cliches),
+            "markup": len(leftovers),
+        },
+    }
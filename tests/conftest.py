@@ -0,0 +1,48 @@
+"""Shared fixtures: an in-memory website behind the process-wide fetcher."""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from services import page_cache
+
+
+@pytest.fixture
+def page_store(tmp_path, monkeypatch):
+    """A fresh page cache in tmp_path used as the process-wide one."""
+    cache = page_cache.PageCache(str(tmp_path / "pages.sqlite"))
+    monkeypatch.setattr(page_cache, "CACHE_ENABLED", True)
+    monkeypatch.setattr(page_cache, "_CACHE", cache)
+    return cache
+
+
+@pytest.fixture
+def site(monkeypatch, page_store):  # pylint: disable=unused-argument
+    """
+    Routes the process-wide fetcher to site.pages ({path: body} or
+    {path: (status, body)}; str bodies are served as HTML, bytes as is).
+    site.requests lists the requested URLs.
+    """
+    httpx = pytest.importorskip("httpx")
+    from services import fetcher  # pylint: disable=import-outside-toplevel
+
+    pages = {}
+    requests = []
+
+    def handler(request):
+        requests.append(str(request.url))
+        entry = pages.get(request.url.path)
+        if entry is None:
+            return httpx.Response(404, text="not found")
+        status, body = entry if isinstance(entry, tuple) else (200, entry)
+        if isinstance(body, str):
+            return httpx.Response(status, html=body)
+        return httpx.Response(status, content=body)
+
+    instance = fetcher.AsyncFetcher(http2=False)
+    # pylint: disable=protected-access
+    instance._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    instance._global_slots = asyncio.Semaphore(instance.max_connections)
+    monkeypatch.setattr(fetcher, "_FETCHER", instance)
+    return SimpleNamespace(pages=pages, requests=requests)
@@ -0,0 +1,76 @@
+"""Breadth-first crawling with a deduplicating frontier."""
+
+import pytest
+
+pytest.importorskip("bs4")
+
+from services import crawler  # noqa: E402  # pylint: disable=wrong-import-position
+
+
+def _page(title, *links):
+    anchors = "".join(f'<a href="{href}">{href}</a>' for href in links)
+    return f"<html><head><title>{title}</title></head><body>{anchors}</body></html>"
+
+
+def test_frontier_enqueues_each_url_once():
+    frontier = crawler.Frontier()
+    assert frontier.add("https://example.com/a", 1)
+    assert not frontier.add("https://example.com/a", 2)
+    assert len(frontier) == 1
+    assert frontier.seen_count == 1
+
+
+def test_frontier_include_exclude_and_force():
+    frontier = crawler.Frontier(include=["/blog/*"], exclude=["/blog/drafts/*"])
+    assert frontier.add("https://example.com/blog/post", 1)
+    assert not frontier.add("https://example.com/shop/item", 1)
+    assert not frontier.add("https://example.com/blog/drafts/x", 1)
+    # Стартовая страница добавляется в обход фильтров
+    assert frontier.add("https://example.com/", 0, force=True)
+
+
+def test_frontier_pops_one_depth_at_a_time():
+    frontier = crawler.Frontier()
+    for url, depth in (("/a", 0), ("/b", 1), ("/c", 1), ("/d", 1), ("/e", 2)):
+        frontier.add("https://example.com" + url, depth)
+    assert frontier.pop_level(10) == (0, ["https://example.com/a"])
+    assert frontier.pop_level(2) == (1, ["https://example.com/b", "https://example.com/c"])
+    assert frontier.pop_level(10) == (1, ["https://example.com/d"])
+    assert frontier.pop_level(10) == (2, ["https://example.com/e"])
+    assert frontier.pop_level(10) == (None, [])
+
+
+def test_crawl_fetches_each_page_once_within_depth(site):
+    site.pages.update({
+        "/": _page("Главная", "/a", "/b", "/a#top", "https://other.com/x", "/private/p"),
+        "/a": _page("A", "/", "/c"),
+        "/b": _page("B", "/c", "mailto:info@example.com"),
+        "/c": _page("C", "/d"),
+        "/d": _page("D"),
+        "/private/p": _page("Закрытая"),
+    })
+    pages = list(crawler.crawl_site(
+        "https://example.com/", max_depth=2, exclude=["/private/*"]
+    ))
+    assert sorted(p["Title"] for p in pages) == ["A", "B", "C", "Главная"]
+    # /c встречается на двух страницах, но скачивается один раз; /d глубже max_depth
+    assert sorted(site.requests) == [
+        "https://example.com/", "https://example.com/a",
+        "https://example.com/b", "https://example.com/c",
+    ]
+
+
+def test_crawl_respects_max_pages(site):
+    site.pages["/"] = _page("Главная", *(f"/p{i}" for i in range(10)))
+    for i in range(10):
+        site.pages[f"/p{i}"] = _page(f"P{i}")
+    pages = list(crawler.crawl_site("https://example.com/", max_pages=4))
+    assert len(pages) == 4
+    assert len(site.requests) == 4
+
+
+def test_crawl_skips_failed_pages(site):
+    site.pages["/"] = _page("Главная", "/missing", "/ok")
+    site.pages["/ok"] = _page("OK")
+    pages = list(crawler.crawl_site("https://example.com/"))
+    assert sorted(p["Title"] for p in pages) == ["OK", "Главная"]
@@ -0,0 +1,41 @@
+"""Export writers: Parquet must accept the mixed and empty cells real projects have."""
+
+import io
+
+import pytest
+
+from services import export
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def _read_parquet(rows, **kwargs):
+    output = io.BytesIO()
+    count = export.write_parquet(rows, output, **kwargs)
+    table = pq.read_table(io.BytesIO(output.getvalue()))
+    return count, table.to_pylist()
+
+
+def test_parquet_empty_cell_in_bool_column():
+    count, rows = _read_parquet([{"Выбрать": True}, {"Выбрать": None}, {"Выбрать": float("nan")}])
+    assert count == 3
+    assert rows == [{"Выбрать": "True"}, {"Выбрать": None}, {"Выбрать": None}]
+
+
+def test_parquet_mixed_int_and_text():
+    _, rows = _read_parquet([{"A": 1}, {"A": "x, y"}, {"A": 2.5}])
+    assert [row["A"] for row in rows] == ["1", "x, y", "2.5"]
+
+
+def test_parquet_column_typed_only_in_later_group():
+    data = [{"A": None, "B": "t"}] * 3 + [{"A": 1.5, "B": "t"}, {"A": False, "B": None}]
+    count, rows = _read_parquet(data, row_group_size=3)
+    assert count == 5
+    assert [row["A"] for row in rows] == [None, None, None, "1.5", "False"]
+    assert rows[-1]["B"] is None
+
+
+def test_parquet_empty_project_keeps_columns():
+    count, rows = _read_parquet([], columns=["Title", "Link"])
+    assert count == 0
+    assert rows == []
@@ -0,0 +1,44 @@
+"""Cache-aware fetching through the shared event loop."""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from services import aio, fetcher
+
+
+@pytest.fixture
+def small_loop(monkeypatch):
+    """A fresh shared loop whose default executor has only two threads."""
+    monkeypatch.setattr(aio, "_LOOP", None)
+    loop = aio.get_loop()
+    loop.set_default_executor(ThreadPoolExecutor(2))
+    yield loop
+    loop.call_soon_threadsafe(loop.stop)
+
+
+def test_second_fetch_is_served_from_cache(site, page_store):
+    site.pages["/a"] = "<html><body><p>/a</p></body></html>"
+    first = fetcher.fetch("https://example.com/a")
+    second = fetcher.fetch("https://example.com/a")
+    assert first["status"] == second["status"] == 200
+    assert second["text"] == first["text"]
+    assert site.requests == ["https://example.com/a"]
+    assert page_store.get("https://example.com/a") is not None
+
+
+def test_sync_loaders_in_default_executor_do_not_deadlock(site, small_loop):  # pylint: disable=unused-argument
+    # Так грузит контекст страниц генерация текстов: синхронный fetch() из
+    # пула по умолчанию, а страниц больше, чем потоков в пуле
+    urls = [f"https://example.com/p{i}" for i in range(20)]
+    for i in range(20):
+        site.pages[f"/p{i}"] = f"<html><body><p>{i}</p></body></html>"
+
+    async def _load_all():
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(*(loop.run_in_executor(None, fetcher.fetch, url) for url in urls))
+
+    results = aio.run(_load_all(), timeout=30)
+    assert [r["status"] for r in results] == [200] * len(urls)
+    assert sorted(site.requests) == sorted(urls)
@@ -0,0 +1,61 @@
+"""Humanizer: precompiled cleanup passes and project dictionaries."""
+
+import json
+import os
+
+import pytest
+
+from services import humanizer
+
+
+def test_strips_markup_intro_and_extra_whitespace():
+    text = "Конечно, вот текст:\n## Заголовок\n__курсив__ и `код` <b>тег</b>  **жирный**\n\n\n\nКонец"
+    assert humanizer.Humanizer().humanize(text) == "Заголовок\nкурсив и код тег **жирный**\n\nКонец"
+
+
+def test_longest_phrase_wins():
+    h = humanizer.Humanizer({"Кроме": "X", "Кроме того,": "А еще,"})
+    assert h.humanize("Кроме того, это Кроме") == "А еще, это X"
+
+
+def test_with_replacements_overrides_defaults():
+    h = humanizer.Humanizer().with_replacements({"Кроме того,": "Плюс", "кот": "пёс"})
+    assert h.humanize("Кроме того, кот") == "Плюс пёс"
+    assert humanizer.Humanizer().humanize("Кроме того, кот") == "А еще, кот"
+
+
+def test_load_replacements_json_and_tsv(tmp_path):
+    (tmp_path / "a.json").write_text(json.dumps({"кот": "пёс"}), encoding="utf-8")
+    (tmp_path / "b.tsv").write_text("кот\tпёс\nудалить\n", encoding="utf-8")
+    assert humanizer.load_replacements(str(tmp_path / "a.json")) == {"кот": "пёс"}
+    assert humanizer.load_replacements(str(tmp_path / "b.tsv")) == {"кот": "пёс", "удалить": ""}
+
+
+@pytest.fixture
+def dictionaries(tmp_path, monkeypatch):
+    root = tmp_path / "dictionaries"
+    root.mkdir()
+    (root / "travel.json").write_text(json.dumps({"кот": "пёс"}), encoding="utf-8")
+    (tmp_path / "secret.json").write_text("{}", encoding="utf-8")
+    monkeypatch.setattr(humanizer, "DICTIONARIES_DIR", str(root))
+    return root
+
+
+def test_project_dictionary_is_applied(dictionaries):
+    path = humanizer.resolve_dictionary("travel.json")
+    assert humanizer.list_dictionaries() == ["travel.json"]
+    assert humanizer.humanize_text("Большой кот", path) == "Большой пёс"
+
+
+@pytest.mark.parametrize("name", [
+    "../secret.json", "/etc/passwd", "sub/travel.json", "..", "", "travel.txt", "missing.json",
+])
+def test_resolve_dictionary_rejects_anything_outside_the_folder(dictionaries, name):
+    with pytest.raises(ValueError):
+        humanizer.resolve_dictionary(name)
+
+
+def test_resolve_dictionary_rejects_symlink_out_of_the_folder(dictionaries):
+    os.symlink(dictionaries.parent / "secret.json", dictionaries / "link.json")
+    with pytest.raises(ValueError):
+        humanizer.resolve_dictionary("link.json")
@@ -0,0 +1,125 @@
+"""Background jobs: queue, worker loop, resume from checkpoint and crash handling."""
+
+import json
+
+import pytest
+
+from services import jobs
+
+
+@pytest.fixture(autouse=True)
+def jobs_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_DB", str(tmp_path / "jobs.sqlite"))
+    monkeypatch.setattr(jobs, "EXPORTS_DIR", str(tmp_path / "exports"))
+    monkeypatch.setattr(jobs, "_conn", None)
+    # Рабочие процессы не запускаем - задачи выполняет work() в самом тесте
+    monkeypatch.setattr(jobs, "ensure_workers", lambda *args, **kwargs: None)
+    yield
+    jobs._db().close()  # pylint: disable=protected-access
+
+
+def _handler(monkeypatch, fn):
+    monkeypatch.setitem(jobs.HANDLERS, "test", fn)
+
+
+def test_worker_runs_job_and_stores_result(monkeypatch):
+    def run(ctx):
+        ctx.progress(1, 2, "шаг", force=True)
+        return {"echo": ctx.params["value"]}
+
+    _handler(monkeypatch, run)
+    job_id = jobs.submit("test", {"sheet_id": "S", "value": 7})
+    jobs.work(idle_timeout=0)
+    job = jobs.get_job(job_id)
+    assert job["status"] == jobs.DONE
+    assert job["result"] == {"echo": 7}
+    assert (job["done"], job["total"]) == (1, 2)
+
+
+def test_failed_job_resumes_from_checkpoint(monkeypatch):
+    seen = []
+
+    def run(ctx):
+        done = ctx.checkpoint.setdefault("done", [])
+        seen.append(list(done))
+        for i in range(3):
+            if i in done:
+                continue
+            if i == 1 and len(seen) == 1:
+                raise RuntimeError("сбой API")
+            done.append(i)
+        return {"done": done}
+
+    _handler(monkeypatch, run)
+    job_id = jobs.submit("test", {"sheet_id": "S"})
+    jobs.work(idle_timeout=0)
+    job = jobs.get_job(job_id)
+    assert (job["status"], job["error"]) == (jobs.FAILED, "сбой API")
+
+    assert jobs.resume(job_id)
+    assert jobs.get_job(job_id)["attempts"] == 0
+    jobs.work(idle_timeout=0)
+    assert jobs.get_job(job_id)["result"] == {"done": [0, 1, 2]}
+    assert seen == [[], [0]]
+
+
+def test_queued_job_cancels_immediately(monkeypatch):
+    _handler(monkeypatch, lambda ctx: pytest.fail("cancelled job must not run"))
+    job_id = jobs.submit("test", {"sheet_id": "S"})
+    assert jobs.cancel(job_id)
+    jobs.work(idle_timeout=0)
+    assert jobs.get_job(job_id)["status"] == jobs.CANCELLED
+    assert not jobs.cancel(job_id)
+
+
+def test_crashing_job_fails_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_MAX_ATTEMPTS", 2)
+    _handler(monkeypatch, lambda ctx: None)
+    job_id = jobs.submit("test", {"sheet_id": "S"})
+    for _ in range(jobs.JOB_MAX_ATTEMPTS):
+        # Процесс "упал": пульс задачи остановился
+        assert jobs._claim(12345)["id"] == job_id  # pylint: disable=protected-access
+        jobs._db().execute("UPDATE jobs SET heartbeat_at = 0")  # pylint: disable=protected-access
+    assert jobs._claim(12345) is None  # pylint: disable=protected-access
+    job = jobs.get_job(job_id)
+    assert job["status"] == jobs.FAILED
+    assert "2" in job["error"]
+
+
+def test_first_partial_is_written_without_throttle(monkeypatch):
+    monkeypatch.setattr(jobs, "PROGRESS_INTERVAL", 3600)
+    _handler(monkeypatch, lambda ctx: None)
+    job_id = jobs.submit("test", {"sheet_id": "S"})
+    ctx = jobs.JobContext(jobs.get_job(job_id))
+
+    def stored_partial():
+        # pylint: disable=protected-access
+        row = jobs._db().execute("SELECT partial FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row[0] else None
+
+    ctx.progress(0, 2, "", partial={"idx": 0, "stage": "draft", "text": "П"}, force=True)
+    ctx.progress(0, 2, "", partial={"idx": 0, "stage": "draft", "text": "При"})
+    assert stored_partial()["text"] == "П"
+    # Первый вывод другой строки или этапа пишется сразу
+    ctx.progress(0, 2, "", partial={"idx": 1, "stage": "draft", "text": "Д"})
+    assert stored_partial() == {"idx": 1, "stage": "draft", "text": "Д"}
+    ctx.progress(0, 2, "", partial={"idx": 0, "stage": "editor", "text": "Р"})
+    assert stored_partial()["stage"] == "editor"
+
+
+def test_cleanup_removes_old_jobs_and_their_exports(tmp_path, monkeypatch):
+    exports = tmp_path / "exports"
+    exports.mkdir()
+    _handler(monkeypatch, lambda ctx: None)
+    old_id = jobs.submit("test", {"sheet_id": "S"})
+    new_id = jobs.submit("test", {"sheet_id": "S"})
+    jobs.work(idle_timeout=0)
+    # pylint: disable=protected-access
+    jobs._db().execute("UPDATE jobs SET finished_at = 0 WHERE id = ?", (old_id,))
+    for name in (f"{old_id}.xlsx", f"{new_id}.csv", "orphan.xml.tmp"):
+        (exports / name).write_bytes(b"x")
+
+    assert jobs.cleanup() == 1
+    assert jobs.get_job(old_id) is None
+    assert jobs.get_job(new_id)["status"] == jobs.DONE
+    assert sorted(p.name for p in exports.iterdir()) == [f"{new_id}.csv"]
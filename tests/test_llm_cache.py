@@ -0,0 +1,70 @@
+"""LLM response cache: LRU bookkeeping and async access off the event loop."""
+
+import asyncio
+import threading
+
+from services import llm_cache
+
+
+def _cache(tmp_path, **kwargs):
+    return llm_cache.LLMCache(str(tmp_path / "llm.sqlite"), **kwargs)
+
+
+def test_read_does_not_write_until_batch(tmp_path):
+    cache = _cache(tmp_path)
+    cache.put("k", "m", "answer")
+    # pylint: disable=protected-access
+    before = cache._conn.total_changes
+    assert cache.get("k") == "answer"
+    assert cache._conn.total_changes == before
+
+
+def test_eviction_keeps_recently_read_entries(tmp_path):
+    cache = _cache(tmp_path, max_entries=2)
+    cache.put("a", "m", "A")
+    cache.put("b", "m", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "m", "C")
+    assert cache.get("a") == "A"
+    assert cache.get("b") is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_expired_entry_is_a_miss(tmp_path):
+    cache = _cache(tmp_path, ttl=-1)
+    cache.put("k", "m", "answer")
+    assert cache.get("k") is None
+
+
+def test_async_calls_coalesce_and_keep_sqlite_off_the_loop(tmp_path, monkeypatch):
+    cache = _cache(tmp_path)
+    sqlite_threads = set()
+    get, put = cache.get, cache.put
+
+    def tracking_get(key):
+        sqlite_threads.add(threading.get_ident())
+        return get(key)
+
+    def tracking_put(*args):
+        sqlite_threads.add(threading.get_ident())
+        return put(*args)
+
+    monkeypatch.setattr(cache, "get", tracking_get)
+    monkeypatch.setattr(cache, "put", tracking_put)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        loop_thread = threading.get_ident()
+        answers = await asyncio.gather(*(cache.aget_or_compute("k", "m", compute) for _ in range(5)))
+        return loop_thread, answers
+
+    loop_thread, answers = asyncio.run(main())
+    assert answers == ["answer"] * 5
+    assert len(calls) == 1
+    assert loop_thread not in sqlite_threads
+    assert asyncio.run(cache.aget_any(["missing", "k"])) == "answer"
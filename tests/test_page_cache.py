@@ -0,0 +1,38 @@
+"""Page cache: canonical keys and size/age eviction."""
+
+import os
+
+from services import page_cache
+
+
+def _page(size):
+    # hex от случайных байт сжимается примерно вдвое: ~size/2 байт на запись
+    return {"status": 200, "headers": {"etag": '"v1"'}, "text": os.urandom(size // 2).hex()}
+
+
+def test_canonical_url_ignores_default_port_and_fragment():
+    assert page_cache.canonical_url("HTTPS://Example.com:443/a?x=1#top") == "https://example.com/a?x=1"
+    assert page_cache.canonical_url("http://example.com") == "http://example.com/"
+
+
+def test_prune_drops_expired_entries(tmp_path):
+    cache = page_cache.PageCache(str(tmp_path / "pages.sqlite"))
+    cache.put("https://example.com/old", _page(100))
+    cache.put("https://example.com/new", _page(100))
+    # pylint: disable=protected-access
+    cache._conn.execute("UPDATE pages SET fetched_at = 0 WHERE url = 'https://example.com/old'")
+    assert cache.prune(max_age=3600) == 1
+    assert cache.get("https://example.com/old") is None
+    assert cache.get("https://example.com/new")["etag"] == '"v1"'
+
+
+def test_prune_evicts_least_recently_validated_over_budget(tmp_path):
+    cache = page_cache.PageCache(str(tmp_path / "pages.sqlite"))
+    for i in range(10):
+        cache.put(f"https://example.com/{i}", _page(2000))
+    cache.touch("https://example.com/0")
+    removed = cache.prune(max_bytes=6000)
+    assert removed >= 5
+    assert cache.get("https://example.com/0") is not None
+    assert cache.get("https://example.com/1") is None
+    assert cache.get("https://example.com/9") is not None
@@ -0,0 +1,135 @@
+"""Project store: local copy, outbox and sync with a fake Google Sheet."""
+
+import pytest
+
+pytest.importorskip("gspread")
+pytest.importorskip("oauth2client")
+
+# pylint: disable=wrong-import-position,redefined-outer-name
+from services import project_store, sheets
+
+
+def _row(link, **cells):
+    return {**{h: "" for h in sheets.HEADERS}, "Link": link, **cells}
+
+
+class FakeSheet:
+    """In-memory spreadsheet; every write bumps the Drive revision."""
+
+    def __init__(self, rows):
+        self.rows = [dict(r) for r in rows]
+        self.version = 1
+        self.reads = 0
+        self.fail = None
+        self.during_read = None
+        self.synced = None
+
+    def revision(self, _sheet_id):
+        return f"rev-{self.version}"
+
+    def get_project_data(self, _sheet_id, columns=None):
+        self.reads += 1
+        self.synced = self.revision(None)
+        rows = [dict(r) for r in self.rows]
+        if self.during_read is not None:
+            hook, self.during_read = self.during_read, None
+            hook()
+        return rows
+
+    def add_rows(self, _sheet_id, rows):
+        if self.fail is not None:
+            raise self.fail
+        self.rows.extend(dict(r) for r in rows)
+        self.version += 1
+
+    def edit_externally(self, link, **cells):
+        next(r for r in self.rows if r["Link"] == link).update(cells)
+        self.version += 1
+
+
+@pytest.fixture
+def sheet(monkeypatch):
+    fake = FakeSheet([_row("https://a"), _row("https://b")])
+    monkeypatch.setattr(sheets, "get_revision", fake.revision)
+    monkeypatch.setattr(sheets, "synced_revision", lambda _sheet_id: fake.synced)
+    monkeypatch.setattr(sheets, "get_project_data", fake.get_project_data)
+    monkeypatch.setattr(
+        sheets, "read_project_changes", lambda sheet_id, data, columns=None: fake.get_project_data(sheet_id)
+    )
+    monkeypatch.setattr(sheets, "add_rows", fake.add_rows)
+    return fake
+
+
+@pytest.fixture
+def store(tmp_path):
+    return project_store.ProjectStore(str(tmp_path / "projects.sqlite"))
+
+
+def test_own_push_does_not_trigger_pull(sheet, store, tmp_path):
+    assert store.pull("S")
+    store.add_rows("S", [_row("https://c")])
+    assert store.push("S") == 1
+    assert [r["Link"] for r in sheet.rows] == ["https://a", "https://b", "https://c"]
+    assert not store.is_stale("S")
+    # Другой процесс с той же базой тоже не перечитывает таблицу
+    other = project_store.ProjectStore(str(tmp_path / "projects.sqlite"))
+    assert not other.is_stale("S")
+    assert sheet.reads == 1
+
+
+def test_external_edit_is_pulled(sheet, store):
+    store.pull("S")
+    sheet.edit_externally("https://b", Title="Новый")
+    assert store.is_stale("S")
+    assert store.pull("S")
+    assert store.find_by_link("S", "https://b")[1]["Title"] == "Новый"
+    assert not store.is_stale("S")
+
+
+def test_pull_does_not_apply_read_overtaken_by_a_push(sheet, store, tmp_path):
+    store.pull("S")
+    other = project_store.ProjectStore(str(tmp_path / "projects.sqlite"))
+
+    def push_from_other_process():
+        other.add_rows("S", [_row("https://c")])
+        other.push("S")
+
+    sheet.edit_externally("https://a", Title="x")
+    sheet.during_read = push_from_other_process
+    assert not store.pull("S")
+    assert store.links("S") == {"https://a", "https://b", "https://c"}
+
+
+def test_pull_waits_for_pending_changes(sheet, store):
+    store.pull("S")
+    store.add_rows("S", [_row("https://c")])
+    assert not store.pull("S")
+    assert store.pending_ops("S") == 1
+
+
+def test_transient_push_error_backs_off(sheet, store):
+    store.pull("S")
+    sheet.fail = ConnectionError("сеть недоступна")
+    store.add_rows("S", [_row("https://c")])
+    assert store.push("S") == 0
+    assert store.pending_ops("S") == 1
+    assert "сеть" in store.sync_error("S")
+    sheet.fail = None
+    # Повтор откладывается до retry_at
+    assert store.push("S") == 0
+    store._conn.execute("UPDATE sync_errors SET retry_at = 0")  # pylint: disable=protected-access
+    assert store.push("S") == 1
+    assert store.sync_error("S") is None
+
+
+def test_permanent_push_error_moves_outbox_aside_and_repulls(sheet, store):
+    store.pull("S")
+    sheet.fail = ValueError("bad row")
+    store.add_rows("S", [_row("https://c")])
+    store.add_rows("S", [_row("https://d")])
+    assert store.push("S") == 0
+    assert store.pending_ops("S") == 0
+    assert store.needs_pull("S")
+    assert "Не отправлено изменений: 2" in store.sync_error("S")
+    assert store.pull("S")
+    assert store.links("S") == {"https://a", "https://b"}
@@ -0,0 +1,162 @@
+"""Adaptive Gemini limiter: retries, AIMD concurrency and token buckets."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from services import rate_limiter
+
+# Исходная функция: фикстура ниже подменяет ее, чтобы тесты не спали
+BACKOFF_DELAY = rate_limiter.backoff_delay
+
+
+class ApiError(Exception):
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "backoff_delay", lambda attempt: 0)
+
+
+def _failing(errors, result="ok"):
+    """fn() that raises the given errors one by one, then returns result."""
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        return result
+    return fn, calls
+
+
+@pytest.mark.parametrize("exc, expected", [
+    (ApiError("boom", code=429), True),
+    (ApiError("boom", code="503"), True),
+    (RuntimeError("429 Resource has been exhausted"), True),
+    (RuntimeError("Quota exceeded for model"), True),
+    (ApiError("bad request", code=400), False),
+    (ValueError("invalid prompt"), False),
+])
+def test_is_retryable(exc, expected):
+    assert rate_limiter.is_retryable(exc) is expected
+
+
+def test_backoff_is_jittered_and_capped(monkeypatch):
+    monkeypatch.setattr(rate_limiter.random, "uniform", lambda low, high: high)
+    assert [BACKOFF_DELAY(a, base=1.0, cap=10.0) for a in range(5)] == [1, 2, 4, 8, 10]
+    monkeypatch.setattr(rate_limiter.random, "uniform", lambda low, high: low)
+    assert BACKOFF_DELAY(3) == 0
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = rate_limiter.TokenBucket(60)  # 1 ед. в секунду
+    now = bucket.updated
+    assert bucket.wait_time(60, now) == 0
+    bucket.take(60)
+    assert bucket.wait_time(1, now) == pytest.approx(1.0)
+    assert bucket.wait_time(1, now + 1.0) == 0
+    # Запрос больше емкости ждет заполнения всего ведра, а не вечно
+    bucket.take(1)
+    assert bucket.wait_time(1000, now + 1.0) == pytest.approx(60.0)
+
+
+def test_call_retries_throttled_errors():
+    limiter = rate_limiter.AdaptiveLimiter(max_concurrency=8)
+    fn, calls = _failing([ApiError("rate limit", code=429), RuntimeError("503 unavailable")])
+    assert limiter.call(fn) == "ok"
+    assert len(calls) == 3
+    stats = limiter.stats()
+    assert stats["active"] == 0
+    assert stats["requests"] == 3
+    assert stats["throttled"] == 2
+    # Каждый 429 вдвое сужает окно: 4 -> 2 -> 1
+    assert stats["concurrency"] == 1
+
+
+def test_call_raises_non_retryable_at_once():
+    limiter = rate_limiter.AdaptiveLimiter()
+    fn, calls = _failing([ValueError("invalid prompt")])
+    with pytest.raises(ValueError):
+        limiter.call(fn)
+    assert len(calls) == 1
+    assert limiter.active == 0
+    assert limiter.throttled == 0
+
+
+def test_call_gives_up_after_max_retries():
+    limiter = rate_limiter.AdaptiveLimiter(max_retries=2)
+    fn, calls = _failing([ApiError("429", code=429) for _ in range(5)])
+    with pytest.raises(ApiError):
+        limiter.call(fn)
+    assert len(calls) == 3
+    assert limiter.active == 0
+
+
+def test_limit_recovers_while_calls_succeed():
+    limiter = rate_limiter.AdaptiveLimiter(max_concurrency=8)
+    limiter.limit = 1.0
+    for _ in range(20):
+        limiter.call(lambda: None)
+    assert limiter.limit > 1.0
+    assert limiter.limit <= 8
+
+
+def test_concurrency_never_exceeds_limit():
+    limiter = rate_limiter.AdaptiveLimiter(max_concurrency=2)
+    limiter.limit = 2.0
+    peak = []
+    lock = threading.Lock()
+
+    def fn():
+        with lock:
+            peak.append(limiter.active)
+        time.sleep(0.1)
+
+    threads = [threading.Thread(target=limiter.call, args=(fn,)) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert len(peak) == 5
+    assert max(peak) == 2
+    assert limiter.active == 0
+
+
+def test_acall_retries_and_releases_slot_on_cancel():
+    limiter = rate_limiter.AdaptiveLimiter()
+
+    async def scenario():
+        attempts = []
+
+        async def flaky():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise ApiError("overloaded", code=503)
+            return "ok"
+
+        assert await limiter.acall(flaky) == "ok"
+        assert len(attempts) == 2
+
+        started = asyncio.Event()
+
+        async def hang():
+            started.set()
+            await asyncio.sleep(60)
+
+        task = asyncio.ensure_future(limiter.acall(hang))
+        await started.wait()
+        assert limiter.active == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert limiter.active == 0
+    # Отмена - не троттлинг: окно не сужается
+    assert limiter.throttled == 1
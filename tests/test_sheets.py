@@ -0,0 +1,203 @@
+"""Sheets reads, diff saves and buffered writes against an in-memory worksheet."""
+
+import time
+
+import pytest
+
+pytest.importorskip("gspread")
+pytest.importorskip("oauth2client")
+
+# pylint: disable=wrong-import-position,redefined-outer-name,protected-access
+from gspread.utils import a1_to_rowcol
+
+from services import sheets
+
+
+class FakeSpreadsheet:
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.version = 1
+
+    def get_lastUpdateTime(self):  # pylint: disable=invalid-name
+        return f"rev-{self.version}"
+
+    def batch_update(self, body):
+        for request in body["requests"]:
+            kind, spec = next(iter(request.items()))
+            start, end = spec["range"]["startIndex"], spec["range"]["endIndex"]
+            if kind == "deleteDimension":
+                del self.worksheet.cells[start:end]
+            else:
+                self.worksheet.cells[start:start] = [[] for _ in range(end - start)]
+        self.version += 1
+
+
+class FakeWorksheet:
+    """Grid of strings (row 0 is the header) with the gspread calls the service uses."""
+
+    id = 0
+
+    def __init__(self, rows):
+        self.cells = [list(sheets.HEADERS)] + [[row.get(h, "") for h in sheets.HEADERS] for row in rows]
+        self.spreadsheet = FakeSpreadsheet(self)
+        self.ranges_read = []
+
+    def row_values(self, row):
+        return list(self.cells[row - 1])
+
+    def col_values(self, col):
+        return [r[col - 1] if col - 1 < len(r) else "" for r in self.cells]
+
+    def _get(self, a1_range):
+        first, last = a1_range.split(":") if ":" in a1_range else (a1_range, a1_range)
+        (r1, c1), (r2, c2) = a1_to_rowcol(first), a1_to_rowcol(last)
+        values = []
+        for r in range(r1, min(r2, len(self.cells)) + 1):
+            row = self.cells[r - 1]
+            values.append([row[c - 1] if c - 1 < len(row) else "" for c in range(c1, c2 + 1)])
+        # Как API: без пустых строк и ячеек в конце
+        values = [v[:max((i + 1 for i, x in enumerate(v) if x != ""), default=0)] for v in values]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def batch_get(self, ranges):
+        self.ranges_read.extend(ranges)
+        return [self._get(r) for r in ranges]
+
+    def batch_update(self, data):
+        for entry in data:
+            r, c = a1_to_rowcol(entry["range"])
+            for dr, values in enumerate(entry["values"]):
+                row = self.cells[r - 1 + dr]
+                row.extend([""] * (c - 1 + len(values) - len(row)))
+                row[c - 1:c - 1 + len(values)] = values
+        self.spreadsheet.version += 1
+
+    def records(self):
+        return [dict(zip(sheets.HEADERS, row + [""] * (len(sheets.HEADERS) - len(row)))) for row in self.cells[1:]]
+
+
+def _row(link, **cells):
+    return {**{h: "" for h in sheets.HEADERS}, "Link": link, **cells}
+
+
+@pytest.fixture
+def worksheet(monkeypatch):
+    ws = FakeWorksheet([
+        _row("https://a", Title="A", Keywords="12", Text="текст a"),
+        _row("https://b", Title="B", Keywords="1.5", Text="текст b"),
+        _row("https://c", Title="C", Text="текст c"),
+    ])
+    monkeypatch.setitem(sheets._worksheets, "S", {"worksheet": ws, "headers": None})
+    return ws
+
+
+def test_get_project_data_numericises_like_get_all_records(worksheet):
+    rows = sheets.get_project_data("S", page_size=2)
+    assert [r["Keywords"] for r in rows] == [12, 1.5, ""]
+    assert rows[0]["Text"] == "текст a"
+    assert not sheets.is_modified("S")
+
+
+def test_column_projection_skips_text(worksheet):
+    rows = sheets.get_project_data("S", columns=sheets.LIST_COLUMNS)
+    assert all("Text" not in row for row in rows)
+
+
+def test_refresh_reads_text_only_for_changed_rows(worksheet):
+    data = sheets.get_project_data("S")
+    assert sheets.refresh_project_data("S", data) == (data, False)
+
+    worksheet.cells[2][1] = "B2"
+    worksheet.cells[2][6] = "новый текст b"
+    worksheet.cells.append(["", "D", "https://d", "", "", "", "текст d"])
+    worksheet.spreadsheet.version += 1
+    worksheet.ranges_read.clear()
+
+    rows, changed = sheets.refresh_project_data("S", data)
+    assert changed
+    assert [(r["Title"], r["Text"]) for r in rows] == [
+        ("A", "текст a"), ("B2", "новый текст b"), ("C", "текст c"), ("D", "текст d"),
+    ]
+    text_reads = [r for r in worksheet.ranges_read if r.startswith("G")]
+    assert text_reads == ["G3:G3", "G5:G5"]
+
+
+def test_save_project_changes_sends_only_the_diff(worksheet):
+    old = sheets.get_project_data("S")
+    new = [dict(r) for r in old]
+    new[1]["Title"] = "B (правка)"
+    del new[2]
+    new.insert(0, _row("https://z", Title="Z"))
+    summary = sheets.save_project_changes("S", old, new)
+    assert summary == {"updated": 1, "inserted": 1, "deleted": 1, "replaced": False}
+    assert [(r["Link"], r["Title"]) for r in worksheet.records()] == [
+        ("https://z", "Z"), ("https://a", "A"), ("https://b", "B (правка)"),
+    ]
+
+
+def test_save_project_changes_keeps_unloaded_texts(worksheet):
+    old = sheets.get_project_data("S", columns=sheets.LIST_COLUMNS)
+    new = [dict(r) for r in old]
+    new[0]["Title"] = "A2"
+    sheets.save_project_changes("S", old, new)
+    assert [r["Text"] for r in worksheet.records()] == ["текст a", "текст b", "текст c"]
+
+
+class FlakyWorksheet(FakeWorksheet):
+    """batch_update fails the given number of times."""
+
+    def __init__(self, rows, failures):
+        super().__init__(rows)
+        self.failures = failures
+
+    def batch_update(self, data):
+        if self.failures:
+            self.failures -= 1
+            raise ValueError("запись отклонена")
+        super().batch_update(data)
+
+
+def _writer_sheet(monkeypatch, failures):
+    ws = FlakyWorksheet([_row("https://a"), _row("https://b")], failures)
+    monkeypatch.setitem(sheets._worksheets, "W", {"worksheet": ws, "headers": list(sheets.HEADERS)})
+    return ws
+
+
+def test_sheet_writer_merges_row_updates(monkeypatch):
+    ws = _writer_sheet(monkeypatch, failures=0)
+    with sheets.SheetWriter("W", max_rows=10, max_delay=3600) as writer:
+        writer.update_row(1, {"Title": "B"})
+        writer.update_row(1, {"Text": "текст"})
+    assert writer.written_rows == 1
+    assert (ws.records()[1]["Title"], ws.records()[1]["Text"]) == ("B", "текст")
+
+
+def test_failed_background_write_is_raised_on_close(monkeypatch):
+    _writer_sheet(monkeypatch, failures=100)
+    writer = sheets.SheetWriter("W", max_rows=10, max_delay=0.05)
+    writer.update_row(0, {"Title": "A"})
+    time.sleep(0.3)
+    with pytest.raises(ValueError):
+        writer.close()
+
+
+def test_background_failure_recovered_by_close(monkeypatch):
+    ws = _writer_sheet(monkeypatch, failures=1)
+    writer = sheets.SheetWriter("W", max_rows=10, max_delay=0.05)
+    writer.update_row(0, {"Title": "A"})
+    time.sleep(0.3)
+    writer.close()
+    assert ws.records()[0]["Title"] == "A"
+
+
+def test_failed_background_write_is_reported_to_the_next_update(monkeypatch):
+    _writer_sheet(monkeypatch, failures=100)
+    writer = sheets.SheetWriter("W", max_rows=10, max_delay=0.05)
+    writer.update_row(0, {"Title": "A"})
+    time.sleep(0.3)
+    with pytest.raises(ValueError):
+        writer.update_row(1, {"Title": "B"})
+    _writer_sheet(monkeypatch, failures=0)
+    writer.close()
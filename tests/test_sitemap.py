@@ -0,0 +1,110 @@
+"""Streaming sitemap reader: indexes, gzip, lastmod filtering and errors."""
+
+import gzip
+import io
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("bs4")
+
+from services import sitemap  # noqa: E402  # pylint: disable=wrong-import-position
+
+NS = 'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"'
+
+
+def _urlset(*entries):
+    body = "".join(
+        f"<url><loc>{loc}</loc>" + (f"<lastmod>{lastmod}</lastmod>" if lastmod else "") + "</url>"
+        for loc, lastmod in entries
+    )
+    return f'<?xml version="1.0" encoding="UTF-8"?><urlset {NS}>{body}</urlset>'.encode()
+
+
+def _index(*entries):
+    body = "".join(
+        f"<sitemap><loc>{loc}</loc>" + (f"<lastmod>{lastmod}</lastmod>" if lastmod else "") + "</sitemap>"
+        for loc, lastmod in entries
+    )
+    return f'<?xml version="1.0" encoding="UTF-8"?><sitemapindex {NS}>{body}</sitemapindex>'.encode()
+
+
+def test_parse_lastmod_formats():
+    assert sitemap.parse_lastmod("2024-03-01") == datetime(2024, 3, 1, tzinfo=timezone.utc)
+    assert sitemap.parse_lastmod("2024-03-01T10:00:00Z") == datetime(2024, 3, 1, 10, tzinfo=timezone.utc)
+    assert sitemap.parse_lastmod("вчера") is None
+    assert sitemap.parse_lastmod("") is None
+
+
+def test_parse_entries_reads_plain_and_gzip_spools(monkeypatch):
+    # Маленький буфер чтения, чтобы записи разрезались между кусками
+    monkeypatch.setattr(sitemap, "_READ_CHUNK", 16)
+    data = _urlset(("https://example.com/a", "2024-01-01"), ("https://example.com/b", None))
+    expected = [
+        ("url", "https://example.com/a", "2024-01-01"),
+        ("url", "https://example.com/b", None),
+    ]
+    assert list(sitemap._parse_entries(io.BytesIO(data))) == expected  # pylint: disable=protected-access
+    assert list(sitemap._parse_entries(io.BytesIO(gzip.compress(data)))) == expected  # pylint: disable=protected-access
+
+
+def test_index_children_are_followed(site):
+    site.pages.update({
+        "/sitemap.xml": _index(
+            ("https://example.com/pages.xml", None),
+            ("https://example.com/posts.xml.gz", None),
+        ),
+        "/pages.xml": _urlset(("https://example.com/a", None), ("https://other.com/x", None)),
+        "/posts.xml.gz": gzip.compress(_urlset(("https://example.com/post#comments", None))),
+    })
+    urls = [url for url, _ in sitemap.iter_sitemap_urls("https://example.com/sitemap.xml")]
+    assert urls == ["https://example.com/a", "https://example.com/post"]
+
+
+def test_modified_since_skips_old_urls_and_child_sitemaps(site):
+    site.pages.update({
+        "/sitemap.xml": _index(
+            ("https://example.com/old.xml", "2023-01-01"),
+            ("https://example.com/new.xml", "2024-06-01"),
+        ),
+        "/new.xml": _urlset(
+            ("https://example.com/fresh", "2024-06-01"),
+            ("https://example.com/stale", "2023-12-31"),
+            ("https://example.com/undated", None),
+        ),
+    })
+    since = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    urls = [url for url, _ in sitemap.iter_sitemap_urls("https://example.com/sitemap.xml", since)]
+    assert urls == ["https://example.com/fresh", "https://example.com/undated"]
+    # Устаревший дочерний sitemap даже не скачивается
+    assert "https://example.com/old.xml" not in site.requests
+
+
+def test_sitemaps_are_discovered_through_robots(site):
+    site.pages.update({
+        "/robots.txt": (200, b"User-agent: *\nSitemap: /custom-sitemap.xml\n"),
+        "/custom-sitemap.xml": _urlset(("https://example.com/a", None)),
+    })
+    urls = [url for url, _ in sitemap.iter_sitemap_urls("https://example.com/catalog/")]
+    assert urls == ["https://example.com/a"]
+
+
+def test_broken_child_is_reported_after_the_rest(site):
+    site.pages.update({
+        "/sitemap.xml": _index(
+            ("https://example.com/missing.xml", None),
+            ("https://example.com/broken.xml", None),
+            ("https://example.com/ok.xml", None),
+        ),
+        "/broken.xml": b"<urlset><url><loc>https://example.com/b",
+        "/ok.xml": _urlset(("https://example.com/a", None)),
+    })
+    urls = []
+    with pytest.raises(sitemap.SitemapError) as info:
+        for url, _ in sitemap.iter_sitemap_urls("https://example.com/sitemap.xml"):
+            urls.append(url)
+    assert urls == ["https://example.com/a"]
+    errors = info.value.errors
+    assert len(errors) == 2
+    assert errors[0].startswith("https://example.com/missing.xml: ")
+    assert errors[1].startswith("https://example.com/broken.xml: ")